@@ -40,6 +40,6 @@ class BookingAdmin(admin.ModelAdmin):
 @admin.register(Ticket)
 class TicketAdmin(admin.ModelAdmin):
     """ To see who is sitting where """
-    list_display = ("id", "booking", "seat")
+    list_display = ("id", "booking", "showtime", "seat")
     search_fields = ("booking__id", )
 
@@ -0,0 +1,50 @@
+# "Best available" seats: the customer only sends a quantity, we pick the best block of adjacent seats in 1 row
+# Pure in-memory work (no DB, no Redis): the service gives it the hall grid + the 2 bitmaps, then locks the block it suggests
+
+from .locks import seat_index, is_set
+
+
+class SeatGrid:
+    """
+    Free seats of one showtime, stored as 1 int per row (bit c set = seat in column c+1 is free).
+    Finding every run of `n` adjacent free seats is then a few shifts/ANDs per row, instead of looping seat by seat
+    """
+    def __init__(self, hall, seats, sold_bitmap: bytes | None, held_bitmap: bytes | None):
+        self.hall = hall
+        self.rows = [0] * hall.seats_per_row
+        self.seats = {} # (row, column) -> Seat, to turn a block back into Seat rows
+
+        for seat in seats:
+            r, c = ord(seat.row_label) - ord("A"), seat.column_number - 1
+            self.seats[(r, c)] = seat
+            index = seat_index(seat, hall)
+            if not seat.is_broken and not is_set(sold_bitmap, index) and not is_set(held_bitmap, index):
+                self.rows[r] |= 1 << c
+
+    def take(self, seats):
+        """ Mark seats as not free anymore (ex: someone locked them between our snapshot and our lock) """
+        for seat in seats:
+            self.rows[ord(seat.row_label) - ord("A")] &= ~(1 << (seat.column_number - 1))
+
+    def best_block(self, quantity: int):
+        """ The free block of `quantity` adjacent seats closest to the centre of the hall, or None if there is none """
+        mid_row = (self.hall.seats_per_row - 1) / 2
+        mid_column = (self.hall.seats_per_column - 1) / 2
+        best, best_score = None, None
+
+        for r, free in enumerate(self.rows):
+            starts = free
+            for _ in range(quantity - 1):
+                starts &= starts >> 1 # bit c survives only if columns c .. c+quantity-1 are all free
+
+            while starts:
+                c = (starts & -starts).bit_length() - 1 # lowest set bit
+                starts &= starts - 1
+                score = abs(r - mid_row) + abs(c + (quantity - 1) / 2 - mid_column) # distance of the block's middle to the centre
+                if best_score is None or score < best_score:
+                    best, best_score = (r, c), score
+
+        if best is None:
+            return None
+        r, c = best
+        return [self.seats[(r, c + i)] for i in range(quantity)]
@@ -0,0 +1,186 @@
+# Live seat map: the lock/sale scripts PUBLISH every seat change of a showtime ("version|position:letter,...", see locks.py),
+# and each process keeps ONE Redis subscription (PSUBSCRIBE on every showtime feed) that it fans out to its own SSE clients.
+# A client is just a small asyncio.Queue, so thousands of idle clients cost a few KB each and no Redis connection at all.
+
+import asyncio
+import json
+import logging
+import time
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+
+from screening.models import Seat
+from screening.services import ScreeningAnalytic
+from .locks import SeatLock, SeatMap, get_async_redis_connection
+
+RESET = None # put in a queue instead of a change: the client fell behind (or Redis dropped us), send it a fresh map
+
+_feeds = weakref.WeakKeyDictionary() # 1 hub per event loop, like the async Redis clients
+
+logger = logging.getLogger(__name__)
+
+
+def parse_message(data: bytes):
+    """ "12|3:Y,4:Y" -> (12, [[3, "Y"], [4, "Y"]]) """
+    version, _, changes = data.decode().partition("|")
+    return int(version), [[int(position), letter] for position, _, letter in (change.partition(":") for change in changes.split(","))]
+
+
+class SeatFeed:
+    """ The subscribers of this process, by showtime, and the 2 background tasks that serve them (listen + expired holds sweep) """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set) # showtime_id -> {queue, ...}
+        self.showtimes = {} # showtime_id -> showtime (with its hall), for the sweep
+        self.ready = asyncio.Event() # set once Redis confirmed the PSUBSCRIBE: nothing published after that can be missed
+        self.resync = False # changes may have been missed (Redis was down/slow): every client gets a full map once the feed is back
+        self.tasks = []
+
+    @staticmethod
+    def get():
+        loop = asyncio.get_running_loop()
+        if loop not in _feeds:
+            _feeds[loop] = SeatFeed()
+        return _feeds[loop]
+
+    async def subscribe(self, showtime):
+        """ A queue of (version, changes) for this showtime. Returns once the feed is live, so read the map AFTER this call """
+        queue = asyncio.Queue(maxsize=settings.SEAT_FEED_QUEUE_SIZE)
+        self.subscribers[showtime.id].add(queue)
+        self.showtimes[showtime.id] = showtime
+        if not self.tasks:
+            self.ready.clear()
+            self.tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._sweep())]
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=settings.SEAT_FEED_READY_TIMEOUT)
+        except TimeoutError:
+            self.resync = True # don't hang the client: it starts from the map now, and gets a fresh one when the feed is live
+        return queue
+
+    def unsubscribe(self, showtime_id: int, queue):
+        self.subscribers[showtime_id].discard(queue)
+        if not self.subscribers[showtime_id]:
+            del self.subscribers[showtime_id]
+            del self.showtimes[showtime_id]
+        if not self.subscribers: # last client gone: drop the Redis subscription too
+            for task in self.tasks:
+                task.cancel()
+            self.tasks = []
+
+    def publish(self, showtime_id: int, message):
+        for queue in self.subscribers.get(showtime_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull: # slow client: its pending changes are useless now, it gets a full map instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET)
+
+    async def _listen(self):
+        pattern = SeatMap.feed_channel("*")
+        backoff = 1
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_async_redis_connection().pubsub()
+                await pubsub.psubscribe(pattern)
+                async for message in pubsub.listen():
+                    if message["type"] == "psubscribe":
+                        if self.resync:
+                            self.resync = False
+                            for showtime_id in list(self.subscribers):
+                                self.publish(showtime_id, RESET)
+                        self.ready.set()
+                        backoff = 1
+                    elif message["type"] == "pmessage":
+                        self._dispatch(message)
+            except Exception:
+                # whatever broke (connection, timeout, ...), this task must live on or every client stops hearing changes.
+                # What was published meanwhile is gone, so every client starts over from a full map once we are back
+                logger.exception("Seat feed subscription failed, retrying in %ss", backoff)
+                self.ready.clear()
+                self.resync = True
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass # the connection is already broken, nothing left to close cleanly
+
+    def _dispatch(self, message):
+        try:
+            showtime_id = int(message["channel"].rsplit(b":", 1)[1])
+        except ValueError:
+            logger.warning("Seat feed message on an unexpected channel: %r", message["channel"])
+            return
+        if showtime_id not in self.subscribers:
+            return
+        try:
+            self.publish(showtime_id, parse_message(message["data"]))
+        except ValueError:
+            logger.warning("Bad seat feed message for showtime %s: %r", showtime_id, message["data"])
+            self.publish(showtime_id, RESET) # the change is unreadable, the map is not
+
+    async def _sweep(self):
+        """
+        A lock that expires by itself publishes nothing (Redis just drops the key), so every few seconds the holds whose deadline
+        passed are released here. Only the showtimes someone watches, and only 1 HGETALL each when no hold expired
+        """
+        while True:
+            await asyncio.sleep(settings.SEAT_FEED_SWEEP)
+            for showtime in list(self.showtimes.values()):
+                try:
+                    _, holds = await SeatMap.aholds(showtime)
+                    now = time.time()
+                    expired = [seat_id for seat_id, (_, deadline) in holds.items() if deadline <= now]
+                    if expired:
+                        seats = [seat async for seat in Seat.objects.filter(id__in=expired, hall_id=showtime.hall_id)]
+                        await SeatLock.aprune(showtime, seats) # RELEASE_SCRIPT publishes the seats that really went back to free
+                except Exception:
+                    logger.exception("Seat feed sweep failed for showtime %s, retrying on the next sweep", showtime.id)
+
+
+def sse(event: str, data, event_id=None):
+    """ 1 Server-Sent Event (the `id` is what the browser sends back as Last-Event-ID when it reconnects) """
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def seat_events(showtime, since: int | None = None):
+    """
+    The SSE body of a showtime: first the map (or only what changed since `since`), then every change as it happens.
+    Same payloads as the polled seat map, so 1 client code applies both. A gap in the versions (the map was rebuilt, ...)
+    is filled with a delta read from Redis, so a client never ends up with a wrong seat
+    """
+    feed = SeatFeed.get()
+    queue = await feed.subscribe(showtime) # before reading the map: a change made in between is in the queue, not lost
+    try:
+        seat_map = await ScreeningAnalytic.acompact_seat_map(showtime, since)
+        version = seat_map["version"]
+        yield sse("seats", seat_map, version)
+
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=settings.SEAT_FEED_KEEPALIVE)
+            except TimeoutError:
+                yield ": keepalive\n\n" # a comment, so the proxies don't close an idle stream
+                continue
+
+            if message is RESET:
+                seat_map = await ScreeningAnalytic.acompact_seat_map(showtime)
+            else:
+                new_version, changes = message
+                if new_version <= version:
+                    continue # already in the map we sent
+                if new_version == version + 1:
+                    seat_map = {"version": new_version, "since": version, "changes": changes}
+                else:
+                    seat_map = await ScreeningAnalytic.acompact_seat_map(showtime, version)
+            version = seat_map["version"]
+            yield sse("seats", seat_map, version)
+    finally:
+        feed.unsubscribe(showtime.id, queue) # client gone (the ASGI server cancels us)
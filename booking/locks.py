@@ -0,0 +1,578 @@
+# Redis side of the booking domain (the "waiting room" that replaced the old SeatLock table)
+# Every seat hold lives in Redis as `lock:{showtime_id}:{seat_id}` -> user_id, with a 10 minutes timeout
+# Next to the locks, every showtime has 2 bitmaps (1 bit per seat): which seats are SOLD and which are HELD
+
+import asyncio
+import math
+import time
+import uuid
+import weakref
+
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from .models import Booking, Ticket
+
+HOLD_TIMEOUT = 600 # seconds (10 mins) a customer has to finish the payment
+
+_async_clients = weakref.WeakKeyDictionary() # 1 client per event loop (a redis.asyncio connection can't be shared between loops)
+
+
+def get_async_redis_connection():
+    """ Async twin of django_redis' get_redis_connection, for the async views (same server and db as the "default" cache) """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = redis.asyncio.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+    return _async_clients[loop]
+
+
+# Lua runs inside Redis as ONE command, so nobody can sneak in between our "check" and our "set"
+# KEYS[1] = held bitmap, KEYS[2] = hold index (hash seat_id -> "user_id:deadline"), KEYS[3] = seat map version, KEYS[4] = changed seats
+# (zset bit position -> version of its last change), KEYS[5] = sold bitmap, KEYS[6..] = lock keys of every selected seat
+# ARGV[1] = user_id, ARGV[2] = timeout, ARGV[3] = deadline (unix seconds), then the bit position of every selected seat, then their seat ids
+# (same order as the lock keys), and last the seat feed channel
+# Every change is also PUBLISHed on the feed as "version|position:letter,position:letter" (letters of the compact seat map)
+# Returns a flat list [position, holder, position, holder, ...] of the seats that are already taken (empty list = we got all of them)
+ACQUIRE_SCRIPT = """
+local n = #KEYS - 5
+local conflicts = {}
+for i = 1, n do
+    local holder = redis.call('GET', KEYS[i + 5])
+    if holder then
+        table.insert(conflicts, i)
+        table.insert(conflicts, holder)
+    end
+end
+if #conflicts > 0 then
+    return conflicts
+end
+local version = redis.call('INCR', KEYS[3])
+local changed = {}
+for i = 1, n do
+    redis.call('SET', KEYS[i + 5], ARGV[1], 'EX', ARGV[2])
+    redis.call('SETBIT', KEYS[1], ARGV[i + 3], 1)
+    redis.call('HSET', KEYS[2], ARGV[i + 3 + n], ARGV[1] .. ':' .. ARGV[3])
+    redis.call('ZADD', KEYS[4], version, ARGV[i + 3])
+    table.insert(changed, ARGV[i + 3] .. ':Y')
+end
+if redis.call('TTL', KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[2], ARGV[2]) -- the index goes away by itself once its last hold is over
+end
+redis.call('PUBLISH', ARGV[#ARGV], version .. '|' .. table.concat(changed, ','))
+return conflicts
+"""
+
+# Only delete a lock if it still belongs to the given user (the lock might already expired and be taken by someone else)
+# The held bit and the index entry are cleared once nobody holds the seat anymore (and only a real change bumps the version)
+# KEYS same shape as above, ARGV[1] = user_id ('' means any user), then the bit positions, then the seat ids, then the feed channel
+RELEASE_SCRIPT = """
+local n = #KEYS - 5
+local released = 0
+local version = nil
+local changed = {}
+for i = 1, n do
+    if ARGV[1] == '' or redis.call('GET', KEYS[i + 5]) == ARGV[1] then
+        released = released + redis.call('DEL', KEYS[i + 5])
+    end
+    if redis.call('EXISTS', KEYS[i + 5]) == 0 then
+        if redis.call('SETBIT', KEYS[1], ARGV[i + 1], 0) == 1 then
+            version = version or redis.call('INCR', KEYS[3])
+            redis.call('ZADD', KEYS[4], version, ARGV[i + 1])
+            table.insert(changed, ARGV[i + 1] .. (redis.call('GETBIT', KEYS[5], ARGV[i + 1]) == 1 and ':R' or ':G')) -- paid (confirm) or free again
+        end
+        redis.call('HDEL', KEYS[2], ARGV[i + 1 + n])
+    end
+end
+if version then
+    redis.call('PUBLISH', ARGV[#ARGV], version .. '|' .. table.concat(changed, ','))
+end
+return released
+"""
+
+# Sold/unsold (or any other change of the given seats, ex: a seat breaks) + version bump + feed, in 1 step
+# KEYS[1] = sold bitmap, KEYS[2] = held bitmap, KEYS[3] = seat map version, KEYS[4] = changed seats
+# ARGV[1] = new sold bit ('' = leave the bitmap alone), ARGV[2] = letter to publish ('' = read it from the bitmaps), ARGV[3] = feed channel,
+# ARGV[4..] = positions
+CHANGE_SCRIPT = """
+local version = nil
+local changed = {}
+for i = 4, #ARGV do
+    if ARGV[1] == '' or redis.call('SETBIT', KEYS[1], ARGV[i], ARGV[1]) ~= tonumber(ARGV[1]) then
+        version = version or redis.call('INCR', KEYS[3])
+        redis.call('ZADD', KEYS[4], version, ARGV[i])
+        local letter = ARGV[2]
+        if letter == '' then
+            letter = redis.call('GETBIT', KEYS[1], ARGV[i]) == 1 and 'R' or (redis.call('GETBIT', KEYS[2], ARGV[i]) == 1 and 'Y' or 'G')
+        end
+        table.insert(changed, ARGV[i] .. ':' .. letter)
+    end
+end
+if version then
+    redis.call('PUBLISH', ARGV[3], version .. '|' .. table.concat(changed, ','))
+end
+return version
+"""
+
+# A new history starts (map (re)built from Postgres): the version moves forward, to at least now (ms) so it never goes back even if Redis lost it,
+# and becomes the "base": nothing older can be answered with a delta anymore
+# KEYS[1] = version, KEYS[2] = base, KEYS[3] = changed seats ; ARGV[1] = now in ms
+RESET_SCRIPT = """
+local version = math.max(tonumber(redis.call('GET', KEYS[1]) or '0') + 1, tonumber(ARGV[1]))
+redis.call('SET', KEYS[1], version)
+redis.call('SET', KEYS[2], version)
+redis.call('DEL', KEYS[3])
+return version
+"""
+
+NOBODY = "-" # never matches a user_id, so RELEASE_SCRIPT only cleans bits of seats whose lock already expired
+
+
+def seat_index(seat, hall):
+    """ Position of a seat inside the hall grid (row-major): A1=0, A2=1, ... B1=seats_per_column, ... """
+    return (ord(seat.row_label) - ord("A")) * hall.seats_per_column + seat.column_number - 1
+
+
+def is_set(bitmap: bytes | None, index: int):
+    """ Read 1 bit from a bitmap we already downloaded (Redis bit 0 is the highest bit of the first byte) """
+    if not bitmap or (index >> 3) >= len(bitmap):
+        return False
+    return bool((bitmap[index >> 3] >> (7 - (index & 7))) & 1)
+
+
+class SeatLock:
+    @staticmethod
+    def key(showtime_id: int, seat_id: int):
+        # "Name Tag" for the specific seat and showtime ; make_key adds the same prefix `cache.get/set` uses, so both ways see the same lock
+        return cache.make_key(f"lock:{showtime_id}:{seat_id}")
+
+    @staticmethod
+    def _script_args(showtime, seats):
+        """ KEYS (held bitmap, hold index, version, changes, sold bitmap, 1 lock per seat) and the per-seat ARGV (bit positions, then seat ids) of the 2 scripts """
+        keys = SeatMap.lock_keys(showtime.id) + [SeatLock.key(showtime.id, seat.id) for seat in seats]
+        return keys, [seat_index(seat, showtime.hall) for seat in seats] + [seat.id for seat in seats]
+
+    @staticmethod
+    def acquire(showtime, seats, user_id: int, timeout: int = HOLD_TIMEOUT):
+        """ Hold every seat in one atomic step (all-or-nothing). Returns {seat_id: holder_user_id} of conflicted seats, empty dict means success """
+        if not seats:
+            return {}
+
+        con = get_redis_connection("default")
+        keys, seat_args = SeatLock._script_args(showtime, seats)
+        result = con.eval(ACQUIRE_SCRIPT, len(keys), *keys, user_id, timeout, math.ceil(time.time()) + timeout, *seat_args, SeatMap.feed_channel(showtime.id))
+
+        # Lua list is 1-based, so shift back to our python list
+        return {
+            seats[int(result[i]) - 1].id: int(result[i + 1])
+            for i in range(0, len(result), 2)
+        }
+
+    @staticmethod
+    async def aacquire(showtime, seats, user_id: int, timeout: int = HOLD_TIMEOUT):
+        """ Same as acquire(), but doesn't block the event loop while Redis answers """
+        if not seats:
+            return {}
+
+        con = get_async_redis_connection()
+        keys, seat_args = SeatLock._script_args(showtime, seats)
+        result = await con.eval(ACQUIRE_SCRIPT, len(keys), *keys, user_id, timeout, math.ceil(time.time()) + timeout, *seat_args, SeatMap.feed_channel(showtime.id))
+        return {
+            seats[int(result[i]) - 1].id: int(result[i + 1])
+            for i in range(0, len(result), 2)
+        }
+
+    @staticmethod
+    def holders(showtime_id: int, seat_ids: list[int]):
+        """ Who is holding these seats right now --one MGET instead of a GET per seat. Returns {seat_id: user_id or None} """
+        if not seat_ids:
+            return {}
+
+        con = get_redis_connection("default")
+        values = con.mget([SeatLock.key(showtime_id, s_id) for s_id in seat_ids])
+        return {s_id: int(v) if v is not None else None for s_id, v in zip(seat_ids, values)}
+
+    @staticmethod
+    def release(showtime, seats, user_id: int | str | None = None):
+        """ Free the seats. If user_id is given, only locks owned by that user are removed """
+        if not seats:
+            return 0
+
+        con = get_redis_connection("default")
+        keys, seat_args = SeatLock._script_args(showtime, seats)
+        return con.eval(RELEASE_SCRIPT, len(keys), *keys, user_id if user_id is not None else "", *seat_args, SeatMap.feed_channel(showtime.id))
+
+    @staticmethod
+    def prune(showtime, seats):
+        """ Clear the held bit of seats whose lock already expired by itself (no lock is deleted here) """
+        return SeatLock.release(showtime, seats, user_id=NOBODY)
+
+    @staticmethod
+    async def aprune(showtime, seats):
+        if not seats:
+            return 0
+
+        keys, seat_args = SeatLock._script_args(showtime, seats)
+        return await get_async_redis_connection().eval(RELEASE_SCRIPT, len(keys), *keys, NOBODY, *seat_args, SeatMap.feed_channel(showtime.id))
+
+
+
+class SeatMap:
+    """
+    Per-showtime bitmaps, so asking "is this seat free?" is a Redis read instead of joining Ticket, booking_seats and the locks.
+    - sold bitmap: 1 = a Ticket exists. The extra bit right after the last seat says "this bitmap is already built from the DB"
+    - held bitmap: 1 = someone holds the seat in Redis (kept in sync by the SeatLock scripts)
+    - hold index: hash seat_id -> "user_id:deadline" of the same holds, so a seat map reads every hold with 1 HGETALL
+      instead of a GET per lock key (and never a KEYS scan over the whole Redis)
+    - version: bumped by every hold, release, sale, refund or broken seat, with the bit position of each changed seat in a zset
+      scored by the version of its last change, so a polling client asks "what changed since N?" and gets only those seats
+    """
+    @staticmethod
+    def sold_key(showtime_id: int):
+        return cache.make_key(f"seats:sold:{showtime_id}")
+
+    @staticmethod
+    def held_key(showtime_id: int):
+        return cache.make_key(f"seats:held:{showtime_id}")
+
+    @staticmethod
+    def holds_key(showtime_id: int):
+        return cache.make_key(f"seats:holds:{showtime_id}")
+
+    @staticmethod
+    def version_key(showtime_id: int):
+        return cache.make_key(f"seats:version:{showtime_id}")
+
+    @staticmethod
+    def base_key(showtime_id: int):
+        return cache.make_key(f"seats:base:{showtime_id}") # oldest version a delta can start from
+
+    @staticmethod
+    def changes_key(showtime_id: int):
+        return cache.make_key(f"seats:changes:{showtime_id}")
+
+    @staticmethod
+    def feed_channel(showtime_id: int):
+        """ Pub/sub channel where every seat change of the showtime is published (booking/feed.py fans it out to the SSE clients) """
+        return cache.make_key(f"seats:feed:{showtime_id}")
+
+    @staticmethod
+    def lock_keys(showtime_id: int):
+        """ The showtime keys the lock scripts update next to the locks themselves """
+        return [
+            SeatMap.held_key(showtime_id), SeatMap.holds_key(showtime_id), SeatMap.version_key(showtime_id), SeatMap.changes_key(showtime_id),
+            SeatMap.sold_key(showtime_id),
+        ]
+
+    @staticmethod
+    def capacity(hall):
+        return hall.seats_per_row * hall.seats_per_column
+
+    @staticmethod
+    def rebuild(showtime):
+        """ Cold start (Redis restarted or bitmap deleted): copy the current state from Postgres into the bitmaps """
+        hall = showtime.hall
+        sold = Ticket.objects.filter(showtime=showtime).select_related("seat")
+        pending = Booking.objects.filter(showtime=showtime, status="PENDING").prefetch_related("seats")
+
+        # seats of pending bookings only count as held if their lock is still alive
+        holders = SeatLock.holders(showtime.id, [seat.id for booking in pending for seat in booking.seats.all()])
+
+        con = get_redis_connection("default")
+        pipe = con.pipeline()
+        for ticket in sold:
+            pipe.setbit(SeatMap.sold_key(showtime.id), seat_index(ticket.seat, hall), 1)
+        for booking in pending:
+            deadline = int(booking.created_at.timestamp()) + HOLD_TIMEOUT # the locks were taken right before the booking row
+            for seat in booking.seats.all():
+                if holders.get(seat.id) == booking.user_id:
+                    pipe.setbit(SeatMap.held_key(showtime.id), seat_index(seat, hall), 1)
+                    pipe.hset(SeatMap.holds_key(showtime.id), seat.id, f"{booking.user_id}:{deadline}")
+        pipe.expire(SeatMap.holds_key(showtime.id), HOLD_TIMEOUT)
+        pipe.setbit(SeatMap.sold_key(showtime.id), SeatMap.capacity(hall), 1) # mark as built
+        pipe.execute()
+        SeatMap.reset_version(showtime.id) # the clients' old versions can't be trusted against a rebuilt map
+
+    @staticmethod
+    def snapshot(showtime):
+        """ Download both bitmaps in 1 round trip. Returns (sold, held) as bytes """
+        con = get_redis_connection("default")
+        sold, held = con.pipeline().get(SeatMap.sold_key(showtime.id)).get(SeatMap.held_key(showtime.id)).execute()
+
+        if not is_set(sold, SeatMap.capacity(showtime.hall)):
+            SeatMap.rebuild(showtime)
+            sold, held = con.pipeline().get(SeatMap.sold_key(showtime.id)).get(SeatMap.held_key(showtime.id)).execute()
+        return sold, held
+
+    @staticmethod
+    async def asnapshot(showtime):
+        con = get_async_redis_connection()
+        sold, held = await con.pipeline().get(SeatMap.sold_key(showtime.id)).get(SeatMap.held_key(showtime.id)).execute()
+
+        if not is_set(sold, SeatMap.capacity(showtime.hall)):
+            await sync_to_async(SeatMap.rebuild)(showtime) # rare (cold start only), and it reads Postgres, so the sync version is fine
+            sold, held = await con.pipeline().get(SeatMap.sold_key(showtime.id)).get(SeatMap.held_key(showtime.id)).execute()
+        return sold, held
+
+    @staticmethod
+    def holds(showtime):
+        """
+        For the seat map: the sold bitmap and {seat_id: (user_id, deadline)} of every hold, in 1 round trip (GET + HGETALL).
+        An entry whose deadline passed is a lock that expired by itself, the caller prunes it
+        """
+        con = get_redis_connection("default")
+        sold, holds = con.pipeline().get(SeatMap.sold_key(showtime.id)).hgetall(SeatMap.holds_key(showtime.id)).execute()
+
+        if not is_set(sold, SeatMap.capacity(showtime.hall)):
+            SeatMap.rebuild(showtime)
+            sold, holds = con.pipeline().get(SeatMap.sold_key(showtime.id)).hgetall(SeatMap.holds_key(showtime.id)).execute()
+        return sold, SeatMap._parse_holds(holds)
+
+    @staticmethod
+    async def aholds(showtime):
+        con = get_async_redis_connection()
+        sold, holds = await con.pipeline().get(SeatMap.sold_key(showtime.id)).hgetall(SeatMap.holds_key(showtime.id)).execute()
+
+        if not is_set(sold, SeatMap.capacity(showtime.hall)):
+            await sync_to_async(SeatMap.rebuild)(showtime)
+            sold, holds = await con.pipeline().get(SeatMap.sold_key(showtime.id)).hgetall(SeatMap.holds_key(showtime.id)).execute()
+        return sold, SeatMap._parse_holds(holds)
+
+    @staticmethod
+    def _parse_holds(holds: dict):
+        parsed = {}
+        for seat_id, value in holds.items():
+            user_id, deadline = value.split(b":")
+            parsed[int(seat_id)] = (int(user_id), int(deadline))
+        return parsed
+
+    @staticmethod
+    def counts(showtime):
+        """ How many seats are sold and held --BITCOUNT runs inside Redis, nothing is scanned in Postgres """
+        SeatMap.snapshot(showtime) # make sure it's built
+        con = get_redis_connection("default")
+        sold, held = con.pipeline().bitcount(SeatMap.sold_key(showtime.id)).bitcount(SeatMap.held_key(showtime.id)).execute()
+        return sold - 1, held # minus the "built" bit
+
+    @staticmethod
+    def mark_sold(showtime, seats, sold: bool = True):
+        # setting bits on a bitmap that isn't built yet is fine, rebuild() only adds bits on top of it
+        SeatMap._change(showtime.id, [seat_index(seat, showtime.hall) for seat in seats], "1" if sold else "0")
+
+    @staticmethod
+    def touch(showtime_ids, positions: list[int], letter: str = ""):
+        """
+        These seats changed without a lock or a sale (ex: a seat broke, letter "X"): bump the version so the polling clients refetch them
+        and tell the live ones. No letter = read it from the bitmaps (ex: the seat is repaired)
+        """
+        for showtime_id in showtime_ids:
+            SeatMap._change(showtime_id, positions, "", letter)
+
+    @staticmethod
+    def _change(showtime_id: int, positions: list[int], bit: str, letter: str = ""):
+        if positions:
+            keys = [SeatMap.sold_key(showtime_id), SeatMap.held_key(showtime_id), SeatMap.version_key(showtime_id), SeatMap.changes_key(showtime_id)]
+            get_redis_connection("default").eval(CHANGE_SCRIPT, len(keys), *keys, bit, letter, SeatMap.feed_channel(showtime_id), *positions)
+
+    @staticmethod
+    def reset_version(showtime_id: int):
+        keys = [SeatMap.version_key(showtime_id), SeatMap.base_key(showtime_id), SeatMap.changes_key(showtime_id)]
+        return get_redis_connection("default").eval(RESET_SCRIPT, len(keys), *keys, int(time.time() * 1000))
+
+    @staticmethod
+    async def aversion(showtime_id: int):
+        """ Current version of the seat map, None if it was never built (1 GET: enough to answer "nothing changed") """
+        version = await get_async_redis_connection().get(SeatMap.version_key(showtime_id))
+        return int(version) if version is not None else None
+
+    @staticmethod
+    async def aversioned(showtime, since: int | None = None):
+        """
+        Both bitmaps, the version and (when `since` is given) the positions changed after it, in 1 MULTI/EXEC: all from the same instant,
+        so the version never claims a change the bitmaps don't show yet.
+        Returns (sold, held, version, changed positions), changed = None when `since` can't be answered with a delta (send the whole map)
+        """
+        con = get_async_redis_connection()
+        while True:
+            pipe = con.pipeline() # transaction=True by default
+            pipe.get(SeatMap.sold_key(showtime.id)).get(SeatMap.held_key(showtime.id))
+            pipe.get(SeatMap.version_key(showtime.id)).get(SeatMap.base_key(showtime.id))
+            if since is not None:
+                pipe.zrangebyscore(SeatMap.changes_key(showtime.id), f"({since}", "+inf")
+            sold, held, version, base, *changed = await pipe.execute()
+
+            if not is_set(sold, SeatMap.capacity(showtime.hall)):
+                await sync_to_async(SeatMap.rebuild)(showtime) # cold start, starts a new history too
+            elif base is None:
+                await sync_to_async(SeatMap.reset_version)(showtime.id) # map built before it had versions
+            else:
+                break
+
+        version, base = int(version), int(base)
+        if since is None or not base <= since <= version:
+            return sold, held, version, None
+        return sold, held, version, [int(position) for position in changed[0]]
+
+    @staticmethod
+    def forget(showtime_ids):
+        """ Drop the bitmaps (ex: hall is resized so every seat position changed), they are rebuilt on next read """
+        keys = [
+            key for s_id in showtime_ids
+            for key in (SeatMap.sold_key(s_id), SeatMap.held_key(s_id), SeatMap.holds_key(s_id), SeatMap.base_key(s_id), SeatMap.changes_key(s_id))
+        ]
+        if keys:
+            pipe = get_redis_connection("default").pipeline()
+            pipe.delete(*keys)
+            for s_id in showtime_ids:
+                pipe.incr(SeatMap.version_key(s_id)) # not deleted, moved on: no client may get a 304 for the map that is gone
+            pipe.execute()
+
+
+
+class BookingExpiry:
+    """
+    Sorted set of PENDING bookings, scored by the time their hold ends (unix seconds).
+    The `expire_bookings` worker drains it, so abandoned carts turn EXPIRED within seconds instead of staying PENDING forever
+    """
+    @staticmethod
+    def key():
+        return cache.make_key("booking:deadlines")
+
+    @staticmethod
+    def schedule(booking_id: int, deadline: float):
+        get_redis_connection("default").zadd(BookingExpiry.key(), {booking_id: deadline})
+
+    @staticmethod
+    async def aschedule(booking_id: int, deadline: float):
+        await get_async_redis_connection().zadd(BookingExpiry.key(), {booking_id: deadline})
+
+    @staticmethod
+    def unschedule(booking_id: int):
+        get_redis_connection("default").zrem(BookingExpiry.key(), booking_id)
+
+    @staticmethod
+    def claim_due(now: float, limit: int = 100):
+        """ Take the bookings whose deadline passed. ZREM decides who owns each one, so 2 workers never expire the same booking """
+        con = get_redis_connection("default")
+        due = con.zrangebyscore(BookingExpiry.key(), "-inf", now, start=0, num=limit)
+        return [int(b_id) for b_id in due if con.zrem(BookingExpiry.key(), b_id)]
+
+
+
+# KEYS[1] = queue (zset token -> ticket number), KEYS[2] = last ticket number given
+# ARGV[1] = token, ARGV[2] = how long (seconds) the queue keys live
+JOIN_SCRIPT = """
+local number = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[1], number, ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return number
+"""
+
+# The gate opens lazily on every poll: `rate` more ticket numbers are let in per second since the last move (fair, first come first served)
+# KEYS[1] = queue, KEYS[2] = last ticket number given, KEYS[3] = gate (hash: head, tick), KEYS[4] = pass of this token
+# ARGV[1] = token, ARGV[2] = now (unix seconds), ARGV[3] = admit rate per second, ARGV[4] = pass timeout, ARGV[5] = user_id, ARGV[6] = keys lifetime
+# Returns -1 for an unknown token, 0 when admitted (pass is given), otherwise how many people are still in front
+STATUS_SCRIPT = """
+local number = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not number then
+    return -1
+end
+number = tonumber(number)
+
+local now = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local last = tonumber(redis.call('GET', KEYS[2]) or '0')
+local head = tonumber(redis.call('HGET', KEYS[3], 'head') or '0')
+local tick = tonumber(redis.call('HGET', KEYS[3], 'tick') or ARGV[2])
+
+local gained = math.floor((now - tick) * rate)
+if head + gained >= last then
+    head = last
+    tick = now -- nobody is waiting, don't save up "free entries" for a later rush
+elseif gained > 0 then
+    head = head + gained
+    tick = tick + gained / rate
+end
+redis.call('HSET', KEYS[3], 'head', head, 'tick', tick)
+redis.call('EXPIRE', KEYS[3], ARGV[6])
+
+if number <= head then
+    redis.call('SET', KEYS[4], ARGV[5], 'NX', 'EX', ARGV[4])
+    return 0
+end
+return number - head
+"""
+
+# Take the pass for 1 booking attempt, in 1 step: 2 requests with the same token can't both see it (GET then DEL would let them)
+# The token also leaves the queue, so polling it again doesn't hand out a new pass
+# KEYS[1] = pass of this token, KEYS[2] = queue ; ARGV[1] = user_id, ARGV[2] = token
+# Returns {pass ttl, ticket number} so a failed booking can give both back, or an empty list when there is no pass for this user
+CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return {}
+end
+local ttl = redis.call('TTL', KEYS[1])
+local number = tonumber(redis.call('ZSCORE', KEYS[2], ARGV[2]) or '-1')
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[2])
+return {ttl, number}
+"""
+
+
+class WaitingRoom:
+    """
+    Virtual waiting room for showtimes with `queue_enabled` (blockbuster on-sales).
+    Customers take a token, poll their position (Redis only, no Postgres), and get a short-lived pass once the gate reaches them.
+    BookingAPIView only lets a request into make_booking with a valid pass.
+    """
+    LIFETIME = 60 * 60 * 24 # queue keys disappear 1 day after the last join/poll
+
+    @staticmethod
+    def _keys(showtime_id: int):
+        prefix = f"queue:{showtime_id}"
+        return [cache.make_key(prefix), cache.make_key(f"{prefix}:seq"), cache.make_key(f"{prefix}:gate")]
+
+    @staticmethod
+    def pass_key(showtime_id: int, token: str):
+        return cache.make_key(f"queue:{showtime_id}:pass:{token}")
+
+    @staticmethod
+    def join(showtime_id: int):
+        """ Take a place at the end of the line. Returns the token the client must keep """
+        token = uuid.uuid4().hex
+        queue, seq, _ = WaitingRoom._keys(showtime_id)
+        get_redis_connection("default").eval(JOIN_SCRIPT, 2, queue, seq, token, WaitingRoom.LIFETIME)
+        return token
+
+    @staticmethod
+    def position(showtime_id: int, token: str, user_id: int):
+        """ 0 = admitted (pass given to this user), n = people still in front, None = unknown token """
+        keys = WaitingRoom._keys(showtime_id) + [WaitingRoom.pass_key(showtime_id, token)]
+        result = get_redis_connection("default").eval(
+            STATUS_SCRIPT, len(keys), *keys,
+            token, time.time(), settings.WAITING_ROOM_ADMIT_RATE, settings.WAITING_ROOM_PASS_TIMEOUT, user_id, WaitingRoom.LIFETIME,
+        )
+        return None if result < 0 else result
+
+    @staticmethod
+    async def aclaim(showtime_id: int, token: str | None, user_id: int):
+        """ 1 pass = 1 booking: take it before booking. Returns what arestore() needs if the booking fails, None = no valid pass """
+        if not token:
+            return None
+        queue, _, _ = WaitingRoom._keys(showtime_id)
+        claim = await get_async_redis_connection().eval(CLAIM_SCRIPT, 2, WaitingRoom.pass_key(showtime_id, token), queue, user_id, token)
+        return claim or None
+
+    @staticmethod
+    async def arestore(showtime_id: int, token: str, user_id: int, claim):
+        """ The booking failed (seat taken, ...): the customer keeps his pass and his place, for the time the pass had left """
+        ttl, number = claim
+        queue, _, _ = WaitingRoom._keys(showtime_id)
+        pipe = get_async_redis_connection().pipeline()
+        pipe.set(WaitingRoom.pass_key(showtime_id, token), user_id, ex=max(ttl, 1), nx=True)
+        if number >= 0:
+            pipe.zadd(queue, {token: number})
+        await pipe.execute()
@@ -0,0 +1,50 @@
+# Background worker: turns abandoned PENDING bookings into EXPIRED right after their 10 minutes hold ends
+# Run it next to the web server:  python manage.py expire_bookings
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from booking.models import Booking
+from booking.locks import BookingExpiry, HOLD_TIMEOUT
+from booking.services import BookingService
+
+
+class Command(BaseCommand):
+    help = "Expire PENDING bookings whose seat hold has ended and release their seats"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between 2 checks of the Redis deadline queue")
+        parser.add_argument("--sweep-every", type=float, default=60.0, help="Seconds between 2 safety sweeps over Postgres")
+        parser.add_argument("--once", action="store_true", help="Run a single pass (queue + sweep) and exit, ex: from cron")
+
+    def handle(self, *args, **options):
+        last_sweep = 0.0
+
+        while True:
+            now = time.time()
+            expired = self.drain_queue(now)
+
+            # Safety net: bookings that never reached the queue (ex: Redis was flushed), served by the partial index on PENDING
+            if options["once"] or now - last_sweep >= options["sweep_every"]:
+                expired += self.sweep_db()
+                last_sweep = now
+
+            if expired:
+                self.stdout.write(f"Expired {expired} booking(s)")
+
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
+
+    def drain_queue(self, now: float):
+        booking_ids = BookingExpiry.claim_due(now)
+        bookings = Booking.objects.filter(id__in=booking_ids, status="PENDING").select_related("showtime__hall")
+        return sum(BookingService.expire_booking(booking) for booking in bookings)
+
+    def sweep_db(self):
+        deadline = timezone.now() - timedelta(seconds=HOLD_TIMEOUT)
+        bookings = Booking.objects.filter(status="PENDING", created_at__lt=deadline).select_related("showtime__hall")
+        return sum(BookingService.expire_booking(booking) for booking in bookings)
@@ -0,0 +1,214 @@
+# Load test of the booking hot path: many processes (and threads) race make_booking + confirm_booking on the SAME seats
+# It seeds its own hall/showtime/customers, prints throughput, latency and lock-conflict rate, then proves no seat was sold twice
+# Run it before every release to compare with the last baseline:  python manage.py loadtest_bookings --processes 8 --attempts 5000
+# Needs the real Postgres + Redis (a fakeredis *server* works too), never point it at production
+
+import multiprocessing
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.exceptions import ValidationError
+
+from booking.locks import SeatLock, SeatMap, BookingExpiry
+from booking.models import Booking, Ticket
+from booking.services import BookingService
+from identity.models import User
+from screening.models import Movie, Showtime, Seat
+from screening.services import HallService, ShowtimeService
+
+# How a failed attempt is counted (by the message of the ValidationError the service raised)
+CONFLICT_ERRORS = ("on hold by someone else", "already have a pending booking") # lost the race on the Redis lock
+SOLD_OUT_ERRORS = ("already sold", "Not enough seats", "adjacent seats left")
+
+
+def classify(error: ValidationError):
+    message = str(error.detail)
+    if any(text in message for text in CONFLICT_ERRORS):
+        return "conflict"
+    if any(text in message for text in SOLD_OUT_ERRORS):
+        return "sold_out"
+    return "rejected"
+
+
+def run_worker(options: dict, seed: int):
+    """ 1 process: runs its share of attempts on `threads` threads. Returns [(outcome, book_ms, confirm_ms), ...] """
+    users = list(User.objects.filter(id__in=options["user_ids"]))
+    shares = [options["attempts"] // options["threads"] + (1 if i < options["attempts"] % options["threads"] else 0) for i in range(options["threads"])]
+
+    def thread_loop(args):
+        count, thread_seed = args
+        rng = random.Random(thread_seed)
+        results = []
+        for _ in range(count):
+            results.append(attempt(options, rng, rng.choice(users)))
+        connections.close_all() # this thread's own DB connection
+        return results
+
+    with ThreadPoolExecutor(options["threads"]) as executor:
+        chunks = executor.map(thread_loop, [(count, seed * 1000 + i) for i, count in enumerate(shares)])
+        return [result for chunk in chunks for result in chunk]
+
+
+def attempt(options: dict, rng: random.Random, user: User):
+    """ 1 customer: book `quantity` seats, then pay (confirm) or give up (cancel), like a real checkout """
+    quantity = options["quantity"]
+    seat_ids = None
+    if not options["best_available"]:
+        start = rng.randrange(len(options["seat_ids"]) - quantity + 1) # a random block of adjacent seats, so customers overlap a lot
+        seat_ids = options["seat_ids"][start:start + quantity]
+
+    started = time.perf_counter()
+    try:
+        showtime = Showtime.objects.select_related("hall").get(id=options["showtime_id"]) # fresh counters, same as every API request
+        booking = BookingService.make_booking(user=user, showtime=showtime, quantity=quantity, seat_ids=seat_ids)
+    except ValidationError as error:
+        return classify(error), (time.perf_counter() - started) * 1000, None
+    book_ms = (time.perf_counter() - started) * 1000
+
+    if rng.random() >= options["confirm_rate"]:
+        BookingService.cancel_booking(booking) # abandoned cart: the seats go back to the pool and keep the race going
+        return "abandoned", book_ms, None
+
+    started = time.perf_counter()
+    try:
+        BookingService.confirm_booking(booking)
+    except ValidationError as error:
+        return classify(error), book_ms, (time.perf_counter() - started) * 1000
+    return "confirmed", book_ms, (time.perf_counter() - started) * 1000
+
+
+def percentile(values: list[float], q: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+class Command(BaseCommand):
+    help = "Race many concurrent bookings on the same seats, report throughput/latency/conflicts and verify no seat is sold twice"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4, help="Worker processes (each one has its own DB and Redis connections)")
+        parser.add_argument("--threads", type=int, default=4, help="Threads per process")
+        parser.add_argument("--attempts", type=int, default=2000, help="Total booking attempts over all workers")
+        parser.add_argument("--quantity", type=int, default=2, help="Seats per booking")
+        parser.add_argument("--customers", type=int, default=50, help="How many different customers race each other")
+        parser.add_argument("--rows", type=int, default=15, help="Rows of the seeded hall")
+        parser.add_argument("--columns", type=int, default=15, help="Seats per row of the seeded hall")
+        parser.add_argument("--hot-seats", type=int, default=0, help="Only fight over the first N seats (0 = the whole hall)")
+        parser.add_argument("--confirm-rate", type=float, default=0.5, help="Share of successful holds that are paid, the rest are cancelled")
+        parser.add_argument("--best-available", action="store_true", help="Send only the quantity and let the engine pick the seats")
+        parser.add_argument("--seed", type=int, default=42, help="Random seed, the same seed replays the same choices")
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded data (and Redis keys) to inspect them afterwards")
+
+    def handle(self, *args, **options):
+        showtime, users = self.seed(options)
+        try:
+            seat_ids = list(Seat.objects.filter(hall=showtime.hall).order_by("row_label", "column_number").values_list("id", flat=True))
+            work = {
+                "showtime_id": showtime.id,
+                "user_ids": [user.id for user in users],
+                "seat_ids": seat_ids[:options["hot_seats"]] if options["hot_seats"] else seat_ids,
+                "attempts": options["attempts"] // options["processes"],
+                "threads": options["threads"],
+                "quantity": options["quantity"],
+                "confirm_rate": options["confirm_rate"],
+                "best_available": options["best_available"],
+            }
+
+            started = time.perf_counter()
+            results = self.run(work, options)
+            elapsed = time.perf_counter() - started
+
+            self.report(results, elapsed, options)
+            self.verify(showtime)
+        finally:
+            if not options["keep"]:
+                self.cleanup(showtime, users)
+
+    def seed(self, options):
+        tag = uuid.uuid4().hex[:8]
+        movie = Movie.objects.create(title=f"Load test {tag}", duration=120, rating=5, release_date=timezone.now().date())
+        hall = HallService.save_hall(name=f"Load test {tag}", seats_per_row=options["rows"], seats_per_column=options["columns"], screen_type="STANDARD")
+        showtime = ShowtimeService.save_showtime(movie=movie, hall=hall, start_at=timezone.now() + timedelta(days=1), price=10)
+        users = User.objects.bulk_create([
+            User(email=f"loadtest-{tag}-{i}@example.com", username=f"loadtest-{tag}-{i}", password="!") # "!" = unusable password
+            for i in range(options["customers"])
+        ])
+        self.stdout.write(f"Seeded showtime {showtime.id} ({options['rows']}x{options['columns']} hall) and {len(users)} customers")
+        return showtime, users
+
+    def run(self, work, options):
+        if options["processes"] == 1:
+            return run_worker(work, options["seed"])
+
+        # forked children must not share the parent's sockets: close them, every child opens its own
+        connections.close_all()
+        get_redis_connection("default").connection_pool.disconnect()
+        with multiprocessing.get_context("fork").Pool(options["processes"]) as pool:
+            chunks = pool.starmap(run_worker, [(work, options["seed"] + i) for i in range(options["processes"])])
+        return [result for chunk in chunks for result in chunk]
+
+    def report(self, results, elapsed, options):
+        outcomes = {}
+        for outcome, _, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        book_ms = [book for _, book, _ in results]
+        confirm_ms = [confirm for _, _, confirm in results if confirm is not None]
+        conflicts = outcomes.get("conflict", 0)
+
+        self.stdout.write(
+            f"{len(results)} attempts in {elapsed:.2f}s -> {len(results) / elapsed:.0f} attempts/s "
+            f"({options['processes']} processes x {options['threads']} threads)"
+        )
+        self.stdout.write(f"make_booking    p50 {percentile(book_ms, 0.50):7.2f} ms   p99 {percentile(book_ms, 0.99):7.2f} ms")
+        self.stdout.write(f"confirm_booking p50 {percentile(confirm_ms, 0.50):7.2f} ms   p99 {percentile(confirm_ms, 0.99):7.2f} ms")
+        self.stdout.write(f"lock conflicts  {conflicts} ({conflicts / max(len(results), 1):.1%})")
+        self.stdout.write("outcomes        " + ", ".join(f"{name}={count}" for name, count in sorted(outcomes.items())))
+
+    def verify(self, showtime):
+        """ The whole point: whatever the race did, every seat has at most 1 ticket and every counter agrees with the tickets """
+        showtime.refresh_from_db()
+        tickets = Ticket.objects.filter(showtime=showtime)
+        sold = tickets.count()
+
+        errors = []
+        double_sold = list(tickets.values("seat_id").annotate(total=Count("id")).filter(total__gt=1).values_list("seat_id", flat=True))
+        if double_sold:
+            errors.append(f"seats sold twice: {double_sold}")
+
+        confirmed = Booking.objects.filter(showtime=showtime, status="CONFIRMED").aggregate(total=Sum("quantity"))["total"] or 0
+        if confirmed != sold:
+            errors.append(f"{confirmed} seats in CONFIRMED bookings but {sold} tickets")
+
+        pending = Booking.objects.filter(showtime=showtime, status="PENDING").aggregate(total=Sum("quantity"))["total"] or 0
+        if (showtime.sold_count, showtime.held_count) != (sold, pending):
+            errors.append(f"counters say sold={showtime.sold_count} held={showtime.held_count}, rows say sold={sold} held={pending}")
+
+        bitmap_sold, _ = SeatMap.counts(showtime)
+        if bitmap_sold != sold:
+            errors.append(f"sold bitmap has {bitmap_sold} seats but there are {sold} tickets")
+
+        if errors:
+            raise CommandError("Integrity check FAILED: " + "; ".join(errors))
+        self.stdout.write(self.style.SUCCESS(f"Integrity OK: {sold} tickets, no seat sold twice, counters and bitmap match"))
+
+    def cleanup(self, showtime, users):
+        SeatLock.release(showtime, list(showtime.hall.seat_set.all()))
+        SeatMap.forget([showtime.id])
+        for booking_id in Booking.objects.filter(showtime=showtime).values_list("id", flat=True):
+            BookingExpiry.unschedule(booking_id)
+
+        movie, hall = showtime.movie, showtime.hall
+        showtime.delete() # bookings and tickets go with it
+        hall.delete()
+        movie.delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.4 on 2026-10-17 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0002_booking_seats_delete_seatlock'),
+        ('screening', '0003_seat_is_broken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['created_at'], name='booking_pending_created_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 6.0.4 on 2026-10-17 18:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def copy_showtime_from_booking(apps, schema_editor):
+    # Old tickets only knew their showtime through the booking
+    Ticket = apps.get_model('booking', 'Ticket')
+    Booking = apps.get_model('booking', 'Booking')
+    Ticket.objects.update(
+        showtime_id=Subquery(Booking.objects.filter(id=OuterRef('booking_id')).values('showtime_id')[:1])
+    )
+
+
+def refuse_double_sold_seats(apps, schema_editor):
+    # The unique constraint below can't be added over a seat already sold twice. Which buyer keeps it (and who is refunded)
+    # is not a migration's call, so stop here with the list instead of failing half-way inside the constraint
+    Ticket = apps.get_model('booking', 'Ticket')
+    duplicates = list(
+        Ticket.objects.values('showtime_id', 'seat_id').annotate(tickets=Count('id')).filter(tickets__gt=1).order_by('showtime_id', 'seat_id')
+    )
+    if duplicates:
+        seats = ", ".join(f"showtime {row['showtime_id']} seat {row['seat_id']} ({row['tickets']} tickets)" for row in duplicates[:20])
+        raise RuntimeError(
+            f"{len(duplicates)} seat(s) are sold more than once: {seats}. Cancel/refund the extra bookings "
+            "(or delete their tickets) so each (showtime, seat) keeps 1 ticket, then run the migration again."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_booking_pending_created_idx'),
+        ('screening', '0004_showtime_seat_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='showtime',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='screening.showtime'),
+        ),
+        migrations.RunPython(copy_showtime_from_booking, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ticket',
+            name='showtime',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='screening.showtime'),
+        ),
+        migrations.RunPython(refuse_double_sold_seats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(fields=('showtime', 'seat'), name='unique_ticket_per_showtime_seat'),
+        ),
+    ]
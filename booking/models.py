@@ -25,6 +25,15 @@ class Booking(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True) # auto grab the current time
     final_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00) #in case the price will change someday, this will freeze the price 
 
+    class Meta:
+        indexes = [
+            # Partial index: only PENDING rows are inside, so the expiry sweep stays small no matter how big the history grows
+            models.Index(fields=["created_at"], condition=models.Q(status="PENDING"), name="booking_pending_created_idx"),
+            # Keyset pagination (cinema/pagination.py): the admin list walks (created_at, id), a customer's list walks it inside his own rows
+            models.Index(fields=["created_at", "id"], name="booking_created_id_idx"),
+            models.Index(fields=["user", "created_at", "id"], name="booking_user_created_id_idx"),
+        ]
+
     def __str__(self):
         return f"Booking {self.pk} for {self.user} : {self.showtime}" # pk refer to id as default
 
@@ -45,7 +54,16 @@ class Ticket(models.Model):
     """ Represents the Seat is already occupied """
     id: int
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE)
+    showtime = models.ForeignKey("screening.Showtime", on_delete=models.CASCADE) # copy of booking.showtime, so the DB itself can see (and refuse) a seat sold twice
     seat = models.ForeignKey("screening.Seat", on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["showtime", "seat"], # 1 seat can only have 1 ticket per showtime, even if Redis is wrong
+                name="unique_ticket_per_showtime_seat",
+            ),
+        ]
+
 
 # Seatlock table is deleted since we apply Redis
@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from .models import Booking, Ticket
+from django.db.models import Prefetch
+from screening.models import Showtime
+from screening.serializers import ShowtimeReadListSerializer
 
 class BookingBaseSerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,21 +14,35 @@ class BookingBaseSerializer(serializers.ModelSerializer):
 
 class BookingReadSerializer(BookingBaseSerializer):
     choosen_seats = serializers.SerializerMethodField() # We add a way to see the seats actually saved in the Ticket table
+    showtime_info = ShowtimeReadListSerializer(source="showtime", read_only=True) # when, what movie and which hall, so the client doesn't fetch every showtime
     class Meta(BookingBaseSerializer.Meta):
-        fields = BookingBaseSerializer.Meta.fields + ["choosen_seats"]
+        fields = BookingBaseSerializer.Meta.fields + ["choosen_seats", "showtime_info"]
 
+    @staticmethod
+    def eager_load(queryset):
+        """
+        Everything this serializer reads, in a fixed number of queries whatever the page size:
+        showtime + movie + hall are JOINed, seats and tickets of the whole page come in 1 query each
+        """
+        return queryset.select_related("showtime__movie", "showtime__hall").prefetch_related(
+            "seats",
+            Prefetch("ticket_set", queryset=Ticket.objects.only("id", "booking_id", "seat_id")),
+        )
+
+    # .all() (not values_list) so the prefetched rows are used, a booking that wasn't eager_load()ed still works with 1 query
     def get_choosen_seats(self, obj):
         # If the booking is already CONFIRMED, look in the Ticket table (sacred)
         if obj.status == "CONFIRMED":
-            return Ticket.objects.filter(booking=obj).values_list("seat_id", flat=True) # This shows the list of seat IDs for the user to see
+            return [ticket.seat_id for ticket in obj.ticket_set.all()] # This shows the list of seat IDs for the user to see
         
         # If it's PENDING or EXPIRED, show what was saved in the "waiting room"
         # "Look at those rows in the bridge table(join) and just give me a list of the Seat IDs."
-        return obj.seats.values_list("id", flat=True)    
+        return [seat.id for seat in obj.seats.all()]
 
 
 class BookingWriteSerializer(BookingBaseSerializer):
-    seat_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True)
+    showtime = serializers.PrimaryKeyRelatedField(queryset=Showtime.objects.select_related("hall", "movie")) # hall comes in the same query, the service needs its grid size (and the response shows the movie)
+    seat_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True, required=False) # leave it out to get the best available seats for `quantity`
     class Meta(BookingBaseSerializer.Meta):
         fields = BookingBaseSerializer.Meta.fields + ["seat_ids"]
 
@@ -41,4 +58,10 @@ class MessageSerializer(serializers.Serializer):
 
 class BookingResponseSerializer(MessageSerializer):
     booking = BookingWriteSerializer()
-    
\ No newline at end of file
+    
+
+
+class QueueStatusSerializer(serializers.Serializer):
+    token = serializers.CharField() # keep it, send it back on every poll and as "X-Queue-Token" header when booking
+    position = serializers.IntegerField() # people still in front of you (0 = your turn)
+    admitted = serializers.BooleanField()
@@ -1,12 +1,17 @@
 from .models import Booking, Ticket
 from screening.models import Showtime, Seat, Hall, Movie
+from screening.services import OccupancyCache
 from identity.models import User
 
 from rest_framework.exceptions import ValidationError
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.utils import timezone
 from django.core.cache import cache
-from django.db.models import Count, Avg, Max, Min, Sum
+from django.db.models import Count, Avg, Max, Min, Sum, F, Q, Exists, OuterRef, ExpressionWrapper, BooleanField
+import time
+from asgiref.sync import sync_to_async
+from .locks import SeatLock, SeatMap, BookingExpiry, HOLD_TIMEOUT
+from .allocator import SeatGrid
 
 
 # "What stops this Booking from being allowed?" 
@@ -32,11 +37,9 @@ class BookingService:
             if booking and booking.id: 
                 # # If the booking already exists (Update by Admin), 
                 seat_ids = list(booking.seats.values_list('id', flat=True)) # get the IDs from the M2M field
-            else: 
-                # If it's a new booking, we get the list from the user
-                seat_ids = []
+            # If it's a new booking without seats, we pick the best available ones below (only the quantity is needed)
         
-        quantity = quantity if quantity else (booking.quantity if booking else len(seat_ids)) # when admin didnt put quantity, count all selected seats
+        quantity = quantity if quantity else (booking.quantity if booking else len(seat_ids or [])) # when admin didnt put quantity, count all selected seats
         if not quantity:
             raise ValidationError("Quantity is required")
         
@@ -45,118 +48,100 @@ class BookingService:
 
 
         # Since the action is one single event, keep these 3 different logics together makes it Atomic
-        # 1. Check if movie is already over or started
-        if showtime.end_at < timezone.now(): #if current time is after ending time
-            raise ValidationError("The movie is already finished")
-        
-        if showtime.start_at < timezone.now(): #if current time is more than starting line time
-            raise ValidationError("The movie is already started")
-        
-        
-        # 2. Check if the quantity is equal to how much seat selected
-        if quantity != len(seat_ids):
-            raise ValidationError(f"Quantity ({quantity}) must match seat count ({len(seat_ids)})")
-        
-
-        # 3. check if inputted seatid(by user) is indeed belong to that spesific hall
-        # (if showtime 1 plays in hall "IMAX 1" and range seat is 1-50, means if user choose beside ID 1-50, return error)
-        seat_found = Seat.objects.filter(id__in=seat_ids, hall=showtime.hall)
-        if seat_found.count() != len(seat_ids):
-            raise ValidationError("One or more seats do not belong to the hall for this showtime")
-        
-
-        # 4. find out if the spesific hall is already full
-        ticket_counts = Ticket.objects.filter(
-            booking__showtime__hall = showtime.hall, # cant do "hall=hall" bcoz Ticket table has no hall column
-            booking__showtime__movie = showtime.movie
-        ).count()
-        #count all seats for this spesific hall
-        hall_capacity = showtime.hall.seats_per_row * showtime.hall.seats_per_column
-
-        if (ticket_counts + len(seat_ids)) > hall_capacity: # case: if seats already sold 49/50, then a person buy 2 tickets
-            raise ValidationError(f"Not enough seats available. Only {hall_capacity - ticket_counts} seats left")
-        
-
-        # 5. Check if the seat is already taken 
-        taken_ticket = Ticket.objects.filter( #"Find me any Ticket that matches This Showtime AND is in This List of Seats"
-            booking__showtime = showtime, # sql way of doing "booking.showtime" (to access showtime from Ticket)
-            seat_id__in = seat_ids, # "__in" is for accessing list
-        ).exists()
-
-        if taken_ticket:
-            raise ValidationError("One or more seats are already sold")
-        
-
-        # 6. check if selected seat is broken
-        # 7. Fallback: ensure all IDs numbers entered is exist in the DB
-        selected_seats = Seat.objects.filter(id__in=seat_ids) # out of these (___) selected seat IDs by user..
-
-        if selected_seats.filter(is_broken=True).exists(): #.. we filter if any of these selected seat flagged by broken is exist
-            raise ValidationError("This seat is currently under maintenance")
-        
-        if selected_seats.count() != len(seat_ids): #.. we .count() to see how many valid records, if retured valid record is not equal to how many user ids picked ...
-            raise ValidationError("one or more seats is not available")
-        
-        
-        # 8. Check if seat is locked by someone also prevent duplicate (with REDIS)
-        for s_id in seat_ids:
-            lock_key = f"lock:{showtime.id}:{s_id}" # "Name Tag" for the specific seat and showtime to be locked ; separate by `:` semantically 
-            locked_by_user = cache.get(lock_key) # "The action" to find out if a certain "name tag" is already locked (Return None or Id)
-
-            if locked_by_user:
-                if locked_by_user == user.id:
-                    raise ValidationError(f"You already have a pending booking for these seats. Please pay for the existing one")
-                else:
-                    raise ValidationError(f"Seat {s_id} is on hold by someone else.")
-        
-        # we lock it after checking all (Check All-then-Act All)
-        # ORDER MATTER !!! THIS MUST BE AFTER ALL VALIDATIONS
-        for s_id in seat_ids:
-            lock_key = f"lock:{showtime.id}:{s_id}"
-            cache.set(lock_key, user.id, timeout=600) # Auto-delete in 600 seconds (10 mins)
+        BookingService._check_showtime(showtime, quantity, seat_ids) # 1-2
+
+        if seat_ids is None:
+            # Best available: pick AND lock the best block of adjacent seats for the customer
+            seat_found = BookingService._pick_best(showtime, quantity, user)
+            seat_ids = [seat.id for seat in seat_found]
+        else:
+            seat_found = BookingService._check_seats(showtime, seat_ids, list(BookingService._select_seats(showtime, seat_ids))) # 3-7
+            
+            # 8. Lock all seats at once, also prevent duplicate (with REDIS)
+            # Check and lock happen in 1 atomic step inside Redis, so 2 users who pass the checks above at the same moment can't both "win" the seat
+            # ORDER MATTER !!! THIS MUST BE AFTER ALL VALIDATIONS
+            conflicts = SeatLock.acquire(showtime, seat_found, user.id) # {seat_id: holder} of the seats someone else already hold
+            BookingService._check_conflicts(conflicts, user)
 
 
         #patch for admin
         if booking:
-            with transaction.atomic():
-                # delete prev data
-                Ticket.objects.filter(booking=booking).delete() #delete ticket for this booking (delete from Ticket where booking=...)
-
-                #update existing booking (what admin input)
-                booking.quantity = quantity
-                booking.showtime = showtime
-                booking.final_price = booking.showtime.price * booking.quantity # price sync
-                
-                booking.save()
-
-                # Sync M2M: This ensures the 'seats' table(M2M) matches the new 'seat_ids'(temp write field)
-                booking.seats.set(seat_ids)
-
-                for s_id in seat_ids: # bcoz prev ticket is deleted, so admin recreate new ticket
-                    Ticket.objects.create(booking = booking, seat_id = s_id)
-                # Admin is manually confirming booking, so no need SeatLock
+            old_showtime = booking.showtime # remember where the old tickets were, to free them in the bitmap later
+            old_seats = [ticket.seat for ticket in Ticket.objects.filter(booking=booking).select_related("seat")]
+            old_held = booking.quantity if booking.status == "PENDING" else 0 # seats this booking was still counting as "held"
+
+            try:
+                with transaction.atomic():
+                    # delete prev data
+                    Ticket.objects.filter(booking=booking).delete() #delete ticket for this booking (delete from Ticket where booking=...)
+
+                    #update existing booking (what admin input)
+                    booking.quantity = quantity
+                    booking.showtime = showtime
+                    booking.final_price = booking.showtime.price * booking.quantity # price sync
+                    booking.status = "CONFIRMED" # it gets tickets below, so payment can't confirm it (and make tickets) a 2nd time
+                    
+                    booking.save()
+
+                    # Sync M2M: This ensures the 'seats' table(M2M) matches the new 'seat_ids'(temp write field)
+                    booking.seats.set(seat_ids)
+
+                    # bcoz prev ticket is deleted, so admin recreate new ticket (all of them in 1 INSERT)
+                    BookingService._issue_tickets(booking, seat_ids)
+                    # Admin is manually confirming booking, so no need SeatLock
+
+                    BookingService._update_counters(old_showtime.id, sold=-len(old_seats), held=-old_held)
+                    BookingService._update_counters(showtime.id, sold=len(seat_ids))
+            except ValidationError:
+                SeatLock.release(showtime, seat_found, user.id) # nothing was saved, so give the seats back
+                raise
+
+            # sync the bitmaps: old tickets are free again, new ones are sold (and not on hold anymore)
+            SeatMap.mark_sold(old_showtime, old_seats, sold=False)
+            SeatMap.mark_sold(showtime, seat_found)
+            SeatLock.release(showtime, seat_found, user.id)
+            BookingExpiry.unschedule(booking.id) # has tickets now, the expiry worker must leave it alone
                 
             return booking
         
         
         # Booking and seatlock is created at same time, while ticket is created after payment
-        with transaction.atomic():
-            # 1. makes a row in Booking table. Let's say it gets ID: 100
-            new_booking = Booking.objects.create(
-                user = user,
-                showtime = showtime,
-                quantity = quantity,
-                final_price = showtime.price * quantity, # whatever user pays on this day is recorded
-                status = "PENDING"
-            )
+        new_booking = BookingService._create_pending(user, showtime, quantity, seat_ids)
 
-            # 2. Then `.set()` looks at that hidden bridge table (seats to booking)
-            # It says: "Make a new connection: Booking 100 <-> Seat 5 and Booking 100 <-> Seat 6"
-            new_booking.seats.set(seat_ids)
+        # 3. Tell the expiry worker when this hold ends (the locks above were set a moment ago, so this is never earlier than them)
+        BookingExpiry.schedule(new_booking.id, time.time() + HOLD_TIMEOUT)
    
         return new_booking
 
 
+    @staticmethod
+    async def amake_booking(user: User, showtime: Showtime, quantity: int | None, seat_ids: list[int] | None):
+        """
+        Async version of make_booking() for NEW bookings (used by the async BookingAPIView.post), same checks and same errors.
+        Postgres reads use the async ORM and Redis the async client, so the event loop keeps serving other requests while they wait.
+        Only the INSERTs run in a thread: Django has no async transaction.atomic yet
+        """
+        quantity = quantity if quantity else len(seat_ids or [])
+        if not quantity:
+            raise ValidationError("Quantity is required")
+
+        BookingService._check_showtime(showtime, quantity, seat_ids)
+
+        if seat_ids is None:
+            seat_found = await BookingService._apick_best(showtime, quantity, user)
+            seat_ids = [seat.id for seat in seat_found]
+        else:
+            selected_seats = [seat async for seat in BookingService._select_seats(showtime, seat_ids)]
+            seat_found = BookingService._check_seats(showtime, seat_ids, selected_seats)
+
+            conflicts = await SeatLock.aacquire(showtime, seat_found, user.id)
+            BookingService._check_conflicts(conflicts, user)
+
+        new_booking = await sync_to_async(BookingService._create_pending)(user, showtime, quantity, seat_ids)
+        await BookingExpiry.aschedule(new_booking.id, time.time() + HOLD_TIMEOUT)
+        return new_booking
+
+
     @staticmethod
     def confirm_booking(booking: Booking):
     # moving from Seatlock(waiting room) to Ticket(sacred room)
@@ -165,37 +150,41 @@ class BookingService:
             raise ValidationError(f"This booking is already {booking.status}") # stops if already expired/booked
         
         # 1. list all seats found in Booking table
-        reserved_seats = booking.seats.all() # "gimme all seats for this spesific booking"
+        reserved_seats = list(booking.seats.all()) # "gimme all seats for this spesific booking"
 
-        # 2. Check Redis for EVERY seat
-        for each_seat in reserved_seats:
-            lock_key = f"lock:{booking.showtime.id}:{each_seat.id}"
+        # 2. Check Redis for EVERY seat (in 1 round trip), the lock must still belong to this booking's owner
+        holders = SeatLock.holders(booking.showtime_id, [seat.id for seat in reserved_seats])
 
-            # This is how you "access the db of redis" to check
-            if not cache.get(lock_key):
-                # Apply these to db when 10 minutes is up
-                booking.status = "EXPIRED"
-                booking.save()
-                raise ValidationError("10 minutes payment time exceeded, please make the new one")
+        if any(holder != booking.user_id for holder in holders.values()):
+            # Apply these to db when 10 minutes is up (the worker was just not fast enough)
+            BookingService.expire_booking(booking)
+            raise ValidationError("10 minutes payment time exceeded, please make the new one")
 
         # 3. If user make payment within 10 minutes, we make sacred Ticket table
         with transaction.atomic():
+            # conditional UPDATE (same as expire_booking): if the expiry worker or a cancel got there first, nothing is confirmed
+            if not Booking.objects.filter(id=booking.id, status="PENDING").update(status="CONFIRMED"):
+                booking.refresh_from_db(fields=["status"])
+                raise ValidationError(f"This booking is already {booking.status}")
             booking.status = "CONFIRMED"
-            booking.save()
 
-            # Every time this loop runs, it creates ONE separate row in the Ticket table (now each person gets his own ticket)
-            for each_seat in reserved_seats:
-                Ticket.objects.create(booking=booking, seat=each_seat)
+            # ONE row per seat in the Ticket table (now each person gets his own ticket), all sent in 1 INSERT
+            BookingService._issue_tickets(booking, [seat.id for seat in reserved_seats])
 
-        # 4. Clear Redis now since the seat is already sold
-        for seat in reserved_seats:
-            cache.delete(f"lock:{booking.showtime.id}:{seat.id}")
+            BookingService._update_counters(booking.showtime_id, sold=len(reserved_seats), held=-booking.quantity)
+
+        # 4. Clear Redis now since the seat is already sold (mark sold first, so the seat never looks free in between)
+        SeatMap.mark_sold(booking.showtime, reserved_seats)
+        SeatLock.release(booking.showtime, reserved_seats, booking.user_id)
+        BookingExpiry.unschedule(booking.id)
 
         return booking # give back the result once function finished
     
     
     @staticmethod
     def cancel_booking(booking: Booking):  
+        # every move is a conditional UPDATE (like expire_booking): when 2 of them race (ex: a cancel and the expiry worker),
+        # only the one that really moved the booking touches the counters and the seats, the other just sees the new status
 
         # if user intendedly cancel the ticket (that already bought) and ask for refund, set CANCELLED
         if booking.status == "CONFIRMED":
@@ -205,18 +194,187 @@ class BookingService:
             if booking.showtime.end_at < timezone.now():
                 raise ValidationError("The showtime has finished")
             
-            Ticket.objects.filter(booking=booking).delete() # only delete ticket for this booking
+            sold_seats = [ticket.seat for ticket in Ticket.objects.filter(booking=booking).select_related("seat")]
+            with transaction.atomic():
+                if not Booking.objects.filter(id=booking.id, status="CONFIRMED").update(status="CANCELLED"):
+                    booking.refresh_from_db(fields=["status"]) # refunded by someone else at the same moment
+                    return booking
+                Ticket.objects.filter(booking=booking).delete() # only delete ticket for this booking
+                BookingService._update_counters(booking.showtime_id, sold=-len(sold_seats))
+            SeatMap.mark_sold(booking.showtime, sold_seats, sold=False) # the seats can be sold again
             booking.status = "CANCELLED"
 
 
         # if within 10 mins seatlock: user cancel the payment, so delete seatlock, and set status to CANCELLED
         elif booking.status == "PENDING": # use elif bcoz it's completely different situation
-            reserved_seats = booking.seats.all() # "gimme all seats for this spesific booking"
-            for seat in reserved_seats:
-                cache.delete(f"lock:{booking.showtime.id}:{seat.id}")
-            
-            booking.status = "CANCELLED" 
+            with transaction.atomic():
+                if not Booking.objects.filter(id=booking.id, status="PENDING").update(status="CANCELLED"):
+                    booking.refresh_from_db(fields=["status"]) # expired or paid meanwhile: its seats are not ours to free anymore
+                    return booking
+                BookingService._update_counters(booking.showtime_id, held=-booking.quantity)
+            booking.status = "CANCELLED"
+
+            reserved_seats = list(booking.seats.all()) # "gimme all seats for this spesific booking"
+            SeatLock.release(booking.showtime, reserved_seats, booking.user_id)
+            BookingExpiry.unschedule(booking.id)
 
-        booking.save()
         return booking
 
+
+    @staticmethod
+    def expire_booking(booking: Booking):
+        """ Hold time is over: PENDING -> EXPIRED and free its seats. Returns False if the booking already moved on (paid/cancelled) """
+
+        # conditional UPDATE, so we never overwrite a booking that got CONFIRMED/CANCELLED at the same moment
+        with transaction.atomic():
+            expired = Booking.objects.filter(id=booking.id, status="PENDING").update(status="EXPIRED")
+            if not expired:
+                return False
+            BookingService._update_counters(booking.showtime_id, held=-booking.quantity)
+        booking.status = "EXPIRED"
+
+        # the locks are normally already gone by themselves, this clears whatever is left (only ours) and the held bits
+        SeatLock.release(booking.showtime, list(booking.seats.all()), booking.user_id)
+        BookingExpiry.unschedule(booking.id)
+        return True
+
+
+    # ---Shared by make_booking and amake_booking (no I/O in the checks, so both versions use them as they are)---
+    @staticmethod
+    def _check_showtime(showtime: Showtime, quantity: int, seat_ids: list[int] | None):
+        # 1. Check if movie is already over or started
+        if showtime.end_at < timezone.now(): #if current time is after ending time
+            raise ValidationError("The movie is already finished")
+        
+        if showtime.start_at < timezone.now(): #if current time is more than starting line time
+            raise ValidationError("The movie is already started")
+        
+        
+        # 2. Check if the quantity is equal to how much seat selected (nothing to compare when we pick the seats ourselves)
+        if seat_ids is not None and quantity != len(seat_ids):
+            raise ValidationError(f"Quantity ({quantity}) must match seat count ({len(seat_ids)})")
+
+    @staticmethod
+    def _select_seats(showtime: Showtime, seat_ids: list[int]):
+        # Load every selected seat ONCE, the DB computes the state flags in the same query (instead of 1 query per check below):
+        # in_hall = belongs to the hall of this showtime ; sold = already has a Ticket for this showtime ; is_broken is a normal column
+        return Seat.objects.filter(id__in=seat_ids).annotate(
+            in_hall=ExpressionWrapper(Q(hall_id=showtime.hall_id), output_field=BooleanField()),
+            sold=Exists(Ticket.objects.filter(showtime_id=showtime.id, seat_id=OuterRef("pk"))), # served by the unique (showtime, seat) index
+        )
+
+    @staticmethod
+    def _check_seats(showtime: Showtime, seat_ids: list[int], selected_seats: list[Seat]):
+        """ Returns the seats (rows) that passed every check """
+        # 3. check if inputted seatid(by user) is indeed belong to that spesific hall
+        # (if showtime 1 plays in hall "IMAX 1" and range seat is 1-50, means if user choose beside ID 1-50, return error)
+        # 7. Fallback: this also catches IDs that don't exist in the DB at all (they are simply missing from the list)
+        seat_found = [seat for seat in selected_seats if seat.in_hall] # keep the rows, we need their position in the grid later
+        if len(seat_found) != len(seat_ids):
+            raise ValidationError("One or more seats do not belong to the hall for this showtime")
+        
+
+        # 4. find out if the spesific showtime is already full
+        BookingService._check_seats_left(showtime, len(seat_ids))
+        
+
+        # 5. Check if the seat is already taken 
+        if any(seat.sold for seat in seat_found):
+            raise ValidationError("One or more seats are already sold")
+        
+
+        # 6. check if selected seat is broken
+        if any(seat.is_broken for seat in seat_found):
+            raise ValidationError("This seat is currently under maintenance")
+
+        return seat_found
+
+    @staticmethod
+    def _check_seats_left(showtime: Showtime, count: int):
+        # the counters live on the showtime row itself (broken seats already excluded), so no counting over Ticket history
+        seats_left = showtime.sellable_capacity - showtime.sold_count - showtime.held_count
+
+        if count > seats_left: # case: if seats already sold 49/50, then a person buy 2 tickets
+            raise ValidationError(f"Not enough seats available. Only {seats_left} seats left")
+
+    @staticmethod
+    def _pick_best(showtime: Showtime, quantity: int, user: User):
+        """
+        Best available: lock the best free block of `quantity` adjacent seats in one row (centre first).
+        If someone locks part of it before us, try the next best block instead of failing the request
+        """
+        BookingService._check_seats_left(showtime, quantity)
+        sold, held = SeatMap.snapshot(showtime) # the bitmaps already know what is sold/held, only the grid comes from the DB
+        grid = SeatGrid(showtime.hall, showtime.hall.seat_set.all(), sold, held)
+
+        while block := grid.best_block(quantity):
+            conflicts = SeatLock.acquire(showtime, block, user.id)
+            if not conflicts:
+                return block
+            grid.take([seat for seat in block if seat.id in conflicts]) # lost these seats, the next try skips them
+        raise ValidationError(f"No {quantity} adjacent seats left in one row, please choose your seats")
+
+    @staticmethod
+    async def _apick_best(showtime: Showtime, quantity: int, user: User):
+        BookingService._check_seats_left(showtime, quantity)
+        sold, held = await SeatMap.asnapshot(showtime)
+        grid = SeatGrid(showtime.hall, [seat async for seat in showtime.hall.seat_set.all()], sold, held)
+
+        while block := grid.best_block(quantity):
+            conflicts = await SeatLock.aacquire(showtime, block, user.id)
+            if not conflicts:
+                return block
+            grid.take([seat for seat in block if seat.id in conflicts])
+        raise ValidationError(f"No {quantity} adjacent seats left in one row, please choose your seats")
+
+    @staticmethod
+    def _check_conflicts(conflicts: dict, user: User):
+        if conflicts:
+            if user.id in conflicts.values():
+                raise ValidationError(f"You already have a pending booking for these seats. Please pay for the existing one")
+            raise ValidationError(f"Seat {sorted(conflicts)} is on hold by someone else.")
+
+    @staticmethod
+    def _create_pending(user: User, showtime: Showtime, quantity: int, seat_ids: list[int]):
+        with transaction.atomic():
+            # 1. makes a row in Booking table. Let's say it gets ID: 100
+            new_booking = Booking.objects.create(
+                user = user,
+                showtime = showtime,
+                quantity = quantity,
+                final_price = showtime.price * quantity, # whatever user pays on this day is recorded
+                status = "PENDING"
+            )
+
+            # 2. Then fill that hidden bridge table (seats to booking) directly, in 1 INSERT
+            # It says: "Make a new connection: Booking 100 <-> Seat 5 and Booking 100 <-> Seat 6"
+            # (`.set()` would first SELECT the current links, but a brand new booking has none)
+            Booking.seats.through.objects.bulk_create([
+                Booking.seats.through(booking_id=new_booking.id, seat_id=s_id) for s_id in seat_ids
+            ])
+
+            BookingService._update_counters(showtime.id, held=quantity)
+        return new_booking
+
+    @staticmethod
+    def _update_counters(showtime_id: int, sold: int = 0, held: int = 0): # private, only the booking lifecycle above moves these numbers
+        # F() makes the DB do the math (sold_count = sold_count + 2), so 2 requests at the same time can't overwrite each other
+        if sold or held:
+            Showtime.objects.filter(id=showtime_id).update(
+                sold_count=F("sold_count") + sold,
+                held_count=F("held_count") + held,
+            )
+        if sold:
+            transaction.on_commit(OccupancyCache.invalidate) # a sale or a refund: the manager's occupancy report is out of date
+
+
+    @staticmethod
+    def _issue_tickets(booking: Booking, seat_ids: list[int]):
+        # The unique (showtime, seat) constraint is the last guard: if any seat is already sold the whole INSERT fails, nothing half-done
+        try:
+            with transaction.atomic(): # savepoint, so the outer transaction is still usable after the error
+                Ticket.objects.bulk_create([
+                    Ticket(booking=booking, showtime_id=booking.showtime_id, seat_id=s_id) for s_id in seat_ids
+                ])
+        except IntegrityError:
+            raise ValidationError("One or more seats are already sold")
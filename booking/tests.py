@@ -1,3 +1,703 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, AsyncClient, override_settings
+from django_redis import get_redis_connection
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from cinema.testing import QueryBudgetMixin
+from identity.models import User
+from screening.models import Movie, Showtime, Seat
+from screening.services import HallService, ShowtimeService, SeatService, ScreeningAnalytic
+from . import feed as feed_module
+from .feed import SeatFeed, RESET
+from .locks import SeatLock, SeatMap, BookingExpiry, WaitingRoom, HOLD_TIMEOUT, get_async_redis_connection
+from .models import Booking, Ticket
+from .services import BookingService
+from .views import BookingAPIView
+
+
+class BookingFixtures:
+    """ Shared setup: 1 hall (5x5), 1 upcoming showtime and 2 customers. Redis keys of the showtime are wiped before/after each test """
+
+    def setUp(self):
+        self.customer = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+        self.other = User.objects.create_user(email="other@test.com", username="other1", password="pass12345")
+
+        movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01")
+        self.hall = HallService.save_hall(name="Hall 1", seats_per_row=5, seats_per_column=5, screen_type="STANDARD")
+        self.showtime = ShowtimeService.save_showtime(movie=movie, hall=self.hall, start_at=timezone.now() + timedelta(days=1), price=10)
+        self.seats = list(Seat.objects.filter(hall=self.hall))
+
+        self.clear_redis()
+        self.addCleanup(self.clear_redis)
+
+    def clear_redis(self):
+        SeatLock.release(self.showtime, self.seats)
+        SeatMap.forget([self.showtime.id])
+        for booking_id in Booking.objects.values_list("id", flat=True): # keep the expiry queue clean for the next test
+            BookingExpiry.unschedule(booking_id)
+
+    def fresh_showtime(self):
+        # same as what the API does: showtime (and its hall) loaded by BookingWriteSerializer
+        return Showtime.objects.select_related("hall").get(id=self.showtime.id)
+
+    def book(self, user, seats):
+        return BookingService.make_booking(user=user, showtime=self.fresh_showtime(), quantity=len(seats), seat_ids=[seat.id for seat in seats])
+
+
+class BookingTestData(BookingFixtures, TestCase):
+    pass
+
+
+class MakeBookingValidationTest(BookingTestData):
+    def test_query_budget(self):
+        # 1 SELECT for all seat checks, then SAVEPOINT + INSERT booking + INSERT seats + UPDATE counters + RELEASE
+        showtime = self.fresh_showtime()
+        with self.assertNumQueries(6):
+            BookingService.make_booking(user=self.customer, showtime=showtime, quantity=3, seat_ids=[seat.id for seat in self.seats[:3]])
+
+    def test_seat_from_other_hall(self):
+        other_hall = HallService.save_hall(name="Hall 2", seats_per_row=1, seats_per_column=1, screen_type="STANDARD")
+        with self.assertRaisesMessage(ValidationError, "do not belong to the hall"):
+            self.book(self.customer, [Seat.objects.get(hall=other_hall)])
+
+    def test_unknown_seat(self):
+        with self.assertRaisesMessage(ValidationError, "do not belong to the hall"):
+            BookingService.make_booking(user=self.customer, showtime=self.fresh_showtime(), quantity=1, seat_ids=[0])
+
+    def test_sold_seat(self):
+        BookingService.confirm_booking(self.book(self.customer, self.seats[:1]))
+        with self.assertRaisesMessage(ValidationError, "already sold"):
+            self.book(self.other, self.seats[:1])
+
+    def test_sold_twice_is_stopped_by_the_constraint(self):
+        # 2 PENDING bookings end up on the same seat (ex: the lock expired and was taken again): the checks before the INSERT
+        # can't see it, the unique (showtime, seat) constraint must refuse the 2nd sale and undo its status change
+        BookingService.confirm_booking(self.book(self.customer, self.seats[:1]))
+        late = Booking.objects.create(user=self.other, showtime=self.showtime, quantity=1, final_price=10)
+        late.seats.set(self.seats[:1])
+        get_redis_connection("default").set(SeatLock.key(self.showtime.id, self.seats[0].id), self.other.id) # his lock, as confirm expects
+        late = Booking.objects.select_related("showtime__hall").get(id=late.id)
+
+        with self.assertRaisesMessage(ValidationError, "One or more seats are already sold"):
+            BookingService.confirm_booking(late)
+        self.assertEqual(Booking.objects.get(id=late.id).status, "PENDING") # rolled back with the failed INSERT
+        self.assertEqual(Ticket.objects.filter(showtime=self.showtime, seat=self.seats[0]).count(), 1)
+        self.assertEqual(Showtime.objects.values_list("sold_count", flat=True).get(id=self.showtime.id), 1)
+
+    def test_broken_seat(self):
+        self.seats[0].is_broken = True
+        self.seats[0].save()
+        with self.assertRaisesMessage(ValidationError, "under maintenance"):
+            self.book(self.customer, self.seats[:1])
+
+    def test_held_seat(self):
+        self.book(self.customer, self.seats[:2])
+        with self.assertRaisesMessage(ValidationError, "on hold by someone else"):
+            self.book(self.other, self.seats[1:3])
+        with self.assertRaisesMessage(ValidationError, "already have a pending booking"):
+            self.book(self.customer, self.seats[1:2])
+
+
+class BestAvailableTest(BookingTestData):
+    """ No seat_ids: the service picks the block of adjacent seats closest to the centre (5x5 hall -> centre is C3) """
+
+    def seat(self, label):
+        return next(seat for seat in self.seats if f"{seat.row_label}{seat.column_number}" == label)
+
+    def labels(self, booking):
+        return sorted(f"{seat.row_label}{seat.column_number}" for seat in booking.seats.all())
+
+    def best(self, user, quantity):
+        return BookingService.make_booking(user=user, showtime=self.fresh_showtime(), quantity=quantity)
+
+    def test_centre_block(self):
+        self.assertEqual(self.labels(self.best(self.customer, 3)), ["C2", "C3", "C4"])
+
+    def test_skips_taken_and_broken_seats(self):
+        self.book(self.other, [self.seat("C3")]) # held
+        self.assertEqual(self.labels(self.best(self.customer, 2)), ["B2", "B3"])
+
+        Seat.objects.filter(id=self.seat("D3").id).update(is_broken=True)
+        self.assertEqual(self.labels(self.best(self.customer, 3)), ["A2", "A3", "A4"]) # rows B, C and D have no 3 free seats in a row anymore
+
+    def test_retries_next_block_on_conflict(self):
+        # someone holds C3 in Redis but the bitmap doesn't know yet (the race between our snapshot and our lock)
+        get_redis_connection("default").set(SeatLock.key(self.showtime.id, self.seat("C3").id), self.other.id)
+        self.assertEqual(self.labels(self.best(self.customer, 3)), ["B2", "B3", "B4"])
+
+    def test_no_block_left(self):
+        for row in "ABCDE":
+            self.book(self.other, [self.seat(f"{row}3")]) # cut every row in 2 blocks of 2
+        with self.assertRaisesMessage(ValidationError, "No 3 adjacent seats left"):
+            self.best(self.customer, 3)
+        self.assertEqual(self.labels(self.best(self.customer, 2)), ["C1", "C2"])
+
+
+class BookingExpiryTest(BookingTestData):
+    """ expire_bookings worker + the races of a booking that is paid or cancelled while it expires (only 1 move may count) """
+
+    def counters(self):
+        return tuple(Showtime.objects.filter(id=self.showtime.id).values_list("sold_count", "held_count").get())
+
+    def stale(self, booking):
+        return Booking.objects.select_related("showtime__hall").get(id=booking.id) # what the other process still has in memory
+
+    def run_worker(self):
+        call_command("expire_bookings", "--once", stdout=StringIO())
+
+    def test_worker_expires_due_bookings(self):
+        due, fresh = self.book(self.customer, self.seats[:2]), self.book(self.other, self.seats[2:3])
+        BookingExpiry.schedule(due.id, time.time() - 1)
+
+        self.run_worker()
+        self.assertEqual(Booking.objects.get(id=due.id).status, "EXPIRED")
+        self.assertEqual(Booking.objects.get(id=fresh.id).status, "PENDING")
+        self.assertEqual(self.counters(), (0, 1))
+        self.assertEqual(SeatLock.holders(self.showtime.id, [self.seats[0].id, self.seats[1].id]), {self.seats[0].id: None, self.seats[1].id: None})
+        self.assertEqual(set(SeatMap.holds(self.fresh_showtime())[1]), {self.seats[2].id})
+
+    def test_sweep_catches_unqueued_bookings(self):
+        booking = self.book(self.customer, self.seats[:1])
+        BookingExpiry.unschedule(booking.id) # ex: Redis was flushed
+        Booking.objects.filter(id=booking.id).update(created_at=timezone.now() - timedelta(seconds=HOLD_TIMEOUT + 1))
+
+        self.run_worker()
+        self.assertEqual(Booking.objects.get(id=booking.id).status, "EXPIRED")
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_paid_during_sweep(self):
+        booking = self.book(self.customer, self.seats[:1])
+        stale = self.stale(booking)
+        BookingService.confirm_booking(booking)
+
+        self.assertFalse(BookingService.expire_booking(stale))
+        self.assertEqual(Booking.objects.get(id=booking.id).status, "CONFIRMED")
+        self.assertEqual(self.counters(), (1, 0))
+
+    def test_cancelled_during_sweep(self):
+        booking = self.book(self.customer, self.seats[:1])
+        stale = self.stale(booking)
+        BookingService.cancel_booking(booking)
+
+        self.assertFalse(BookingService.expire_booking(stale))
+        self.assertEqual(self.counters(), (0, 0)) # held_count moved once, not twice
+
+    def test_cancel_after_expiry(self):
+        booking = self.book(self.customer, self.seats[:1])
+        stale = self.stale(booking)
+        BookingService.expire_booking(booking)
+
+        self.assertEqual(BookingService.cancel_booking(stale).status, "EXPIRED")
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_confirm_after_expiry(self):
+        # the worker already committed EXPIRED but didn't reach Redis yet, so the locks still look like ours
+        booking = self.book(self.customer, self.seats[:1])
+        Booking.objects.filter(id=booking.id).update(status="EXPIRED")
+
+        with self.assertRaisesMessage(ValidationError, "already EXPIRED"):
+            BookingService.confirm_booking(booking)
+        self.assertFalse(Ticket.objects.filter(booking=booking).exists())
+
+
+class HoldIndexTest(BookingTestData):
+    """ The per-showtime hold index follows the locks, and the seat map reads it instead of the lock keys """
+
+    def index(self):
+        return SeatMap.holds(self.fresh_showtime())[1]
+
+    def statuses(self):
+        return {row["seat_id"]: row["status"] for row in ScreeningAnalytic.hall_seats_layout(self.showtime.id)}
+
+    def test_follows_the_locks(self):
+        booking = self.book(self.customer, self.seats[:2])
+        holds = self.index()
+        self.assertEqual(set(holds), {self.seats[0].id, self.seats[1].id})
+        self.assertEqual({user_id for user_id, _ in holds.values()}, {self.customer.id})
+        self.assertTrue(all(deadline > time.time() + HOLD_TIMEOUT - 5 for _, deadline in holds.values()))
+        self.assertEqual(self.statuses()[self.seats[0].id], "Yellow")
+
+        BookingService.cancel_booking(booking)
+        self.assertEqual(self.index(), {})
+        self.assertEqual(self.statuses()[self.seats[0].id], "Green")
+
+    def test_expired_hold_is_pruned(self):
+        # the lock expired by itself, only its index entry (deadline in the past) is left
+        SeatMap.snapshot(self.fresh_showtime())
+        get_redis_connection("default").hset(SeatMap.holds_key(self.showtime.id), self.seats[0].id, f"{self.other.id}:{int(time.time()) - 1}")
+
+        self.assertEqual(self.statuses()[self.seats[0].id], "Green")
+        self.assertEqual(self.index(), {})
+
+    def test_rebuilt_on_cold_start(self):
+        self.book(self.customer, self.seats[:1])
+        SeatMap.forget([self.showtime.id]) # Redis lost the bitmaps and the index, the locks are still there
+        self.assertEqual(list(self.index()), [self.seats[0].id])
+
+
+class SeatMapPollingTest(BookingTestData):
+    """ Compact seat map: 1 letter per seat, then only what changed since the client's version (or a 304) """
+
+    def poll(self, since=None, expect=200):
+        response = self.client.get(f"/screening/showtimes/{self.showtime.id}/seats", {"since": since} if since is not None else {})
+        self.assertEqual(response.status_code, expect, response.content)
+        return response.data
+
+    def test_full_then_deltas(self):
+        seat_map = self.poll()
+        self.assertEqual((seat_map["rows"], seat_map["columns"], seat_map["seats"]), (5, 5, "G" * 25))
+        version = seat_map["version"]
+
+        with self.assertNumQueries(0): # nothing changed: 1 Redis GET
+            self.poll(since=version, expect=304)
+
+        booking = self.book(self.customer, self.seats[:2])
+        delta = self.poll(since=version)
+        self.assertEqual(delta["changes"], [[0, "Y"], [1, "Y"]])
+
+        BookingService.confirm_booking(booking)
+        self.assertEqual(self.poll(since=delta["version"])["changes"], [[0, "R"], [1, "R"]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SeatService.update_seat(Seat.objects.get(hall=self.hall, row_label="E", column_number=5), is_broken=True)
+        latest = self.poll(since=version) # several changes since: each seat once, with its state now
+        self.assertEqual(latest["changes"], [[0, "R"], [1, "R"], [24, "X"]])
+        self.assertEqual(self.poll()["seats"], "RR" + "G" * 22 + "X")
+
+    def test_old_version_gets_the_full_map(self):
+        version = self.poll()["version"]
+        SeatMap.forget([self.showtime.id]) # Redis lost the map: rebuilt from Postgres, the history starts over
+        seat_map = self.poll(since=version)
+        self.assertIn("seats", seat_map)
+        self.assertGreater(seat_map["version"], version)
+
+
+class SeatFeedTest(BookingTestData):
+    """ Live seat map: every hold/sale/release is published once and reaches the SSE clients of this process """
+
+    async def next_change(self, queue):
+        return await asyncio.wait_for(queue.get(), timeout=2)
+
+    async def test_booking_lifecycle_is_published(self):
+        showtime = await sync_to_async(self.fresh_showtime)()
+        feed = SeatFeed.get()
+        queue = await feed.subscribe(showtime)
+        try:
+            booking = await sync_to_async(self.book)(self.customer, self.seats[:2])
+            version, changes = await self.next_change(queue)
+            self.assertEqual(changes, [[0, "Y"], [1, "Y"]])
+
+            await sync_to_async(BookingService.cancel_booking)(booking)
+            self.assertEqual(await self.next_change(queue), (version + 1, [[0, "G"], [1, "G"]]))
+            self.assertTrue(queue.empty())
+        finally:
+            feed.unsubscribe(showtime.id, queue)
+        self.assertEqual(feed.tasks, []) # last client gone: no Redis subscription left
+
+    @override_settings(SEAT_FEED_QUEUE_SIZE=2)
+    async def test_slow_client_gets_a_reset(self):
+        showtime = await sync_to_async(self.fresh_showtime)()
+        feed = SeatFeed.get()
+        queue = await feed.subscribe(showtime)
+        try:
+            for version in range(3):
+                feed.publish(showtime.id, (version, [[0, "Y"]]))
+            self.assertEqual(queue.qsize(), 1)
+            self.assertIs(queue.get_nowait(), RESET)
+        finally:
+            feed.unsubscribe(showtime.id, queue)
+
+    @override_settings(SEAT_FEED_SWEEP=0.1)
+    async def test_expired_hold_is_published(self):
+        showtime = await sync_to_async(self.fresh_showtime)()
+        feed = SeatFeed.get()
+        queue = await feed.subscribe(showtime)
+        try:
+            await SeatLock.aacquire(showtime, self.seats[:1], self.customer.id, timeout=1)
+            self.assertEqual((await self.next_change(queue))[1], [[0, "Y"]])
+            self.assertEqual((await asyncio.wait_for(queue.get(), timeout=4))[1], [[0, "G"]]) # nobody released it, the sweep did
+        finally:
+            feed.unsubscribe(showtime.id, queue)
+
+    @override_settings(SEAT_FEED_READY_TIMEOUT=0.2)
+    async def test_listener_survives_errors(self):
+        showtime = await sync_to_async(self.fresh_showtime)()
+        connect = feed_module.get_async_redis_connection
+        attempts = []
+
+        def flaky_connection():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RedisTimeoutError("Redis is busy")
+            return connect()
+
+        feed = SeatFeed.get()
+        with patch.object(feed_module, "get_async_redis_connection", flaky_connection), self.assertLogs("booking.feed", "ERROR"):
+            queue = await feed.subscribe(showtime) # doesn't hang while the subscription is down
+            try:
+                self.assertIs(await asyncio.wait_for(queue.get(), timeout=4), RESET) # back up: fresh map, changes may be lost
+                await sync_to_async(self.book)(self.customer, self.seats[:1])
+                self.assertEqual((await self.next_change(queue))[1], [[0, "Y"]])
+            finally:
+                feed.unsubscribe(showtime.id, queue)
+
+    async def test_bad_message_resets_its_clients(self):
+        showtime = await sync_to_async(self.fresh_showtime)()
+        feed = SeatFeed.get()
+        queue = await feed.subscribe(showtime)
+        try:
+            with self.assertLogs("booking.feed", "WARNING"):
+                await get_async_redis_connection().publish(SeatMap.feed_channel(showtime.id), "garbage")
+                self.assertIs(await self.next_change(queue), RESET)
+            await sync_to_async(self.book)(self.customer, self.seats[:1]) # the listener is still alive
+            self.assertEqual((await self.next_change(queue))[1], [[0, "Y"]])
+        finally:
+            feed.unsubscribe(showtime.id, queue)
+
+    @override_settings(SEAT_FEED_SWEEP=0.1)
+    async def test_sweep_survives_errors(self):
+        showtime = await sync_to_async(self.fresh_showtime)()
+        feed = SeatFeed.get()
+        queue = await feed.subscribe(showtime)
+        try:
+            await SeatLock.aacquire(showtime, self.seats[:1], self.customer.id, timeout=1)
+            self.assertEqual((await self.next_change(queue))[1], [[0, "Y"]])
+            aholds, failures = SeatMap.aholds, []
+
+            async def failing_once(showtime):
+                if not failures:
+                    failures.append(1)
+                    raise RuntimeError("Redis hiccup")
+                return await aholds(showtime)
+
+            with patch.object(SeatMap, "aholds", failing_once), self.assertLogs("booking.feed", "ERROR"):
+                self.assertEqual((await asyncio.wait_for(queue.get(), timeout=4))[1], [[0, "G"]])
+        finally:
+            feed.unsubscribe(showtime.id, queue)
+
+    async def test_stream_endpoint(self):
+        response = await AsyncClient().get(f"/screening/showtimes/{self.showtime.id}/seats/stream", headers={"Accept": "text/event-stream"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+
+        first = (await asyncio.wait_for(anext(events), timeout=2)).decode()
+        self.assertIn("event: seats", first)
+        self.assertIn('"seats":"' + "G" * 25 + '"', first)
+
+        await sync_to_async(self.book)(self.customer, self.seats[24:])
+        change = (await asyncio.wait_for(anext(events), timeout=2)).decode()
+        self.assertIn('"changes":[[24,"Y"]]', change)
+        waiting = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        waiting.cancel() # client hangs up: the ASGI server cancels the response
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(SeatFeed.get().subscribers)
+
+        missing = await AsyncClient().get("/screening/showtimes/999999/seats/stream", headers={"Accept": "text/event-stream"})
+        self.assertEqual(missing.status_code, 404)
+
+
+class ConcurrentBookingTest(BookingFixtures, TransactionTestCase):
+    """ Real threads with their own DB connections (so TransactionTestCase): the race must never sell a seat twice """
+
+    def race(self, attempts, confirm=False):
+        """ attempts = [(user, seats), ...] all started at the same moment. Returns how many of them got their seats """
+        start = threading.Barrier(len(attempts))
+        won = []
+
+        def customer(user, seats):
+            start.wait()
+            try:
+                booking = self.book(user, seats)
+                if confirm:
+                    BookingService.confirm_booking(booking)
+                won.append(user)
+            except ValidationError:
+                pass
+            finally:
+                connections.close_all() # this thread's own connection
+
+        threads = [threading.Thread(target=customer, args=attempt) for attempt in attempts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(won)
+
+    def test_same_seats_sold_once(self):
+        users = [User.objects.create_user(email=f"racer{i}@test.com", username=f"racer{i}", password="pass12345") for i in range(8)]
+        self.assertEqual(self.race([(user, self.seats[:2]) for user in users], confirm=True), 1)
+
+        self.assertEqual(Ticket.objects.filter(showtime=self.showtime).count(), 2)
+        self.showtime.refresh_from_db()
+        self.assertEqual((self.showtime.sold_count, self.showtime.held_count), (2, 0))
+
+    def test_overlapping_holds(self):
+        # [A1, A2] vs [A2, A3] at the same time: A2 decides, and the loser must not keep A1 or A3 either (all-or-nothing)
+        self.assertEqual(self.race([(self.customer, self.seats[0:2]), (self.other, self.seats[1:3])]), 1)
+        self.assertEqual(Booking.objects.filter(status="PENDING").count(), 1)
+        holders = SeatLock.holders(self.showtime.id, [seat.id for seat in self.seats[:3]])
+        self.assertEqual(len({holder for holder in holders.values() if holder}), 1)
+
+    def test_load_harness(self):
+        out = StringIO()
+        call_command("loadtest_bookings", processes=2, threads=2, attempts=40, customers=5, rows=3, columns=3, stdout=out)
+        self.assertIn("Integrity OK", out.getvalue())
+        self.assertIn("attempts/s", out.getvalue())
+
+
+class WaitingRoomTest(BookingTestData):
+    """ Queue of a hot showtime: admitted at the gate's rate, then 1 pass = 1 booking, for its owner only """
+
+    def setUp(self):
+        super().setUp()
+        Showtime.objects.filter(id=self.showtime.id).update(queue_enabled=True)
+        self.redis = get_redis_connection("default")
+        self.addCleanup(self.redis.delete, *WaitingRoom._keys(self.showtime.id)) # the passes expire by themselves
+        self.client = APIClient()
+
+    def admitted(self, user):
+        token = WaitingRoom.join(self.showtime.id)
+        WaitingRoom.position(self.showtime.id, token, user.id) # 1st poll starts the gate clock
+        self.redis.hset(WaitingRoom._keys(self.showtime.id)[2], "tick", time.time() - 60) # a minute went by: the gate reached us
+        self.assertEqual(WaitingRoom.position(self.showtime.id, token, user.id), 0)
+        return token
+
+    def post_booking(self, user, token, seats):
+        self.client.force_authenticate(user)
+        return self.client.post("/booking", {"showtime": self.showtime.id, "quantity": len(seats), "seat_ids": [seat.id for seat in seats]},
+                                format="json", HTTP_X_QUEUE_TOKEN=token)
+
+    @override_settings(WAITING_ROOM_ADMIT_RATE=1)
+    def test_admission_rate(self):
+        tokens = [WaitingRoom.join(self.showtime.id) for _ in range(3)]
+        self.assertEqual([WaitingRoom.position(self.showtime.id, token, self.customer.id) for token in tokens], [1, 2, 3])
+        self.redis.hset(WaitingRoom._keys(self.showtime.id)[2], "tick", time.time() - 2.5) # 2.5s at 1/s: 2 more are let in
+        self.assertEqual([WaitingRoom.position(self.showtime.id, token, self.customer.id) for token in tokens], [0, 0, 1])
+        self.assertIsNone(WaitingRoom.position(self.showtime.id, "unknown", self.customer.id))
+
+    def test_no_pass_no_booking(self):
+        token = WaitingRoom.join(self.showtime.id) # in the queue, but not admitted yet
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[:1]).status_code, 429)
+        self.assertEqual(self.post_booking(self.customer, None, self.seats[:1]).status_code, 429)
+
+    def test_pass_is_single_use(self):
+        token = self.admitted(self.customer)
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[:1]).status_code, 201)
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[1:2]).status_code, 429)
+        self.assertIsNone(WaitingRoom.position(self.showtime.id, token, self.customer.id)) # polling can't get a new pass either
+
+    def test_pass_belongs_to_its_user(self):
+        token = self.admitted(self.customer)
+        self.assertEqual(self.post_booking(self.other, token, self.seats[:1]).status_code, 429)
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[:1]).status_code, 201) # the owner still has it
+
+    def test_pass_expires(self):
+        token = self.admitted(self.customer)
+        self.redis.delete(WaitingRoom.pass_key(self.showtime.id, token)) # PASS_TIMEOUT went by without a booking
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[:1]).status_code, 429)
+
+    def test_failed_booking_gives_the_pass_back(self):
+        self.book(self.other, self.seats[:1])
+        token = self.admitted(self.customer)
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[:1]).status_code, 400) # seat taken
+        self.assertGreater(self.redis.ttl(WaitingRoom.pass_key(self.showtime.id, token)), 0)
+        self.assertEqual(self.post_booking(self.customer, token, self.seats[1:2]).status_code, 201)
+
+    async def test_parallel_claims(self):
+        token = await sync_to_async(self.admitted)(self.customer)
+        claims = await asyncio.gather(*(WaitingRoom.aclaim(self.showtime.id, token, self.customer.id) for _ in range(5)))
+        self.assertEqual(sum(claim is not None for claim in claims), 1)
+
+
+class IdempotencyTest(BookingTestData):
+    """ Idempotency-Key on POST /booking: a retry replays the 1st response instead of booking twice """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.run_id = uuid.uuid4().hex # user ids repeat from 1 test database to the next, the keys stored in Redis don't go away
+        self.addCleanup(lambda: cache.delete_many([self.cache_key(f"k{n}") for n in range(1, 7)]))
+
+    def post_booking(self, key, seats):
+        return self.client.post("/booking", {"showtime": self.showtime.id, "quantity": len(seats), "seat_ids": [seat.id for seat in seats]},
+                                format="json", HTTP_IDEMPOTENCY_KEY=f"{self.run_id}-{key}")
+
+    def cache_key(self, key):
+        return f"idem:{self.customer.pk}:/booking:{self.run_id}-{key}"
+
+    def test_retry_replays_the_response(self):
+        first = self.post_booking("k1", self.seats[:1])
+        retry = self.post_booking("k1", self.seats[:1])
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.content), (201, first.content))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Booking.objects.filter(user=self.customer).count(), 1)
+
+    def test_same_key_other_body(self):
+        self.post_booking("k2", self.seats[:1])
+        self.assertEqual(self.post_booking("k2", self.seats[1:2]).status_code, 422)
+        self.assertEqual(Booking.objects.filter(user=self.customer).count(), 1)
+
+    def test_duplicate_in_flight_waits_then_replays(self):
+        first = self.post_booking("k3", self.seats[:1])
+        stored = cache.get(self.cache_key("k3"))
+        # replay the moment the duplicate arrives while the 1st is still running: in-flight marker, no response yet
+        cache.delete(self.cache_key("k3"))
+        cache.add(f"{self.cache_key('k3')}:inflight", 1)
+        threading.Timer(0.3, cache.set, args=(self.cache_key("k3"), stored)).start() # the 1st finishes while we wait
+
+        retry = self.post_booking("k3", self.seats[:1])
+        self.assertEqual((retry.status_code, retry.content, retry["Idempotent-Replayed"]), (201, first.content, "true"))
+        self.assertEqual(Booking.objects.filter(user=self.customer).count(), 1)
+
+    def test_in_flight_too_long(self):
+        cache.add(f"{self.cache_key('k4')}:inflight", 1)
+        self.addCleanup(cache.delete, f"{self.cache_key('k4')}:inflight")
+        with patch.object(BookingAPIView, "idempotency_wait", 0.3):
+            self.assertEqual(self.post_booking("k4", self.seats[:1]).status_code, 409)
+
+    def test_429_is_not_stored(self):
+        Showtime.objects.filter(id=self.showtime.id).update(queue_enabled=True)
+        self.assertEqual(self.post_booking("k5", self.seats[:1]).status_code, 429) # no waiting room pass
+        self.assertIsNone(cache.get(self.cache_key("k5")))
+
+        Showtime.objects.filter(id=self.showtime.id).update(queue_enabled=False)
+        self.assertEqual(self.post_booking("k5", self.seats[:1]).status_code, 201) # the same key runs for real now
+
+    def test_5xx_is_not_stored(self):
+        self.client.raise_request_exception = False
+        with patch.object(BookingService, "amake_booking", side_effect=RuntimeError("database went away")):
+            self.assertEqual(self.post_booking("k6", self.seats[:1]).status_code, 500)
+        self.assertIsNone(cache.get(self.cache_key("k6")))
+        self.assertEqual(self.post_booking("k6", self.seats[:1]).status_code, 201)
+
+
+class BookingQueryBudgetTest(QueryBudgetMixin, BookingFixtures, TestCase):
+    """ Every booking URL, with 1, 10 and 100 bookings behind it: the query count must not follow the row count """
+
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+
+    def grow_bookings(self, n, user=None):
+        """ Bookings of `user` (customer by default): the first ones CONFIRMED with a ticket, the rest PENDING """
+        user = user or self.customer
+        existing = Booking.objects.filter(user=user).count()
+        bookings = Booking.objects.bulk_create([
+            Booking(user=user, showtime=self.showtime, quantity=1, final_price=10, status="CONFIRMED" if i < 5 else "PENDING")
+            for i in range(existing, n)
+        ])
+        Booking.seats.through.objects.bulk_create([
+            Booking.seats.through(booking_id=booking.id, seat_id=self.seats[i % len(self.seats)].id) for i, booking in enumerate(bookings)
+        ])
+        taken = set(Ticket.objects.values_list("seat_id", flat=True))
+        free = [seat for seat in self.seats if seat.id not in taken]
+        Ticket.objects.bulk_create([
+            Ticket(booking=booking, showtime=self.showtime, seat=free.pop()) for booking in bookings if booking.status == "CONFIRMED"
+        ])
+
+    def test_booking_list(self):
+        self.assertQueryBudget("/booking", self.grow_bookings, budget=3, user=self.customer) # page + seats + tickets
+
+    def test_booking_create(self):
+        free_seats = iter(self.seats)
+        self.assertQueryBudget(
+            "/booking", lambda n: self.grow_bookings(n, user=self.other), budget=9, user=self.customer, method="post",
+            data=lambda: {"showtime": self.showtime.id, "quantity": 1, "seat_ids": [next(free_seats).id]},
+        )
+
+    def test_booking_detail(self):
+        self.grow_bookings(1)
+        booking = Booking.objects.filter(user=self.customer).first()
+        self.assertQueryBudget(f"/booking/{booking.id}", self.grow_bookings, budget=3, user=self.customer)
+
+    def test_queue_position(self):
+        Showtime.objects.filter(id=self.showtime.id).update(queue_enabled=True)
+        token = WaitingRoom.join(self.showtime.id)
+        self.addCleanup(get_redis_connection("default").delete, *WaitingRoom._keys(self.showtime.id), WaitingRoom.pass_key(self.showtime.id, token))
+        self.assertQueryBudget(f"/booking/queue/{self.showtime.id}?token={token}", self.grow_bookings, budget=0, user=self.customer)
+
+    def test_admin_booking_list(self):
+        self.assertQueryBudget("/booking/adm", self.grow_bookings, budget=4, user=self.manager) # + the Manager group check
+
+    def test_admin_booking_detail(self):
+        self.grow_bookings(1)
+        booking = Booking.objects.filter(user=self.customer).first()
+        self.assertQueryBudget(f"/booking/adm/{booking.id}", self.grow_bookings, budget=4, user=self.manager)
+
+
+class BookingPaginationTest(BookingTestData):
+    """ The lists are walked with a cursor: every row comes exactly once, even with ties on created_at and inserts while paging """
+
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def make_bookings(self, count):
+        return Booking.objects.bulk_create([
+            Booking(user=self.customer, showtime=self.showtime, quantity=1, final_price=10, status="CANCELLED") for _ in range(count)
+        ])
+
+    def test_walk_all_pages(self):
+        self.make_bookings(30)
+        Booking.objects.update(created_at=timezone.now()) # worst case: the cursor field ties for every row, only "id" orders them
+        expected = list(Booking.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+
+        seen, url = [], "/booking/adm?page_size=7"
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 7)
+            seen += [booking["id"] for booking in page["results"]]
+            self.make_bookings(2) # new bookings land before the cursor, the next page must not shift
+            url = page["next"]
+
+        self.assertEqual(seen, expected)
+
+        back, url = [booking["id"] for booking in page["results"]], page["previous"] # and back from the last page: the new bookings come first
+        while url:
+            page = self.client.get(url).json()
+            back = [booking["id"] for booking in page["results"]] + back
+            url = page["previous"]
+        self.assertEqual(back, list(Booking.objects.order_by("-created_at", "-id").values_list("id", flat=True)))
+
+    def test_tampered_cursor(self):
+        self.make_bookings(3)
+        def cursor(*values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+        for bad in ["not-base64!", cursor("yesterday", 1, False), cursor(timezone.now().isoformat(), "abc", False),
+                    cursor(None, 1, False), cursor([1], 1, False), cursor(1, False)]:
+            response = self.client.get("/booking/adm", {"cursor": bad})
+            self.assertEqual(response.status_code, 404, bad)
+            self.assertEqual(response.json()["detail"], "Invalid cursor")
+
+    def test_page_size_is_capped(self):
+        self.make_bookings(120)
+        page = self.client.get("/booking/adm?page_size=1000").json()
+        self.assertEqual(len(page["results"]), 100)
+        self.assertIsNotNone(page["next"])
@@ -1,9 +1,10 @@
 from django.urls import path
-from .views import BookingAPIView, BookingItemAPIView, AdminBookingAPIView, AdminBookingItemAPIView
+from .views import BookingAPIView, BookingItemAPIView, BookingQueueAPIView, AdminBookingAPIView, AdminBookingItemAPIView
 
 urlpatterns = [
     path("", BookingAPIView.as_view(), name="booking-list"), # booking list and post handled here
     path("/<int:pk>", BookingItemAPIView.as_view(), name="booking-detail"), # booking detail and delete handled here
+    path("/queue/<int:showtime_id>", BookingQueueAPIView.as_view(), name="booking-queue"), # waiting room: join (POST) and poll position (GET)
 
     path("/adm", AdminBookingAPIView.as_view(), name="adm-booking-list"),
     path("/adm/<int:pk>", AdminBookingItemAPIView.as_view(), name="adm-booking-detail")
@@ -1,4 +1,6 @@
 from rest_framework.views import APIView
+from adrf.views import APIView as AsyncAPIView
+from asgiref.sync import sync_to_async
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated # only logged-in users can book or see bookings
@@ -6,39 +8,62 @@ from django.shortcuts import get_object_or_404
 from drf_spectacular.utils import extend_schema, extend_schema_view
 
 from .models import Booking
-from .serializers import BookingWriteSerializer, BookingReadSerializer, BookingResponseSerializer, MessageSerializer
+from .serializers import BookingWriteSerializer, BookingReadSerializer, BookingResponseSerializer, MessageSerializer, QueueStatusSerializer
 from .services import BookingService
 from .permissions import IsManager
+from .locks import WaitingRoom
+from screening.models import Showtime
+from cinema.idempotency import IdempotencyMixin, IDEMPOTENCY_HEADER
+from cinema.async_views import serialize
+from cinema.pagination import KeysetPagination, apaginate, paginated, PAGINATION_PARAMETERS
 
 
 @extend_schema_view(
-    get=extend_schema(summary="List All Bookings", responses={200: BookingReadSerializer(many=True)}),
-    post=extend_schema(summary="Create a New Booking", request=BookingWriteSerializer, responses={201: BookingResponseSerializer})
+    get=extend_schema(summary="List All Bookings", responses={200: paginated(BookingReadSerializer)}, parameters=PAGINATION_PARAMETERS),
+    post=extend_schema(summary="Create a New Booking", request=BookingWriteSerializer, responses={201: BookingResponseSerializer}, parameters=[IDEMPOTENCY_HEADER])
 )
-class BookingAPIView(APIView): 
+# Async (ASGI): the booking hot path, a request waiting on Redis/Postgres doesn't hold a whole worker anymore
+class BookingAPIView(IdempotencyMixin, AsyncAPIView): 
     permission_classes = [IsAuthenticated]
     
-    def get(self, request):
-        bookings = Booking.objects.filter(user=request.user) # Make sure the owner ID matches this specific person's ID
-        serializer = BookingReadSerializer(bookings, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    async def get(self, request):
+        paginator = KeysetPagination() # 1 page at a time, newest first: a regular's history only grows
+        bookings = await apaginate(paginator, BookingReadSerializer.eager_load(Booking.objects.filter(user=request.user)), request, self) # Make sure the owner ID matches this specific person's ID
+        data = await serialize(BookingReadSerializer(bookings, many=True))
+        return paginator.get_paginated_response(data)
 
-    def post(self, request):
+    async def post(self, request):
         serializer = BookingWriteSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        await sync_to_async(serializer.is_valid)(raise_exception=True) # the showtime ID is looked up in the DB here
+        showtime = serializer.validated_data.get("showtime")
+
+        # Waiting room: for hot showtimes only customers that the queue already let in can reach the booking engine
+        # The pass is taken up front (atomically), so parallel requests with the same token can't all book
+        queue_token = request.headers.get("X-Queue-Token")
+        claim = None
+        if showtime.queue_enabled:
+            claim = await WaitingRoom.aclaim(showtime.id, queue_token, request.user.id)
+            if claim is None:
+                return Response({
+                    "error": "This showtime is in high demand. Please join the waiting room and wait for your turn."
+                }, status=status.HTTP_429_TOO_MANY_REQUESTS)
         
         # DRF already turned the ID into an Object
-        booking = BookingService.make_booking(
-            booking=None, 
-            user=request.user,  # we pass the user from the request into our service (this prevents users from booking for someone else)
-            showtime=serializer.validated_data.get("showtime"),
-            quantity=serializer.validated_data.get("quantity"),
-            seat_ids=serializer.validated_data.get("seat_ids"),
-        )
+        try:
+            booking = await BookingService.amake_booking(
+                user=request.user,  # we pass the user from the request into our service (this prevents users from booking for someone else)
+                showtime=showtime,
+                quantity=serializer.validated_data.get("quantity"),
+                seat_ids=serializer.validated_data.get("seat_ids"),
+            )
+        except Exception:
+            if claim:
+                await WaitingRoom.arestore(showtime.id, queue_token, request.user.id, claim) # nothing was booked: 1 pass = 1 booking still holds
+            raise
         # We return the Readonly version because it shows the "seats" field
         return Response({
             "message": "Booking successfully created, you have 10 minutes to complete the Payment",
-            "booking": BookingReadSerializer(booking).data # returning read bcoz expected output is diff to the input
+            "booking": await serialize(BookingReadSerializer(booking)) # returning read bcoz expected output is diff to the input
         },status=status.HTTP_201_CREATED)
     
 
@@ -50,7 +75,7 @@ class BookingItemAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        booking = get_object_or_404(Booking, pk=pk, user=request.user) # This returns 404 "Not Found" if the ID is wrong OR the User is wrong
+        booking = get_object_or_404(BookingReadSerializer.eager_load(Booking.objects), pk=pk, user=request.user) # This returns 404 "Not Found" if the ID is wrong OR the User is wrong
         serializer = BookingReadSerializer(booking)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
@@ -60,10 +85,32 @@ class BookingItemAPIView(APIView):
         return Response({"message": "Booking cancelled"}, status=status.HTTP_200_OK) # we change status not delete. so user can see it in their history later
 
 
+@extend_schema_view(
+    post=extend_schema(summary="Join the waiting room of a high-demand showtime", request=None, responses={201: QueueStatusSerializer}),
+    get=extend_schema(summary="Check your position in the waiting room (?token=...)", responses={200: QueueStatusSerializer}),
+)
+class BookingQueueAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, showtime_id):
+        get_object_or_404(Showtime, pk=showtime_id, queue_enabled=True) # only showtimes that opted-in have a queue
+        token = WaitingRoom.join(showtime_id)
+        position = WaitingRoom.position(showtime_id, token, request.user.id)
+        return Response({"token": token, "position": position, "admitted": position == 0}, status=status.HTTP_201_CREATED)
+
+    # Clients poll this a lot, so it only talks to Redis (no Postgres query)
+    def get(self, request, showtime_id):
+        token = request.query_params.get("token", "")
+        position = WaitingRoom.position(showtime_id, token, request.user.id)
+        if position is None:
+            return Response({"error": "Unknown queue token, please join the waiting room again."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"token": token, "position": position, "admitted": position == 0}, status=status.HTTP_200_OK)
+
+
 #-------------------- ADMIN --------------------
 
 @extend_schema_view(
-    get=extend_schema(summary="Admin: To see the whole customer bookings", responses={200: BookingReadSerializer(many=True)}), 
+    get=extend_schema(summary="Admin: To see the whole customer bookings", responses={200: paginated(BookingReadSerializer)}, parameters=PAGINATION_PARAMETERS),
 )
 # Advancing admin dashboard soon !!!
 class AdminBookingAPIView(APIView):
@@ -71,9 +118,10 @@ class AdminBookingAPIView(APIView):
     # Admin dont need POST to keep data clean(let user do).
 
     def get(self, request):
-        bookings = Booking.objects.all().order_by("-created_at")
+        paginator = KeysetPagination() # the paginator orders by (-created_at, -id) itself
+        bookings = paginator.paginate_queryset(BookingReadSerializer.eager_load(Booking.objects.all()), request, view=self)
         serializer = BookingReadSerializer(bookings, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
 
 
 @extend_schema_view(
@@ -85,7 +133,7 @@ class AdminBookingItemAPIView(APIView):
     permission_classes = [IsAuthenticated, IsManager]
 
     def get(self, request, pk):
-        booking = get_object_or_404(Booking, pk=pk) # Managers can see ANY booking, so no user=request.user filter
+        booking = get_object_or_404(BookingReadSerializer.eager_load(Booking.objects), pk=pk) # Managers can see ANY booking, so no user=request.user filter
         serializer = BookingReadSerializer(booking)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
@@ -0,0 +1,23 @@
+# Shared by the apps: helpers for the async (ASGI) views
+# Django runs a view either fully sync or fully async, so every handler of an async APIView must be `async def`.
+# Only the hot reads/writes are really async (async ORM + redis.asyncio), the rest just moves its old sync code to a thread
+
+import functools
+
+from asgiref.sync import sync_to_async
+
+
+def sync_handler(handler):
+    """
+    Keep a normal (sync) handler inside an async APIView, ex: the POST/PATCH/DELETE next to an async GET.
+    It runs in a worker thread, so the event loop is never blocked by its ORM calls
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, request, *args, **kwargs):
+        return await sync_to_async(handler)(self, request, *args, **kwargs)
+    return wrapper
+
+
+async def serialize(serializer):
+    """ `serializer.data` may still hit the DB (nested objects, SerializerMethodField), which is not allowed inside the event loop """
+    return await sync_to_async(lambda: serializer.data)()
@@ -0,0 +1,125 @@
+# Shared by the apps: makes POST endpoints safe to retry (mobile clients resend on timeouts)
+# The client sends an `Idempotency-Key` header ; the 1st response is saved in Redis and replayed byte-for-byte on every retry
+
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from drf_spectacular.utils import OpenApiParameter
+
+
+# Swagger: document the header on every endpoint that uses the mixin
+IDEMPOTENCY_HEADER = OpenApiParameter(
+    name="Idempotency-Key", type=str, location=OpenApiParameter.HEADER, required=False,
+    description="Any unique string (ex: a UUID). Retrying with the same key replays the first response instead of running the request again.",
+)
+
+
+class IdempotentReplay(Exception):
+    """ Not an error: carries the stored response out of `initial()` so the view can return it without running the handler """
+    def __init__(self, response):
+        self.response = response
+
+
+class IdempotencyConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still being processed, retry in a moment."
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used with a different request body."
+
+
+class IdempotencyMixin:
+    """
+    Put it BEFORE APIView:  class PaymentPostAPIView(IdempotencyMixin, APIView)
+    - 1st request with a key runs normally, its response is stored (24h)
+    - a retry gets the stored response, the handler (and Stripe) is never called twice
+    - a duplicate arriving while the 1st is still running waits for it instead of running in parallel
+    """
+    idempotency_methods = ("POST",)
+    idempotency_timeout = 60 * 60 * 24 # how long a response can be replayed
+    idempotency_lock_timeout = 60 # in-flight marker, in case the worker dies in the middle
+    idempotency_wait = 10 # seconds a duplicate waits for the 1st request to finish
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs) # authentication and permissions first, so keys are per user
+
+        key = request.headers.get("Idempotency-Key")
+        if request.method not in self.idempotency_methods or not key:
+            return
+
+        cache_key = f"idem:{request.user.pk}:{request.path}:{key}"
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+
+        stored = cache.get(cache_key)
+        if stored is None and not cache.add(f"{cache_key}:inflight", 1, timeout=self.idempotency_lock_timeout):
+            stored = self._wait_for(cache_key) # somebody else is running this exact request right now
+
+        if stored is not None:
+            if stored["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReused()
+            response = HttpResponse(stored["content"], status=stored["status"], content_type=stored["content_type"])
+            response["Idempotent-Replayed"] = "true"
+            raise IdempotentReplay(response)
+
+        self._idempotency = (cache_key, fingerprint) # we are the 1st one, dispatch() will store our response
+
+    def _wait_for(self, cache_key):
+        deadline = time.monotonic() + self.idempotency_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return stored
+            if cache.add(f"{cache_key}:inflight", 1, timeout=self.idempotency_lock_timeout):
+                return None # the 1st one gave up without a response (server error), so we run it ourselves
+        raise IdempotencyConflict()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, IdempotentReplay):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def dispatch(self, request, *args, **kwargs):
+        self._idempotency = None
+        if getattr(self, "view_is_async", False): # async APIView: super().dispatch() gives a coroutine, not a response
+            return self._async_dispatch(request, *args, **kwargs)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except Exception:
+            self._release() # crashed (Django turns it into a 500 later): a retry must be able to run, not wait on our marker
+            raise
+        return self._store(response)
+
+    async def _async_dispatch(self, request, *args, **kwargs):
+        try:
+            response = await super().dispatch(request, *args, **kwargs)
+        except Exception:
+            await sync_to_async(self._release)()
+            raise
+        return await sync_to_async(self._store)(response)
+
+    def _release(self):
+        if self._idempotency:
+            cache.delete(f"{self._idempotency[0]}:inflight")
+
+    def _store(self, response):
+        if self._idempotency:
+            cache_key, fingerprint = self._idempotency
+            # 5xx (our fault) and 429 (not let in yet) never really ran, so a retry is allowed to run again
+            if response.status_code < 500 and response.status_code != status.HTTP_429_TOO_MANY_REQUESTS:
+                response.render() # turn it into the final bytes now, so the replay is exactly the same
+                cache.set(cache_key, {
+                    "fingerprint": fingerprint,
+                    "status": response.status_code,
+                    "content": response.content,
+                    "content_type": response["Content-Type"],
+                }, timeout=self.idempotency_timeout)
+        self._release()
+        return response
@@ -0,0 +1,160 @@
+# Shared by the apps: cursor (keyset) pagination for the list endpoints whose tables only grow (bookings, payments, users...)
+# A page is "WHERE (created_at, id) < (<last row seen>) ORDER BY created_at DESC, id DESC LIMIT n" on an index,
+# so page 1000 costs the same as page 1 (an OFFSET would read and throw away every row before it),
+# and a row inserted while the client pages never shifts, repeats or hides a row of the next pages
+#
+# Response: {"next": <url or null>, "previous": <url or null>, "results": [...]} ; ?page_size=... (default PAGE_SIZE in settings, max 100)
+#
+# Not DRF's CursorPagination: it only keys on the 1st ordering field and counts an OFFSET inside ties,
+# which repeats rows when many share the same created_at and new rows come in between 2 pages
+
+import base64
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from drf_spectacular.utils import OpenApiParameter, inline_serializer
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    `ordering` is the key of the cursor and must end with "id", so 2 rows never tie (the index behind it lives on the model's Meta).
+    The cursor carries the key of the last (or first, going back) row of the page, never an offset
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    ordering = ("-created_at", "-id") # newest first
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        key, backwards = self.decode_cursor(request, queryset.model)
+
+        ordering = [self.flip(field) for field in self.ordering] if backwards else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if key is not None:
+            queryset = queryset.filter(self.after(ordering, key))
+
+        rows = list(queryset[:page_size + 1]) # 1 extra row only to know if there is a next page
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+
+        # going forward there is a previous page if we came from a cursor, going back there always is a next page (the one we came from)
+        self.next_key = self.key_of(rows[-1]) if rows and (has_more if not backwards else True) else None
+        self.previous_key = self.key_of(rows[0]) if rows and (key is not None if not backwards else has_more) else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.link(self.next_key, backwards=False),
+            "previous": self.link(self.previous_key, backwards=True),
+            "results": data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    # ---The cursor: base64 of [key values..., backwards]---
+    def key_of(self, row):
+        return [getattr(row, field.lstrip("-")) for field in self.ordering]
+
+    def link(self, key, backwards):
+        if key is None:
+            return None
+        cursor = base64.urlsafe_b64encode(json.dumps([*key, backwards], default=self.encode_value).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    @staticmethod
+    def encode_value(value):
+        # datetimes keep their microseconds (DjangoJSONEncoder cuts them to ms, then the cursor would skip rows of that ms)
+        return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            *key, backwards = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if len(key) != len(self.ordering) or not isinstance(backwards, bool):
+            raise NotFound("Invalid cursor")
+
+        # the cursor comes from the client: parse each value with its model field here (a bad date or id is a 404 like
+        # any broken cursor), instead of letting the ORM choke on it in the middle of the query (500)
+        try:
+            key = [model._meta.get_field(field.lstrip("-")).to_python(value) for field, value in zip(self.ordering, key)]
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if any(value is None for value in key):
+            raise NotFound("Invalid cursor")
+        return key, backwards
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def after(ordering, key):
+        """ Rows strictly after `key` in `ordering`: (a > x) OR (a = x AND b > y) ... = a row comparison Postgres runs on the index """
+        condition, equal = Q(), {}
+        for field, value in zip(ordering, key):
+            name = field.lstrip("-")
+            condition |= Q(**equal, **{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+            equal[name] = value
+        return condition
+
+
+class ShowtimePagination(KeysetPagination):
+    ordering = ("start_at", "id") # the next screenings first
+
+
+class OccupancyPagination(KeysetPagination):
+    ordering = ("-start_at", "-id") # the occupancy dashboard lists the latest screenings first (same index, read backwards)
+
+
+class UserPagination(KeysetPagination):
+    ordering = ("-date_joined", "-id")
+
+
+class MoviePagination(KeysetPagination):
+    ordering = ("-id",) # newest added first, the PK is already the index
+
+
+async def apaginate(paginator: KeysetPagination, queryset, request, view):
+    """ paginator.paginate_queryset() for the async views: the page is read with the sync ORM, so it goes to a thread """
+    return await sync_to_async(paginator.paginate_queryset)(queryset, request, view=view)
+
+
+# ---OpenAPI (the list views are plain APIViews, so drf-spectacular can't see the paginator by itself)---
+PAGINATION_PARAMETERS = [
+    OpenApiParameter("cursor", str, description="Opaque cursor taken from the `next`/`previous` link of the previous page"),
+    OpenApiParameter("page_size", int, description="Rows per page (max 100)"),
+]
+
+
+def paginated(serializer_class):
+    """ Schema of one page of `serializer_class` rows """
+    return inline_serializer(
+        name=f"Paginated{serializer_class.__name__}",
+        fields={
+            "next": serializers.URLField(allow_null=True),
+            "previous": serializers.URLField(allow_null=True),
+            "results": serializer_class(many=True),
+        },
+    )
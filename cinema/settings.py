@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres', # range fields + the showtime exclusion constraint
     'screening.apps.ScreeningConfig', # we register manually, so django can access
     'booking.apps.BookingConfig',
     'payment.apps.PaymentConfig',
@@ -57,6 +58,7 @@ INSTALLED_APPS = [
     'rest_framework', # DRF
     'rest_framework_simplejwt.token_blacklist', # So that people can actually log out
     'drf_spectacular', # Swagger/Redoc
+    'adrf', # async APIView (ASGI hot paths: booking, seat map, catalog GETs)
 ]
 
 # like "app/Http/Middleware" in laravel
@@ -177,9 +179,11 @@ AUTH_USER_MODEL = 'identity.User'
 # Django Rest Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'identity.authentication.CachedJWTAuthentication', # simplejwt without the user query per request (user rows cached in-process)
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema', #Swagger/Redoc
+    'DEFAULT_PAGINATION_CLASS': 'cinema.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('PAGE_SIZE', '20')), # rows per page of the list endpoints (cinema/pagination.py), clients can ask up to 100
 }
 
 from datetime import timedelta
@@ -210,6 +214,29 @@ CACHES = {
 
 
 
+# Waiting room (only for showtimes with `queue_enabled`): how many queued customers may enter the booking per second,
+# and how long (seconds) an admitted customer has to send his booking before the pass is gone
+WAITING_ROOM_ADMIT_RATE = float(os.getenv('WAITING_ROOM_ADMIT_RATE', '5'))
+WAITING_ROOM_PASS_TIMEOUT = int(os.getenv('WAITING_ROOM_PASS_TIMEOUT', '120'))
+
+# In-process cache of the user rows behind the JWTs (identity/authentication.py): how many users per worker, and how long (seconds)
+# another worker may keep serving a user's old row after it changed
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+# How long (seconds) a page of the manager's occupancy report is served from Redis (dropped sooner when a booking is confirmed/cancelled)
+OCCUPANCY_CACHE_TTL = int(os.getenv('OCCUPANCY_CACHE_TTL', '30'))
+
+# Live seat map (booking/feed.py): seconds between 2 keepalive comments on an idle stream, changes queued per client before
+# it gets a full map instead, seconds between 2 sweeps of the holds that expired by themselves, and seconds a new stream waits
+# for the Redis subscription before it starts anyway (it gets a fresh map once the subscription is up)
+SEAT_FEED_KEEPALIVE = float(os.getenv('SEAT_FEED_KEEPALIVE', '15'))
+SEAT_FEED_QUEUE_SIZE = int(os.getenv('SEAT_FEED_QUEUE_SIZE', '64'))
+SEAT_FEED_SWEEP = float(os.getenv('SEAT_FEED_SWEEP', '5'))
+SEAT_FEED_READY_TIMEOUT = float(os.getenv('SEAT_FEED_READY_TIMEOUT', '5'))
+
+
+
 # Swagger/Redoc docs
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Cinema Management System API',
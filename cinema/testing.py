@@ -0,0 +1,37 @@
+# Shared by the apps' tests: catches N+1 queries before they ship
+# Every endpoint is called with 1, 10 and 100 rows behind it, the number of SQL queries must stay the same (and under a budget)
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+SIZES = (1, 10, 100)
+
+
+class QueryBudgetMixin:
+    def assertQueryBudget(self, url, grow, budget: int, user=None, method: str = "get", data=None):
+        """
+        `grow(n)` must bring the rows the endpoint renders up to n ; `url` and `data` can be callables (ex: a fresh body for every POST).
+        Fails if the query count changes between 1, 10 and 100 rows (= 1 query per row somewhere) or goes above `budget`
+        """
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+
+        counts, queries = {}, {}
+        for size in SIZES:
+            grow(size)
+            path = url() if callable(url) else url
+            body = data() if callable(data) else data
+            with CaptureQueriesContext(connection) as context:
+                response = getattr(client, method)(path, body, format="json") if body is not None else getattr(client, method)(path)
+            self.assertLess(response.status_code, 300, f"{method.upper()} {path} -> {response.status_code}: {response.content[:300]}")
+            counts[size], queries[size] = len(context), [query["sql"] for query in context.captured_queries]
+
+        largest = queries[SIZES[-1]]
+        if len(set(counts.values())) > 1:
+            self.fail(f"{method.upper()} {path}: query count grows with the rows {counts}, last run:\n" + "\n".join(largest[:15]))
+        self.assertLessEqual(
+            counts[SIZES[-1]], budget,
+            f"{method.upper()} {path}: {counts[SIZES[-1]]} queries, budget is {budget}:\n" + "\n".join(largest),
+        )
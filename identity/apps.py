@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class IdentityConfig(AppConfig):
     name = 'identity'
+
+    def ready(self):
+        from . import signals # noqa: F401 (connects the receivers that revoke the JWT roles on group changes)
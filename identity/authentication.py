@@ -0,0 +1,77 @@
+# JWT authentication without a "SELECT ... FROM identity_user WHERE id = ..." on every request
+# simplejwt's JWTAuthentication loads the user row each time. Here the row is kept in a small in-process LRU cache (USER_CACHE_SIZE rows,
+# USER_CACHE_TTL seconds) and every request gets a fresh User object built from it, so request.user still works everywhere
+# (FK filters, Booking.objects.create(user=...), serializers), it just doesn't cost a query.
+#
+# Invalidation: signals.py forgets a user whenever his row is saved or deleted (UserService.save_user, the admin, login's last_login...).
+# That only clears THIS process (and a queryset .update() sends no signal): the other workers drop their copy at the latest
+# USER_CACHE_TTL seconds later (ex: a deactivated account)
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+
+class UserCache:
+    """
+    str(user id) -> the values of his row, least recently used rows go first when full. Thread-safe (sync views run in threads).
+    Keys are strings because that is how simplejwt writes the user id claim
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size, self.ttl = size, ttl
+        self.fields = [field.attname for field in User._meta.concrete_fields]
+        self.rows = OrderedDict() # user_id -> (expires_at, values)
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self.lock:
+            entry = self.rows.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.rows[key]
+                return None
+            self.rows.move_to_end(key)
+        return User.from_db(DEFAULT_DB_ALIAS, self.fields, entry[1]) # a new object per request, nobody shares (or mutates) the cached one
+
+    def put(self, user):
+        values = tuple(getattr(user, field) for field in self.fields)
+        with self.lock:
+            self.rows[str(user.pk)] = (time.monotonic() + self.ttl, values)
+            self.rows.move_to_end(str(user.pk))
+            while len(self.rows) > self.size:
+                self.rows.popitem(last=False)
+
+    def forget(self, user_id):
+        with self.lock:
+            self.rows.pop(str(user_id), None)
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+
+
+user_cache = UserCache(size=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user = user_cache.get(validated_token.get(api_settings.USER_ID_CLAIM))
+        if user is None:
+            user = super().get_user(validated_token) # the usual checks (unknown id, inactive account) only run on a miss
+            user_cache.put(user) # only active users get here, a deactivation saves the row and drops it from the cache
+        return user
+
+
+class CachedJWTScheme(SimpleJWTScheme): # Swagger: same "Bearer" scheme as simplejwt's class
+    target_class = "identity.authentication.CachedJWTAuthentication"
@@ -0,0 +1,39 @@
+# One-off, after deploying the Redis blacklist (identity/tokens.py): empties simplejwt's token_blacklist tables
+# Tokens that are blacklisted AND still alive are copied to Redis first, so nobody gets a logged-out session back
+# Safe to run twice. Once it reported 0 rows, 'rest_framework_simplejwt.token_blacklist' can leave INSTALLED_APPS
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from identity.tokens import TokenBlacklist
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "Move the still-valid blacklisted refresh tokens to Redis and empty the token_blacklist tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be moved and deleted")
+
+    def handle(self, *args, **options):
+        alive = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list("token__jti", "token__expires_at")
+        outstanding = OutstandingToken.objects.count()
+        if options["dry_run"]:
+            self.stdout.write(f"Would copy {alive.count()} live blacklisted token(s) to Redis and delete {outstanding} outstanding token row(s)")
+            return
+
+        moved = 0
+        for jti, expires_at in alive.iterator(chunk_size=BATCH_SIZE):
+            TokenBlacklist.add(jti, int(expires_at.timestamp()))
+            moved += 1
+
+        # BlacklistedToken first (nothing points at it, so 1 DELETE), then the outstanding rows by batches to keep transactions short
+        BlacklistedToken.objects.all().delete()
+        deleted = 0
+        while batch := list(OutstandingToken.objects.values_list("id", flat=True)[:BATCH_SIZE]):
+            OutstandingToken.objects.filter(id__in=batch).delete()
+            deleted += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Copied {moved} live blacklisted token(s) to Redis, deleted {deleted} outstanding token row(s)"))
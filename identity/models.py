@@ -16,6 +16,11 @@ class User(AbstractUser):
     USERNAME_FIELD = "email" #by default it uses username for login, we force to use Email 
     REQUIRED_FIELDS = ["username"] #When create a user in the terminal (CMD), you must ask to type username too (DB demand it)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=["date_joined", "id"], name="user_joined_id_idx"), # keyset pagination of the admin user list
+        ]
+
 
     def __str__(self):
         return self.email
@@ -1,6 +1,5 @@
 from rest_framework import permissions
-from typing import cast
-from identity.models import User
+from .roles import has_role
 
 class IsOwner(permissions.BasePermission):
     """ Checks if the person asking is the owner of the specific Account """
@@ -11,5 +10,4 @@ class IsOwner(permissions.BasePermission):
 class IsManager(permissions.BasePermission):
     """ Allows access only to users in the 'Manager' group. """
     def has_permission(self, request, view):
-        user = cast(User, request.user) # make sure pylance know that user has group attribute
-        return user.groups.filter(name="Manager").exists() 
+        return has_role(request, "Manager") # read from the JWT claims, no DB query
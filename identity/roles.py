@@ -0,0 +1,51 @@
+# Roles (= the user's group names) travel inside the JWT, so the permission classes don't ask the DB on every request
+# Login/register issue RoleRefreshToken, its access token carries the same "roles" claim
+#
+# Revocation: when the groups of a user change (admin page, shell...), signals.py calls revoke_roles():
+# a Redis mark "roles changed at <time>" makes every token whose roles were read before it lose them (checked only when a claim GRANTS a role)
+# Refreshing (/identity/refresh) always reads the roles again, so an old refresh token never mints an access token with the old roles.
+# After that he simply logs in again (or refreshes) and gets the new roles
+
+import time
+
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+
+from .tokens import RefreshToken
+
+ROLES_CLAIM = "roles"
+ROLES_AT_CLAIM = "roles_at" # when the roles were read, to the microsecond ("iat" is rounded to the second)
+
+
+def roles_changed_key(user_id: int):
+    return f"identity:roles_changed:{user_id}"
+
+
+class RoleRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[ROLES_CLAIM] = sorted(user.groups.values_list("name", flat=True)) # copied into the access token too
+        token[ROLES_AT_CLAIM] = time.time()
+        return token
+
+
+def has_role(request, role: str):
+    """ Is the requester in the `role` group? Read from the token, the DB is only asked for requests without a roles claim """
+    token = request.auth
+    roles = token.get(ROLES_CLAIM) if token is not None else None
+    if roles is None:
+        # session login, force_authenticate in tests, or a token issued before roles were put in the claims: same query as before
+        return request.user.groups.filter(name=role).exists()
+
+    if role not in roles:
+        return False # a claim can only be too generous after a demotion, never too strict (a promotion needs a new login anyway)
+    changed_at = cache.get(roles_changed_key(token[api_settings.USER_ID_CLAIM]))
+    return changed_at is None or token.get(ROLES_AT_CLAIM, 0) > changed_at # read after the last change of his groups
+
+
+def revoke_roles(user_ids):
+    """ The groups of these users changed: the roles inside their current tokens can't be trusted anymore """
+    now = time.time()
+    # a mark older than the access token lifetime is useless (every token issued before it has expired)
+    cache.set_many({roles_changed_key(user_id): now for user_id in user_ids}, timeout=int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()) + 1)
@@ -21,6 +21,10 @@ class WriteNonModelSerializer(serializers.Serializer):
     # We skip validate_password here because the Service/Authenticate will check if it's correct.
 
 
+class RefreshTokenSerializer(serializers.Serializer): # logout and refresh only need the refresh token
+    refresh = serializers.CharField()
+
+
 class WriteModelSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True) # dont show it when display result to user
 
@@ -66,3 +70,7 @@ class MessageSerializer(serializers.Serializer):
 
 class IdentityResponseSerializer(MessageSerializer): # only call in post/patch
     identity = ReadUserSerializer()
+
+class TokenPairResponseSerializer(MessageSerializer):
+    refresh = serializers.CharField()
+    access = serializers.CharField()
@@ -1,5 +1,8 @@
 from .models import User
-from rest_framework.exceptions import ValidationError, PermissionDenied
+from rest_framework.exceptions import ValidationError, PermissionDenied, AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .roles import RoleRefreshToken
 from django.db.models import Q
 from django.contrib.auth import authenticate
 
@@ -102,4 +105,26 @@ class UserService:
         if not user:
             raise ValidationError("Invalid email or password")
         return user
-    
\ No newline at end of file
+    
+
+
+    @staticmethod
+    def refresh_tokens(refresh_token: str | None=None):
+        """ A used refresh token for a new pair. Nothing goes to Postgres except reading the user (roles are read again too) """
+        try:
+            old_refresh = RoleRefreshToken(refresh_token) # signature, expiry, type and the Redis blacklist are checked here
+        except TokenError:
+            raise AuthenticationFailed("Invalid or expired refresh token, please log in again")
+
+        user = User.objects.filter(id=old_refresh[api_settings.USER_ID_CLAIM], is_active=True).first()
+        if not user:
+            raise AuthenticationFailed("This account is not active anymore")
+
+        # rotation: a refresh token works once. If 2 requests race with the same token, only the first one gets a new pair
+        if api_settings.BLACKLIST_AFTER_ROTATION and not old_refresh.blacklist():
+            raise AuthenticationFailed("This refresh token was already used, please log in again")
+
+        new_refresh = RoleRefreshToken.for_user(user)
+        if not api_settings.ROTATE_REFRESH_TOKENS:
+            return old_refresh, new_refresh.access_token # keep the same refresh token, only the access token is new
+        return new_refresh, new_refresh.access_token
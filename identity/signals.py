@@ -0,0 +1,37 @@
+# Keeps the JWTs honest: a change of who is in which group revokes the affected users' roles (roles.py),
+# and a changed user row leaves the in-process user cache (authentication.py)
+
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import User
+from .authentication import user_cache
+from .roles import revoke_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # user.groups.add(...) -> instance is the user ; group.user_set.add(...) -> instance is the group and pk_set are the users
+    if action in ("post_add", "post_remove"):
+        user_ids = list(pk_set) if reverse else [instance.pk]
+    elif action == "pre_clear": # pk_set is empty on clear, so take the members before they are gone
+        user_ids = list(instance.user_set.values_list("id", flat=True)) if reverse else [instance.pk]
+    else:
+        return
+    if user_ids:
+        transaction.on_commit(lambda: revoke_roles(user_ids)) # only once the change is really saved
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    user_ids = list(instance.user_set.values_list("id", flat=True))
+    if user_ids:
+        transaction.on_commit(lambda: revoke_roles(user_ids))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    user_cache.forget(instance.pk) # the next request reloads the row (profile edit, deactivation, deletion...)
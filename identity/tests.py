@@ -1,3 +1,187 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken as SimpleRefreshToken
+
+from cinema.testing import QueryBudgetMixin
+from .authentication import user_cache
+from .models import User
+from .roles import roles_changed_key
+from .services import UserService
+from .tokens import RefreshToken, TokenBlacklist
+
+
+class IdentityQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """ Every identity URL, with 1, 10 and 100 accounts behind it: the query count must not follow the row count """
+
+    def setUp(self):
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+        self.customer = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+
+    def grow_users(self, n):
+        User.objects.bulk_create([
+            User(email=f"user{i}@test.com", username=f"user{i}", password="!") for i in range(User.objects.count(), n)
+        ])
+
+    def new_account(self):
+        self.signups = getattr(self, "signups", 0) + 1
+        return {"email": f"new{self.signups}@test.com", "username": f"newuser{self.signups}", "password": "Str0ng-pass-123", "phone_number": f"0800{self.signups:04d}"}
+
+    def test_register(self):
+        self.assertQueryBudget("/identity/register", self.grow_users, budget=5, method="post", data=self.new_account)
+
+    def test_login(self):
+        self.assertQueryBudget("/identity/login", self.grow_users, budget=2, method="post", data={"email": "customer@test.com", "password": "pass12345"})
+
+    def test_profile(self):
+        self.assertQueryBudget("/identity/profile", self.grow_users, budget=0, user=self.customer)
+
+    def test_logout(self):
+        self.assertQueryBudget(
+            "/identity/logout", self.grow_users, budget=0, user=self.customer, method="post",
+            data=lambda: {"refresh": str(RefreshToken.for_user(self.customer))},
+        )
+
+    def test_refresh(self):
+        self.assertQueryBudget(
+            "/identity/refresh", self.grow_users, budget=2, method="post", # the user row + his groups for the roles claim
+            data=lambda: {"refresh": str(RefreshToken.for_user(self.customer))},
+        )
+
+    def test_admin_user_list(self):
+        self.assertQueryBudget("/identity/adm", self.grow_users, budget=2, user=self.manager)
+
+    def test_admin_user_detail(self):
+        self.assertQueryBudget(f"/identity/adm/{self.customer.id}", self.grow_users, budget=2, user=self.manager)
+
+
+class RoleClaimsTest(TestCase):
+    """ Roles come from the JWT: no group query per request, and a change of groups revokes the roles of the old tokens """
+
+    def setUp(self):
+        self.manager_group = Group.objects.create(name="Manager")
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(self.manager_group)
+        self.addCleanup(cache.delete, roles_changed_key(self.manager.id))
+
+    def login(self):
+        client = APIClient()
+        response = client.post("/identity/login", {"email": "manager@test.com", "password": "pass12345"}, format="json")
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        client.refresh_token = response.data["refresh"]
+        return client
+
+    def test_roles_are_read_from_the_token(self):
+        client = self.login()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(client.get("/identity/adm").status_code, 200)
+        self.assertFalse([query for query in context.captured_queries if "auth_group" in query["sql"]])
+
+    def test_group_change_revokes_old_tokens(self):
+        client = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.groups.remove(self.manager_group)
+        self.assertEqual(client.get("/identity/adm").status_code, 403)
+        refreshed = APIClient().post("/identity/refresh", {"refresh": client.refresh_token}, format="json")
+        self.assertEqual(AccessToken(refreshed.data["access"])["roles"], []) # a refresh reads the roles again, the old ones never come back
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager_group.user_set.add(self.manager) # promoted again (from the group side)
+        self.assertEqual(client.get("/identity/adm").status_code, 403) # the old token still can't be trusted
+        self.assertEqual(self.login().get("/identity/adm").status_code, 200) # a new login picks up the new roles
+
+
+class CachedUserAuthenticationTest(TestCase):
+    """ The user behind a JWT comes from the in-process cache, and leaves it as soon as his row changes """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query for query in context.captured_queries if 'FROM "identity_user"' in query["sql"]]
+
+    def test_user_row_read_once(self):
+        self.assertEqual(len(self.user_queries("/identity/profile")[1]), 1) # cold cache
+        response, queries = self.user_queries("/identity/profile")
+        self.assertEqual(queries, [])
+        self.assertEqual(response.data["email"], "customer@test.com")
+
+    def test_saved_user_is_reloaded(self):
+        self.user_queries("/identity/profile")
+        UserService.save_user(user=User.objects.get(id=self.user.id), username="renamed")
+        response, queries = self.user_queries("/identity/profile")
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.data["username"], "renamed")
+
+    def test_deactivated_user_is_refused(self):
+        self.user_queries("/identity/profile")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/identity/profile").status_code, 401)
+
+
+class RedisTokenBlacklistTest(TestCase):
+    """ Login/refresh/logout never write token rows to Postgres, the blacklist lives in Redis until the token expires """
+
+    def setUp(self):
+        User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post("/identity/login", {"email": "customer@test.com", "password": "pass12345"}, format="json")
+        self.addCleanup(cache.delete, TokenBlacklist.key(RefreshToken(response.data["refresh"], verify=False)["jti"]))
+        return response.data
+
+    def refresh(self, token):
+        return self.client.post("/identity/refresh", {"refresh": token}, format="json")
+
+    def test_refresh_token_works_once(self):
+        first = self.login()["refresh"]
+        response = self.refresh(first)
+        self.assertEqual(response.status_code, 200)
+        self.addCleanup(cache.delete, TokenBlacklist.key(RefreshToken(response.data["refresh"], verify=False)["jti"]))
+
+        self.assertEqual(self.refresh(first).status_code, 401) # rotated: the old one is blacklisted
+        self.assertEqual(self.refresh(response.data["refresh"]).status_code, 200)
+        self.assertEqual(OutstandingToken.objects.count(), 0)
+
+    def test_logout_blacklists_until_expiry(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.post("/identity/logout", {"refresh": tokens["refresh"]}, format="json").status_code, 200)
+        self.assertEqual(self.client.post("/identity/logout", {"refresh": tokens["refresh"]}, format="json").status_code, 400)
+        self.assertEqual(self.refresh(tokens["refresh"]).status_code, 401)
+
+        ttl = cache.ttl(TokenBlacklist.key(RefreshToken(tokens["refresh"], verify=False)["jti"]))
+        self.assertTrue(0 < ttl <= api_settings.REFRESH_TOKEN_LIFETIME.total_seconds() + 1)
+
+    def test_drain_old_tables(self):
+        user = User.objects.get(email="customer@test.com")
+        live, dead = SimpleRefreshToken.for_user(user), SimpleRefreshToken.for_user(user) # the old DB-backed tokens
+        live.blacklist()
+        OutstandingToken.objects.filter(jti=dead["jti"]).update(expires_at=timezone.now() - timedelta(days=1))
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=dead["jti"]))
+        self.addCleanup(cache.delete, TokenBlacklist.key(live["jti"]))
 
-# Create your tests here.
+        call_command("drain_token_blacklist", stdout=StringIO())
+        self.assertEqual((OutstandingToken.objects.count(), BlacklistedToken.objects.count()), (0, 0))
+        self.assertTrue(TokenBlacklist.contains(live["jti"])) # still logged out
+        self.assertFalse(TokenBlacklist.contains(dead["jti"])) # expired anyway, not copied
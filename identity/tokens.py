@@ -0,0 +1,52 @@
+# Refresh tokens with their blacklist in Redis instead of the `token_blacklist` tables
+# simplejwt's blacklist app INSERTs an OutstandingToken row for every login/refresh and looks rows up on every refresh, forever.
+# Here nothing is written at login, and a blacklisted token is 1 Redis key (its jti) that expires together with the token,
+# so the store only ever holds tokens that are still alive.
+# (the old tables are emptied once with `python manage.py drain_token_blacklist`)
+
+import time
+
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken as SimpleRefreshToken
+
+
+class TokenBlacklist:
+    @staticmethod
+    def key(jti: str):
+        return f"identity:blacklist:{jti}"
+
+    @staticmethod
+    def add(jti: str, exp: int):
+        """ True if the token was not blacklisted yet. Atomic (SET NX), so 2 refreshes racing with the same token can't both win """
+        remaining = int(exp - time.time()) + 1
+        if remaining <= 0:
+            return True # already expired, nothing to remember
+        return cache.add(TokenBlacklist.key(jti), 1, timeout=remaining)
+
+    @staticmethod
+    def contains(jti: str):
+        return cache.get(TokenBlacklist.key(jti)) is not None
+
+
+class RefreshToken(SimpleRefreshToken):
+    """ simplejwt's RefreshToken, minus its DB blacklist (super(BlacklistMixin, ...) jumps over the mixin that does the queries) """
+
+    @classmethod
+    def for_user(cls, user):
+        return super(BlacklistMixin, cls).for_user(user) # no OutstandingToken row
+
+    def verify(self, *args, **kwargs):
+        self.check_blacklist()
+        super(BlacklistMixin, self).verify(*args, **kwargs)
+
+    def check_blacklist(self):
+        if TokenBlacklist.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+    def blacklist(self):
+        return TokenBlacklist.add(self.payload[api_settings.JTI_CLAIM], self.payload["exp"])
+
+    def outstand(self):
+        return None # nothing is tracked per issued token anymore
@@ -3,14 +3,16 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny # only logged-in users can book or see bookings
 from typing import cast
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.shortcuts import get_object_or_404
 from drf_spectacular.utils import extend_schema, extend_schema_view
 
 from .models import User
-from .serializers import WriteModelSerializer, WriteNonModelSerializer, ReadUserSerializer, MessageSerializer, IdentityResponseSerializer
+from .serializers import WriteModelSerializer, WriteNonModelSerializer, ReadUserSerializer, MessageSerializer, IdentityResponseSerializer, RefreshTokenSerializer, TokenPairResponseSerializer
 from .services import UserService
 from .permissions import IsOwner, IsManager
+from .roles import RoleRefreshToken
+from .tokens import RefreshToken
+from cinema.pagination import UserPagination, paginated, PAGINATION_PARAMETERS
 
 
 @extend_schema_view(
@@ -65,7 +67,7 @@ class RegisterUserAPIView(APIView):
             password=serializer.validated_data.get("password")
         )
 
-        refresh = RefreshToken.for_user(register_user)
+        refresh = RoleRefreshToken.for_user(register_user) # the user's roles ride inside the tokens (see roles.py)
 
         return Response({
             "message": "Register successful",
@@ -91,7 +93,7 @@ class LoginUserAPIView(APIView):
             password=serializer.validated_data.get("password")
         ))
 
-        refresh = RefreshToken.for_user(login_user)
+        refresh = RoleRefreshToken.for_user(login_user)
 
         return Response({
             "message": "Login successful",
@@ -101,6 +103,28 @@ class LoginUserAPIView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+@extend_schema_view(
+    post=extend_schema(summary="Trade a refresh token for a new token pair", request=RefreshTokenSerializer, responses={200: TokenPairResponseSerializer})
+)
+class RefreshTokenAPIView(APIView): # the access token expired: no password needed, the refresh token is enough (and only works once)
+    permission_classes = [AllowAny]
+    authentication_classes = [] # the access token is probably expired, don't let it reject the request
+
+    def get_authenticate_header(self, request):
+        return 'Bearer realm="api"' # without authenticators DRF would turn our 401 into a 403
+
+    def post(self, request):
+        serializer = RefreshTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        refresh, access = UserService.refresh_tokens(refresh_token=serializer.validated_data.get("refresh"))
+        return Response({
+            "message": "Token refreshed",
+            "refresh": str(refresh),
+            "access": str(access),
+        }, status=status.HTTP_200_OK)
+
+
 @extend_schema_view(
     post=extend_schema(summary="Log-out from an Account", responses={200: MessageSerializer})
 )
@@ -113,7 +137,7 @@ class LogoutUserAPIView(APIView): # This logs out the refresh_token, not access_
             refresh_token = request.data.get("refresh")
             token = RefreshToken(refresh_token)
             
-            token.blacklist() # This is where the 'token_blacklist' app does its job
+            token.blacklist() # its jti goes to the Redis blacklist until the token would have expired anyway (identity/tokens.py)
 
             return Response({
                 "message": "Logout successful. Token is now invalid."
@@ -128,15 +152,16 @@ class LogoutUserAPIView(APIView): # This logs out the refresh_token, not access_
 #-------------------- ADMIN --------------------
 
 @extend_schema_view(
-    get=extend_schema(summary="Admin: List all Users", responses={200: ReadUserSerializer(many=True)}) #bcoz it returns list
+    get=extend_schema(summary="Admin: List all Users", responses={200: paginated(ReadUserSerializer)}, parameters=PAGINATION_PARAMETERS) #bcoz it returns a page of the list
 )
 class AdminUserAPIView(APIView):
     permission_classes = [IsAuthenticated, IsManager]
 
     def get(self, request):
-        users = User.objects.all().order_by("-date_joined")
+        paginator = UserPagination() # newest accounts first
+        users = paginator.paginate_queryset(User.objects.all(), request, view=self)
         serializer = ReadUserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
 
 
 @extend_schema_view(
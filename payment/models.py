@@ -11,5 +11,10 @@ class Payment(models.Model):
     status = models.CharField(max_length=20, choices=[("SUCCESS", "Success"), ("FAILED", "Failed")])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="payment_created_id_idx"), # keyset pagination of the receipt lists
+        ]
+
     def __str__(self):
         return f"{self.booking.user} - {self.booking.showtime} - Status:{self.status}"
@@ -1,12 +1,10 @@
 from rest_framework import permissions
-from typing import cast
-from identity.models import User
+from identity.roles import has_role
 
 class IsManager(permissions.BasePermission):
     """ Allows access only to users in the 'Manager' group. """
     def has_permission(self, request, view):
-        user = cast(User, request.user) # make sure pylance know that user has group attribute
-        return user.groups.filter(name="Manager").exists() 
+        return has_role(request, "Manager") # read from the JWT claims, no DB query
 
 class IsPaymentOwner(permissions.BasePermission):
     """ Keep customer lock their own data """
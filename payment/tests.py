@@ -1,3 +1,71 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group
 from django.test import TestCase
+from django.utils import timezone
+
+from booking.locks import SeatLock, SeatMap, BookingExpiry
+from booking.models import Booking
+from booking.services import BookingService
+from cinema.testing import QueryBudgetMixin
+from identity.models import User
+from screening.models import Movie, Seat
+from screening.services import HallService, ShowtimeService
+from .models import Payment
+
+
+class PaymentQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """ Every payment URL, with 1, 10 and 100 receipts behind it: the query count must not follow the row count """
+
+    def setUp(self):
+        self.customer = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+
+        movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01")
+        hall = HallService.save_hall(name="Hall 1", seats_per_row=5, seats_per_column=5, screen_type="STANDARD")
+        self.showtime = ShowtimeService.save_showtime(movie=movie, hall=hall, start_at=timezone.now() + timedelta(days=1), price=10)
+        self.seats = list(Seat.objects.filter(hall=hall))
+        self.addCleanup(self.clear_redis)
+
+    def clear_redis(self):
+        SeatLock.release(self.showtime, self.seats)
+        SeatMap.forget([self.showtime.id])
+        for booking_id in Booking.objects.values_list("id", flat=True):
+            BookingExpiry.unschedule(booking_id)
+
+    def grow_payments(self, n):
+        """ n SUCCESS receipts of the customer (the booking behind them is enough, no tickets needed to list receipts) """
+        missing = n - Payment.objects.count()
+        bookings = Booking.objects.bulk_create([
+            Booking(user=self.customer, showtime=self.showtime, quantity=1, final_price=10, status="CONFIRMED") for _ in range(missing)
+        ])
+        Payment.objects.bulk_create([
+            Payment(booking=booking, stripe_charge_id=f"pi_{booking.id}", amount=10, status="SUCCESS") for booking in bookings
+        ])
+
+    def test_receipt_list(self):
+        self.assertQueryBudget("/payment/receipt", self.grow_payments, budget=1, user=self.customer)
+
+    def test_receipt_detail(self):
+        self.grow_payments(1)
+        self.assertQueryBudget(f"/payment/receipt/{Payment.objects.first().id}", self.grow_payments, budget=3, user=self.customer)
+
+    def test_admin_receipt_list(self):
+        self.assertQueryBudget("/payment/adm", self.grow_payments, budget=2, user=self.manager)
+
+    def test_admin_receipt_detail(self):
+        self.grow_payments(1)
+        self.assertQueryBudget(f"/payment/adm/{Payment.objects.first().id}", self.grow_payments, budget=2, user=self.manager)
+
+    @patch("stripe.PaymentIntent.create", return_value=SimpleNamespace(id="pi_test")) # never call the real bank from tests
+    def test_pay(self, _):
+        free_seats = iter(self.seats)
+
+        def pending_booking(): # every POST pays a fresh booking that still holds its seat
+            booking = BookingService.make_booking(user=self.customer, showtime=self.showtime, quantity=1, seat_ids=[next(free_seats).id])
+            return {"booking": booking.id, "payment_token": "pm_card_visa"}
 
-# Create your tests here.
+        self.assertQueryBudget("/payment", self.grow_payments, budget=13, user=self.customer, method="post", data=pending_booking)
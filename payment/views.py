@@ -12,10 +12,12 @@ from booking.models import Booking
 from django.shortcuts import get_object_or_404
 from .permissions import IsManager, IsPaymentOwner
 from drf_spectacular.utils import extend_schema, extend_schema_view
+from cinema.idempotency import IdempotencyMixin, IDEMPOTENCY_HEADER
+from cinema.pagination import KeysetPagination, paginated, PAGINATION_PARAMETERS
 
 
 @extend_schema_view(
-    get=extend_schema(summary="For user to see all of his payment receipts collection", responses={200: PaymentReadSerializer(many=True)}),
+    get=extend_schema(summary="For user to see all of his payment receipts collection", responses={200: paginated(PaymentReadSerializer)}, parameters=PAGINATION_PARAMETERS),
 )
 class PaymentAPIView(APIView):
     permission_classes = [IsAuthenticated, IsPaymentOwner]
@@ -24,9 +26,10 @@ class PaymentAPIView(APIView):
         list_payments = Payment.objects.filter(
             booking__user=request.user, # payment dont have user field, so we connect user via booking
             status = "SUCCESS", # This will hide the FAILED part
-        ).order_by("-created_at") # minus is reverse, put the newest at top
-        serializer = PaymentReadSerializer(list_payments, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        )
+        paginator = KeysetPagination() # newest at top, 1 page at a time
+        serializer = PaymentReadSerializer(paginator.paginate_queryset(list_payments, request, view=self), many=True)
+        return paginator.get_paginated_response(serializer.data)
     
 
 @extend_schema_view(
@@ -43,9 +46,9 @@ class PaymentItemAPIView(APIView):
 
 
 @extend_schema_view(
-    post=extend_schema(summary="Proceed the Payment process", request=PaymentWriteSerializer, responses={201: PaymentResponseSerializer})
+    post=extend_schema(summary="Proceed the Payment process", request=PaymentWriteSerializer, responses={201: PaymentResponseSerializer}, parameters=[IDEMPOTENCY_HEADER])
 )
-class PaymentPostAPIView(APIView):
+class PaymentPostAPIView(IdempotencyMixin, APIView):
     permission_classes = [IsAuthenticated] # no need to include owner, bcoz payment not exist yet
 
     def post(self, request):
@@ -70,15 +73,15 @@ class PaymentPostAPIView(APIView):
 #-------------------- ADMIN --------------------
 
 @extend_schema_view(
-    get=extend_schema(summary="Admin: to see all of the payments happened", responses={200: PaymentReadSerializer(many=True)}),
+    get=extend_schema(summary="Admin: to see all of the payments happened", responses={200: paginated(PaymentReadSerializer)}, parameters=PAGINATION_PARAMETERS),
 )
 class AdminPaymentAPIView(APIView):
     permission_classes = [IsAuthenticated, IsManager]
 
     def get(self, request):
-        list_payments = Payment.objects.all().order_by("-created_at")
-        serializer = PaymentReadSerializer(list_payments, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        paginator = KeysetPagination()
+        serializer = PaymentReadSerializer(paginator.paginate_queryset(Payment.objects.all(), request, view=self), many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 @extend_schema_view(
@@ -22,6 +22,7 @@ class HallAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "seats_per_row", "seats_per_column", "screen_type")
     list_filter = ("screen_type",)# Comma needed, bcoz it's Tuple (a list of items) not string
     search_fields = ("name",)
+    readonly_fields = ("total_seats", "broken_seats") # counted by the services from the seats, not typed in
 
     def save_model(self, request, obj, form, change):
         # Call Service to handle the 'if hall' logic and the seat generation
@@ -30,8 +31,8 @@ class HallAdmin(admin.ModelAdmin):
 
 @admin.register(Showtime)
 class ShowtimeAdmin(admin.ModelAdmin):
-    list_display = ("id", "start_at", "price", "movie", "hall", "end_at")
-    readonly_fields = ("end_at",)
+    list_display = ("id", "start_at", "price", "movie", "hall", "end_at", "queue_enabled")
+    readonly_fields = ("end_at", "sold_count", "held_count", "sellable_capacity") # kept by the services, typing over them would desync the seat counts
     list_filter = ("hall", "movie")
     date_hierarchy = "start_at" # admin can jump by year → month → day
 
@@ -0,0 +1,50 @@
+# Schedules weeks of showtimes from a file, the same way as POST /screening/showtimes/import
+#   python manage.py import_showtimes schedule.csv            (or .json: a list of {movie, hall, start_at, price, queue_enabled})
+#   python manage.py import_showtimes schedule.csv --report   lists every conflict, saves nothing
+
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from screening.parsers import read_csv
+from screening.serializers import ShowtimeImportRowSerializer
+from screening.services import ShowtimeService
+
+
+class Command(BaseCommand):
+    help = "Bulk create showtimes from a CSV or JSON file (all or nothing), or report the overlaps"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV (header: movie,hall,start_at,price[,queue_enabled]) or JSON file")
+        parser.add_argument("--report", action="store_true", help="Only list the conflicts, create nothing")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        try:
+            text = path.read_text(encoding="utf-8-sig")
+        except OSError as error:
+            raise CommandError(error)
+        rows = json.loads(text) if path.suffix.lower() == ".json" else read_csv(text)
+
+        serializer = ShowtimeImportRowSerializer(data=rows, many=True, allow_empty=False)
+        if not serializer.is_valid():
+            raise CommandError(f"Invalid rows: {serializer.errors}")
+        showtimes, conflicts = ShowtimeService.import_schedule(serializer.validated_data, report=options["report"])
+
+        for conflict in conflicts:
+            self.stdout.write(self.describe(conflict))
+        if options["report"]:
+            self.stdout.write(f"{len(conflicts)} conflict(s) in {len(rows)} row(s)")
+        elif conflicts:
+            raise CommandError(f"{len(conflicts)} conflict(s), nothing was scheduled")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(showtimes)} showtimes added"))
+
+    @staticmethod
+    def describe(conflict):
+        if "error" in conflict:
+            return f"row {conflict['row']}: {conflict['error']}"
+        if "overlaps_row" in conflict:
+            return f"row {conflict['row']}: overlaps row {conflict['overlaps_row']} in hall {conflict['hall']}"
+        return f"row {conflict['row']}: overlaps showtime {conflict['overlaps_showtime']} in hall {conflict['hall']}"
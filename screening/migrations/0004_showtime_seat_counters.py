@@ -0,0 +1,58 @@
+# Generated by Django 6.0.4 on 2026-10-17 18:03
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+HOLD_TIMEOUT = 600 # booking.locks.HOLD_TIMEOUT at the time of this migration (a migration never imports app code)
+
+
+def fill_counters(apps, schema_editor):
+    # Existing showtimes start with the real numbers instead of 0
+    Showtime = apps.get_model('screening', 'Showtime')
+    Seat = apps.get_model('screening', 'Seat')
+    Ticket = apps.get_model('booking', 'Ticket')
+    Booking = apps.get_model('booking', 'Booking')
+
+    # Before the expiry worker, an abandoned cart stayed PENDING forever: its hold is long over, so it is EXPIRED now
+    # (otherwise held_count would count it and the booking checks would refuse seats nobody holds)
+    Booking.objects.filter(status='PENDING', created_at__lt=timezone.now() - timedelta(seconds=HOLD_TIMEOUT)).update(status='EXPIRED')
+
+    sellable = dict(Seat.objects.filter(is_broken=False).values_list('hall_id').annotate(total=Count('id')))
+    sold = dict(Ticket.objects.values_list('booking__showtime_id').annotate(total=Count('id')))
+    held = dict(Booking.objects.filter(status='PENDING').values_list('showtime_id').annotate(total=Sum('quantity')))
+
+    for showtime in Showtime.objects.all():
+        showtime.sellable_capacity = sellable.get(showtime.hall_id, 0)
+        showtime.sold_count = sold.get(showtime.id, 0)
+        showtime.held_count = held.get(showtime.id, 0)
+        showtime.save(update_fields=['sellable_capacity', 'sold_count', 'held_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screening', '0003_seat_is_broken'),
+        ('booking', '0003_booking_pending_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='showtime',
+            name='held_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='showtime',
+            name='sellable_capacity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='showtime',
+            name='sold_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.4 on 2026-10-17 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screening', '0004_showtime_seat_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='showtime',
+            name='queue_enabled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.4 on 2026-10-17 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screening', '0005_showtime_queue_enabled'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['start_at', 'id'], name='showtime_start_id_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.4 on 2026-10-17 18:33
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    # Existing halls start with the real numbers instead of 0
+    Hall = apps.get_model('screening', 'Hall')
+    for hall in Hall.objects.annotate(total=Count('seat'), broken=Count('seat', filter=Q(seat__is_broken=True))):
+        hall.total_seats, hall.broken_seats = hall.total, hall.broken
+        hall.save(update_fields=['total_seats', 'broken_seats'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('screening', '0006_showtime_showtime_start_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hall',
+            name='broken_seats',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='hall',
+            name='total_seats',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
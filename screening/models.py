@@ -1,10 +1,17 @@
 # A module named "model" with a class "Model" ; for storing, retrieve etc obj model
 
 from django.db import models
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _ # Translation is delayed until the string is displayed (so django know user's preference)
 
 
+class TsTzRange(models.Func): # tstzrange(start, end) = the [start, end) time range Postgres can index and compare
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
 class Movie(models.Model): # django creates Id (PK) automatically
     class Genre(models.TextChoices):
         UNSPECIFIED = "UNSPECIFIED", _("Unspecified")
@@ -38,6 +45,10 @@ class Hall(models.Model):
     screen_type = models.CharField(
             max_length=50, choices=ScreenType.choices, default= ScreenType.STANDARD
         )
+
+    # Denormalized seat counters (kept in sync by HallService/SeatService), so listing halls never COUNTs their seats
+    total_seats = models.PositiveIntegerField(default=0)
+    broken_seats = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         return self.name
@@ -51,6 +62,30 @@ class Showtime(models.Model):
     hall = models.ForeignKey(Hall, on_delete=models.PROTECT) # parent cant delete himself, need to delete the child first, then parent can delete himself
     end_at = models.DateTimeField(blank=True, null=True) # autofill field (by service)
 
+    # Denormalized counters (kept in sync by the services with F() updates), so "is it full?" is a single-row read
+    sold_count = models.PositiveIntegerField(default=0) # seats with a Ticket
+    held_count = models.PositiveIntegerField(default=0) # seats of PENDING bookings (waiting for payment)
+    sellable_capacity = models.PositiveIntegerField(default=0) # seats of the hall that are not broken
+
+    queue_enabled = models.BooleanField(default=False) # opt-in "waiting room" for blockbuster on-sales: customers queue before they can book
+
+    # [start_at, end_at) as 1 column computed by Postgres, so "does it overlap?" is a single && on a GiST index
+    slot = models.GeneratedField(expression=TsTzRange("start_at", "end_at"), output_field=DateTimeRangeField(), db_persist=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["start_at", "id"], name="showtime_start_id_idx"), # keyset pagination of the showtime list
+        ]
+        constraints = [
+            # the DB itself refuses 2 showtimes of the same hall whose slots overlap, even if 2 schedulers pass the service check at once
+            # (its GiST index on (hall, slot) also serves the overlap lookups of ShowtimeService)
+            ExclusionConstraint(
+                name="showtime_no_overlap_per_hall",
+                expressions=[("hall", RangeOperators.EQUAL), ("slot", RangeOperators.OVERLAPS)],
+                condition=models.Q(end_at__isnull=False), # no end = no slot yet (the service always fills end_at)
+            ),
+        ]
+
     def __str__(self):
         return f"{self.movie.title} at {self.hall.name}"
     
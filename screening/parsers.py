@@ -0,0 +1,27 @@
+# Lets the schedule import take a CSV body (Content-Type: text/csv) as well as JSON
+# header line: movie,hall,start_at,price[,queue_enabled]  -> a list of dicts, the serializer does the type checks like for JSON
+
+import csv
+import io
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class CSVParser(BaseParser):
+    media_type = "text/csv"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            text = stream.read().decode("utf-8-sig") # utf-8-sig: Excel puts a BOM in front of the header
+        except UnicodeDecodeError:
+            raise ParseError("CSV must be UTF-8")
+        return read_csv(text)
+
+
+def read_csv(text: str):
+    rows = [{key.strip(): (value or "").strip() for key, value in row.items() if key} for row in csv.DictReader(io.StringIO(text))]
+    for row in rows:
+        if row.get("queue_enabled") == "":
+            del row["queue_enabled"] # empty cell = default (False)
+    return rows
@@ -0,0 +1,15 @@
+# Lets a view answer `Accept: text/event-stream` (the live seat map), DRF would reply 406 without a renderer for it
+
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # the stream itself is a StreamingHttpResponse, this only renders the errors raised before it starts (404, 400)
+        return json.dumps(data).encode() if data is not None else b""
@@ -37,13 +37,14 @@ class HallBaseSerializer(serializers.ModelSerializer):
     
 
 class HallReadSerializer(HallBaseSerializer):
-    total_seats = serializers.SerializerMethodField()
+    sellable_seats = serializers.SerializerMethodField()
 
     class Meta(HallBaseSerializer.Meta):
-        fields = HallBaseSerializer.Meta.fields + ["total_seats"] # add what needed or dont add at all
+        fields = HallBaseSerializer.Meta.fields + ["total_seats", "sellable_seats", "broken_seats"] # add what needed or dont add at all
+        read_only_fields = ["id", "total_seats", "broken_seats"]
 
-    def get_total_seats(self, obj): # looping through halls, calling each one 'obj'
-        return Seat.objects.filter(hall=obj).count() # when at halls A, return the count from hall "A". and so on..
+    def get_sellable_seats(self, obj): # read from the hall's own counters, so a list of halls costs no extra query
+        return obj.total_seats - obj.broken_seats
     
 
 class HallWriteSerializer(HallBaseSerializer):
@@ -71,7 +72,7 @@ class HallWriteSerializer(HallBaseSerializer):
 class ShowtimeBaseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Showtime
-        fields = ["id", "start_at", "price", "end_at"]
+        fields = ["id", "start_at", "price", "end_at", "queue_enabled"]
         read_only_fields = ["id", "end_at"]
 
     
@@ -114,6 +115,34 @@ class ShowtimeWriteSerializer(ShowtimeBaseSerializer):
         return starting
     
 
+class ShowtimeImportRowSerializer(serializers.Serializer):
+    # 1 line of a bulk schedule. Plain ids here: PrimaryKeyRelatedField would run 1 query per row, the service loads them all at once
+    movie = serializers.IntegerField(min_value=1)
+    hall = serializers.IntegerField(min_value=1)
+    start_at = serializers.DateTimeField()
+    price = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=0)
+    queue_enabled = serializers.BooleanField(default=False)
+
+    def validate_start_at(self, starting):
+        if starting < timezone.now():
+            raise ValidationError("Cant schedule movie in the past")
+        return starting
+
+
+class HallAvailabilityQuerySerializer(serializers.Serializer):
+    # ?movie=<id>&start_at=<datetime> : the window to plan is [start_at, start_at + duration + 30 cleaning)
+    movie = serializers.PrimaryKeyRelatedField(queryset=Movie.objects.all())
+    start_at = serializers.DateTimeField()
+
+
+class HallAvailabilitySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    screen_type = serializers.CharField()
+    free = serializers.BooleanField()
+    next_free_start = serializers.DateTimeField(allow_null=True) # null = nothing fits after start_at (only when the hall has a show without end_at)
+
+
 # POST (Trip In): The user sends {"movie": 5}. The serializer accepts it because movie is write_only.
 # GET (Trip Out): The user receives the JSON. They don't see "movie": 5 (because it's hidden). Instead, they see "movie_detail": {...} which contains the Title, Genre, and Rating.
 
@@ -130,7 +159,39 @@ class ShowtimeResponseSerializer(MessageSerializer):
     showtime = ShowtimeWriteSerializer()
 class SeatResponseSerializer(MessageSerializer):
     seat = SeatSerializer()
-
+class ScheduleConflictSerializer(serializers.Serializer):
+    row = serializers.IntegerField()
+    hall = serializers.IntegerField(required=False)
+    overlaps_row = serializers.IntegerField(required=False)
+    overlaps_showtime = serializers.IntegerField(required=False)
+    error = serializers.CharField(required=False)
+class ScheduleImportResponseSerializer(MessageSerializer):
+    showtimes = ShowtimeReadListSerializer(many=True)
+    conflicts = ScheduleConflictSerializer(many=True)
+
+
+
+class OccupancyQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False) # local days, both ends included
+    date_to = serializers.DateField(required=False)
+    hall = serializers.IntegerField(required=False, min_value=1)
+
+
+class ShowtimeOccupancySerializer(serializers.Serializer):
+    # everything comes from the showtime row + its movie/hall (select_related): no query per row
+    id = serializers.IntegerField()
+    screening = serializers.SerializerMethodField()
+    sold = serializers.IntegerField(source="sold_count")
+    capacity = serializers.IntegerField(source="hall.total_seats")
+    occupancy_rate = serializers.SerializerMethodField()
+
+    def get_occupancy_rate(self, show):
+        capacity = show.hall.total_seats
+        return int(show.sold_count / capacity * 100) if capacity > 0 else 0
+
+    def get_screening(self, show):
+        time_str = show.start_at.strftime("%d %b %Y, %H:%M") #convert to readable time
+        return f"[{time_str}] {show.movie.title} - {show.hall.name} ({self.get_occupancy_rate(show)}% Full)"
 
 
 class TopMovieSerializer(serializers.Serializer):
@@ -1,15 +1,20 @@
 # where we put logic business rules
-from .models import Movie, Hall, Showtime, Seat
+from .models import Movie, Hall, Showtime, Seat, TsTzRange
 from identity.models import User
 from booking.models import Booking, Ticket
 from rest_framework.exceptions import ValidationError # in normal django we import from "django.core.exceptions"
+import heapq
+import time
 from datetime import timedelta, date, datetime
 from decimal import Decimal
-from django.db import transaction
-from django.db.models import Count, Avg, Max, Min, Sum
+from django.db import transaction, IntegrityError
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.db.models import Count, Avg, Max, Min, Sum, F, Exists, OuterRef, Subquery
 from django.utils import timezone
+from django.conf import settings
 from django.core.cache import cache
 from django_redis.cache import RedisCache
+from booking.locks import SeatLock, SeatMap, seat_index, is_set
 
 
 class MovieService:
@@ -64,6 +69,8 @@ class HallService:
 
         # This sends all 100 seats to the database in one command
         Seat.objects.bulk_create(seats_to_bulk)
+        hall.total_seats, hall.broken_seats = len(seats_to_bulk), 0 # brand new seats, none is broken
+        hall.save(update_fields=["total_seats", "broken_seats"])
 
 
     @staticmethod
@@ -82,15 +89,26 @@ class HallService:
                 row_diff = seats_per_row and (seats_per_row != hall.seats_per_row)
                 col_diff = seats_per_column and (seats_per_column != hall.seats_per_column) # access spesific data early; here set fallback so when left empty it return false 
 
+                # new seats = the old ones are deleted, and their tickets/booking seats with them (cascade): never under a show people still have seats for
+                if (row_diff or col_diff) and Booking.objects.filter(
+                    showtime__hall=hall, showtime__end_at__gt=timezone.now(), status__in=["PENDING", "CONFIRMED"]
+                ).exists():
+                    raise ValidationError("This hall has bookings for showtimes that are not over yet, it can't be resized now")
+
                 # If I change the name, the Hall is saved, seats ignored. If I change the size, Hall is saved AND seats are updated
                 hall.name = name if name else hall.name
                 hall.seats_per_row = seats_per_row if seats_per_row else hall.seats_per_row
                 hall.seats_per_column = seats_per_column if seats_per_column else hall.seats_per_column
-                hall.save()
+                hall.screen_type = screen_type if screen_type else hall.screen_type
+                # only what the form edits: total_seats/broken_seats in memory may be stale (SeatService moves them with F())
+                hall.save(update_fields=["name", "seats_per_row", "seats_per_column", "screen_type"])
 
                 if row_diff or col_diff: # only run when changing seats number
                     Seat.objects.filter(hall=hall).delete() # this is like delete seats in 1 spesific room instead of whole Hall obj
                     HallService._generate_seats(hall) # generate new seat using updated hall
+                    SeatMap.forget(hall.showtime_set.values_list("id", flat=True)) # every seat position changed, so the seat bitmaps must be rebuilt
+                    # brand new seats, none is broken and none is sold/held anymore (the tickets of the past showtimes went with the old seats)
+                    hall.showtime_set.update(sellable_capacity=hall.seats_per_row * hall.seats_per_column, sold_count=0, held_count=0)
             
             return hall # after trans.atomic closed (no error found), we send the finished 'hall' object back to the View
 
@@ -117,6 +135,7 @@ class ShowtimeService:
         hall: Hall | None=None,
         start_at: datetime | None=None,
         price: int | None=None,
+        queue_enabled: bool | None=None,
        **kwargs # will recognize auto-add field
     ):
         # prevent showtime in the same hall overlapping (DDD logic)
@@ -136,47 +155,179 @@ class ShowtimeService:
             showtime.end_at = end_time # auto-add end_at
         
         # overlap check(shared)
-        overlap = Showtime.objects.filter( 
-            hall = get_hall, # Is there a Prev Movie in the same hall?
-            start_at__lt = end_time, # An overlap exists if the existing show starts BEFORE our show ends...
-            end_at__gt = start_time # ...and the existing show ends AFTER our show starts.
-        )
+        # An overlap exists if the existing show starts BEFORE our show ends and ends AFTER our show starts: slot && [start, end)
+        overlap = Showtime.objects.filter(hall=get_hall, slot__overlap=DateTimeTZRange(start_time, end_time)) # served by the GiST index of the exclusion constraint
         if showtime: #make sure only run in PATCH, no need in POST(bcoz its new)
             overlap = overlap.exclude(id=showtime.id) #type:ignore # This part makes sure doesnt compare to himself
 
         if overlap.exists():
-            # Instead of just returning error, we give user the available alternative halls
-            busy_showtimes = Showtime.objects.filter(start_at__lt=end_time, end_at__gt=start_time) # "Show me every movie playing anywhere in the building during this time"
-            busy_halls = busy_showtimes.values_list("hall_id", flat=True).distinct() #grab IDs, turn into list, remove duplicate
-            available_hall = Hall.objects.all().exclude(id__in=busy_halls) # `id__in=...` to tell the exclude function which column to compare
-
-            list_hall = [hall.name for hall in available_hall]
-
-            if list_hall:
-                message = f"This hall is busy. Available halls at this time: {list_hall}"
-            else:
-                message = "All halls are currently busy at this time"
-
-            raise ValidationError(message)
+            raise ShowtimeService._busy_hall_error(get_hall, start_time, end_time, ignore=showtime)
 
         
         # --- Saving phase (different logic) ---
-        if showtime:
-            showtime.movie = movie if movie else showtime.movie
-            showtime.hall = hall if hall else showtime.hall
-            showtime.start_at = start_at if start_at else showtime.start_at
-            showtime.price = price if price is not None else showtime.price # accpet falsy (might be free)
+        sellable_capacity = get_hall.total_seats - get_hall.broken_seats # what customers can actually buy in this hall (its counters, no COUNT)
+
+        # The check above can't see a showtime another request is saving right now: the exclusion constraint is the final word
+        try:
+            with transaction.atomic(): # savepoint, so a refused INSERT/UPDATE doesn't break the caller's transaction
+                if showtime:
+                    showtime.movie = movie if movie else showtime.movie
+                    showtime.hall = hall if hall else showtime.hall
+                    showtime.start_at = start_at if start_at else showtime.start_at
+                    showtime.price = price if price is not None else showtime.price # accpet falsy (might be free)
+                    showtime.queue_enabled = queue_enabled if queue_enabled is not None else showtime.queue_enabled
+                    showtime.sellable_capacity = sellable_capacity
+
+                    # only what this form edits: sold_count/held_count in memory may be stale, the bookings move them with F()
+                    showtime.save(update_fields=["movie", "hall", "start_at", "end_at", "price", "queue_enabled", "sellable_capacity"])
+                    return showtime
+
+                return Showtime.objects.create(
+                    movie=movie,
+                    hall=hall,
+                    start_at=start_at,
+                    price=price,
+                    end_at=end_time,
+                    sellable_capacity=sellable_capacity,
+                    queue_enabled=bool(queue_enabled),
+                )
+        except IntegrityError as error:
+            if "showtime_no_overlap_per_hall" not in str(error):
+                raise
+            raise ShowtimeService._busy_hall_error(get_hall, start_time, end_time, ignore=showtime) # lost the race: same friendly answer as the check
 
-            showtime.save()
-            return showtime
-        
-        return Showtime.objects.create(
-            movie=movie,
-            hall=hall,
-            start_at=start_at,
-            price=price,
-            end_at=end_time,
+
+    @staticmethod
+    def hall_availability(start_time: datetime, end_time: datetime, ignore: Showtime | None=None):
+        """
+        Every hall, in 1 query: is it free for [start_time, end_time), and the earliest start >= start_time where a show
+        of the same length fits in it. That start is either start_time itself or the end of one of the hall's showtimes
+        (a gap always opens when a show ends), so: the first end_at after start_time whose window overlaps nothing.
+        `ignore` = the showtime being moved (PATCH), it doesn't block itself
+        """
+        window = DateTimeTZRange(start_time, end_time)
+        length = end_time - start_time
+        showtimes = Showtime.objects.exclude(id=ignore.id) if ignore else Showtime.objects.all()
+
+        next_gap = (
+            showtimes.filter(hall=OuterRef("pk"), end_at__gte=start_time)
+            .annotate(gap=TsTzRange(F("end_at"), F("end_at") + length))
+            .exclude(Exists(showtimes.filter(hall=OuterRef("hall"), slot__overlap=OuterRef("gap")))) # nothing else starts inside the gap
+            .order_by("end_at")
+            .values("end_at")[:1]
         )
+        halls = Hall.objects.annotate(
+            busy=Exists(showtimes.filter(hall=OuterRef("pk"), slot__overlap=window)),
+            next_gap=Subquery(next_gap),
+        ).order_by("id")
+
+        return [
+            {
+                "id": hall.id,
+                "name": hall.name,
+                "screen_type": hall.screen_type,
+                "free": not hall.busy,
+                "next_free_start": start_time if not hall.busy else hall.next_gap,
+            }
+            for hall in halls
+        ]
+
+
+    @staticmethod
+    def _busy_hall_error(hall: Hall, start_time: datetime, end_time: datetime, ignore: Showtime | None=None):
+        # Instead of just returning error, we give user the available alternative halls, and when this hall frees up
+        availability = ShowtimeService.hall_availability(start_time, end_time, ignore=ignore)
+
+        list_hall = [other["name"] for other in availability if other["free"]]
+        next_start = next(other["next_free_start"] for other in availability if other["id"] == hall.id)
+
+        if list_hall:
+            message = f"This hall is busy. Available halls at this time: {list_hall}"
+        else:
+            message = "All halls are currently busy at this time"
+        message += f". Next free start in this hall: {timezone.localtime(next_start):%Y-%m-%d %H:%M}"
+
+        return ValidationError(message)
+
+
+    @staticmethod
+    def import_schedule(rows: list[dict], report: bool=False):
+        """
+        Schedule many showtimes at once: rows of {movie, hall, start_at, price, queue_enabled} (ids, already format-checked).
+        Returns (created showtimes, conflicts). Nothing is saved if there is a single conflict (or in report mode),
+        so a schedule goes in whole or not at all. Same number of queries for 1 row or 1000:
+        movies + halls (2), the existing showtimes around the batch (1), 1 bulk INSERT
+        """
+        movies = Movie.objects.in_bulk({row["movie"] for row in rows})
+        halls = Hall.objects.in_bulk({row["hall"] for row in rows})
+
+        conflicts = []
+        planned = [] # (row number, unsaved Showtime)
+        for number, row in enumerate(rows, start=1): # row numbers start at 1, like the lines of the CSV a human wrote
+            movie, hall = movies.get(row["movie"]), halls.get(row["hall"])
+            if movie is None or hall is None:
+                conflicts.append({"row": number, "error": f"Unknown {'movie' if movie is None else 'hall'}: {row['movie'] if movie is None else row['hall']}"})
+                continue
+            planned.append((number, Showtime(
+                movie=movie,
+                hall=hall,
+                start_at=row["start_at"],
+                end_at=row["start_at"] + timedelta(minutes=movie.duration + 30), # same cleaning buffer as save_showtime
+                price=row["price"],
+                queue_enabled=bool(row.get("queue_enabled")),
+                sellable_capacity=hall.total_seats - hall.broken_seats, # the hall's counters, no count per row
+            )))
+        conflicts = sorted(conflicts + ShowtimeService._schedule_overlaps(planned), key=lambda conflict: conflict["row"])
+
+        if conflicts or report or not planned:
+            return [], conflicts
+
+        try:
+            with transaction.atomic():
+                created = Showtime.objects.bulk_create([showtime for _, showtime in planned])
+        except IntegrityError as error:
+            if "showtime_no_overlap_per_hall" not in str(error):
+                raise
+            raise ValidationError("Another showtime was scheduled in one of these halls meanwhile, check the schedule again") # someone saved between our read and our INSERT
+        return created, []
+
+
+    @staticmethod
+    def _schedule_overlaps(planned: list[tuple[int, Showtime]]):
+        # Sweep line, per hall: walk the shows (new + already saved) by start time, keeping the ones still running in a heap by end time.
+        # Whatever is still running when a show starts overlaps it. O(n log n), instead of 1 overlap query per row
+        if not planned:
+            return []
+        window = DateTimeTZRange(min(show.start_at for _, show in planned), max(show.end_at for _, show in planned))
+        existing = Showtime.objects.filter(hall_id__in={show.hall_id for _, show in planned}, slot__overlap=window).values_list("id", "hall_id", "start_at", "end_at")
+
+        timelines = {} # hall_id -> [(start, end, "row"/"showtime", number/id)]
+        for number, show in planned:
+            timelines.setdefault(show.hall_id, []).append((show.start_at, show.end_at, "row", number))
+        for showtime_id, hall_id, start, end in existing:
+            timelines[hall_id].append((start, end, "showtime", showtime_id))
+
+        conflicts = []
+        for hall_id, timeline in timelines.items():
+            timeline.sort()
+            running = [] # heap of (end, start, kind, ref)
+            for start, end, kind, ref in timeline:
+                while running and running[0][0] <= start: # ended before this one starts ([start, end): back to back is fine)
+                    heapq.heappop(running)
+                for _, other_start, other_kind, other_ref in running:
+                    if kind == "showtime" and other_kind == "showtime":
+                        continue # 2 saved showtimes can't overlap (exclusion constraint), nothing for the importer to fix
+                    if kind == "row":
+                        row, other = ref, (other_kind, other_ref)
+                    else:
+                        row, other = other_ref, (kind, ref)
+                    conflicts.append({
+                        "row": row,
+                        "hall": hall_id,
+                        f"overlaps_{other[0]}": other[1], # overlaps_row (same batch) or overlaps_showtime (already scheduled)
+                    })
+                heapq.heappush(running, (end, start, kind, ref))
+        return conflicts
 
 
 
@@ -188,15 +339,54 @@ class SeatService:
         **kwargs
     ):
         # We only update 'is_broken'. Row and Column are locked.
-        if is_broken is not None:
-            seat.is_broken = is_broken
-        
-        seat.save()
+        with transaction.atomic():
+            if is_broken is not None:
+                # ask the DB if the flag really flips (admin form already put the new value on `seat` before we get here)
+                changed = Seat.objects.filter(pk=seat.pk).exclude(is_broken=is_broken).update(is_broken=is_broken)
+                seat.is_broken = is_broken
+
+                if changed:
+                    # upcoming showtimes in this hall gain/lose 1 sellable seat (past showtimes keep their history)
+                    change = -1 if is_broken else 1
+                    Hall.objects.filter(id=seat.hall_id).update(broken_seats=F("broken_seats") - change)
+                    Showtime.objects.filter(hall_id=seat.hall_id, end_at__gt=timezone.now()).update(
+                        sellable_capacity=F("sellable_capacity") + change
+                    )
+                    # the seat maps of those showtimes show it differently now: bump their versions so polling clients refetch the seat
+                    upcoming = list(Showtime.objects.filter(hall_id=seat.hall_id, end_at__gt=timezone.now()).values_list("id", flat=True))
+                    transaction.on_commit(lambda: SeatMap.touch(upcoming, [seat_index(seat, seat.hall)], "X" if is_broken else ""))
+
+            seat.save()
         return seat
 
 
 
 # The output is focused on analyze instead of just CRUD
+class OccupancyCache:
+    """
+    Rendered pages of the occupancy report, in Redis for OCCUPANCY_CACHE_TTL seconds.
+    Every key carries a version number: confirming/cancelling a booking bumps it, so all cached pages go stale at once (no key scan)
+    """
+    VERSION_KEY = "screening:occupancy:version"
+
+    @staticmethod
+    def get(page: str):
+        version = cache.get(OccupancyCache.VERSION_KEY, 0)
+        return version, cache.get(f"screening:occupancy:{version}:{page}")
+
+    @staticmethod
+    def set(version: int, page: str, data):
+        cache.set(f"screening:occupancy:{version}:{page}", data, timeout=settings.OCCUPANCY_CACHE_TTL)
+
+    @staticmethod
+    def invalidate():
+        try:
+            cache.incr(OccupancyCache.VERSION_KEY)
+        except ValueError: # first bump (or Redis was flushed)
+            cache.set(OccupancyCache.VERSION_KEY, 1, timeout=None)
+
+
+
 class ScreeningAnalytic():
     @staticmethod
     def top_movies():
@@ -213,29 +403,20 @@ class ScreeningAnalytic():
     
 
     @staticmethod
-    def showtime_occupancy(): # dont need to give a specific showtime; it finds them itself using '.objects.filter'
+    def showtime_occupancy(date_from: date | None=None, date_to: date | None=None, hall: int | None=None):
         """ Showing Real-time upcoming Showtime(alongside movie and hall info) """
-        
-        # use select_related to avoid slow "N+1" queries
-        upcoming_shows = Showtime.objects.filter(start_at__gt=timezone.now()) \
-        .select_related("movie", "hall") \
-        .order_by("-start_at")
-
-        showtime_report = [] #empty tray to store collections
-
-        for show in upcoming_shows: 
-            capacity = show.hall.seats_per_row * show.hall.seats_per_column # use 'show.' to calculate the math for each individual movie slot
-            ticket_counts = show.booking_set.filter(status="CONFIRMED").aggregate(total_seat=Sum("quantity")) ["total_seat"] or 0 #get "all confirmed booking/ticket for this showtime", then sum it --backward logic #type:ignore
-            occupancy_rate = (ticket_counts/capacity)*100 if capacity>0 else 0
-
-            time_str = show.start_at.strftime("%d %b %Y, %H:%M") #convert to readable time
-            display_text = f"[{time_str}] {show.movie.title} - {show.hall.name} ({int(occupancy_rate)}% Full)" # not use class name (showtime)
-
-            showtime_report.append({
-                "id": show.id,
-                "screening": display_text
-            })
-        return showtime_report
+        # 1 query whatever the number of showtimes: sold seats are the showtime's own counter (sold_count), capacity the hall's (total_seats),
+        # so no more SUM over the bookings of every showtime
+        upcoming_shows = Showtime.objects.filter(start_at__gt=timezone.now()).select_related("movie", "hall")
+
+        # date window, in local days: turned into datetimes so the start_at index still works (start_at__date would not use it)
+        if date_from:
+            upcoming_shows = upcoming_shows.filter(start_at__gte=timezone.make_aware(datetime.combine(date_from, datetime.min.time())))
+        if date_to:
+            upcoming_shows = upcoming_shows.filter(start_at__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), datetime.min.time())))
+        if hall:
+            upcoming_shows = upcoming_shows.filter(hall_id=hall)
+        return upcoming_shows # paginated (and turned into text) by the view
 
 
     @staticmethod
@@ -244,35 +425,102 @@ class ScreeningAnalytic():
 
         # 1. Get the specific showtime(and the Hall it belongs to) --when user click a spesific showtime
         selected_showtime = Showtime.objects.select_related("hall").get(id=showtime_id) #use get bcoz we click on a spesific choice
-        all_seats = selected_showtime.hall.seat_set.all() #Get all seats in of that specific Hall
+        hall = selected_showtime.hall
+        all_seats = list(hall.seat_set.all()) #Get all seats in of that specific Hall
 
-        # 2. Get 'Confirmed' seat IDs from Postgres (look for tickets linked to this specific showtime)
-        confirmed_seats = Ticket.objects.filter(
-            booking__showtime_id = showtime_id,
-            booking__status = "CONFIRMED"
-        ).values_list("seat_id", flat=True) # list all seat_id from this showtime that are already confirmed
+        # 2. Get 'Confirmed' seats from the sold bitmap and 'Pending' ones from the hold index of this showtime
+        # (1 Redis round trip: no Ticket join, no GET per lock key and no KEYS scan)
+        sold_bitmap, holds = SeatMap.holds(selected_showtime)
 
-        # 3. Get 'Pending' seat IDs from Redis
-        # Use the '*' to find all locked seats for this showtime
-        locked_keys = cache.keys(f"lock:{showtime_id}:*") #type:ignore # This "lock:" name must be same everywhere
-        locked_seats = [int(k.split(':')[-1]) for k in locked_keys] # Turn "seatlock:5:102" into just the ID 102
+        # 3. A hold can outlive its lock (the 10 mins lock expired by itself): its deadline tells, no need to ask the lock keys
+        locked_seats, expired = ScreeningAnalytic._live_holds(holds)
+        if expired:
+            SeatLock.prune(selected_showtime, [seat for seat in all_seats if seat.id in expired]) # clean the index/bits of expired holds
 
         # 4. Get info of which seat belong to who
         taker = Ticket.objects.filter(
-            booking__showtime_id = showtime_id,
+            showtime_id = showtime_id,
             booking__status = "CONFIRMED"
         ).select_related("booking__user") #grab user from this showtime that are already confirmed
 
         # use Dictionary map --each occupied seat(key) has value(email)
         # Turn the Queryset from "taker" to simple dictionary --ex: {101: "manager1@gmail.com", 105: "student@uni.edu"}
-        map_taker = {t.seat.id: t.booking.user.email for t in taker} 
+        map_taker = {t.seat_id: t.booking.user.email for t in taker} 
+
+        return ScreeningAnalytic._seat_layout(hall, all_seats, sold_bitmap, locked_seats, map_taker)
 
 
+    @staticmethod
+    async def ahall_seats_layout(showtime_id):
+        """ Async version of hall_seats_layout (same output) for the async ShowtimeOccupancyDetailAPIView: async ORM + async Redis client """
+        selected_showtime = await Showtime.objects.select_related("hall").aget(id=showtime_id)
+        hall = selected_showtime.hall
+        all_seats = [seat async for seat in hall.seat_set.all()]
+
+        sold_bitmap, holds = await SeatMap.aholds(selected_showtime)
+
+        locked_seats, expired = ScreeningAnalytic._live_holds(holds)
+        if expired:
+            await SeatLock.aprune(selected_showtime, [seat for seat in all_seats if seat.id in expired])
+
+        taker = Ticket.objects.filter(showtime_id=showtime_id, booking__status="CONFIRMED").select_related("booking__user")
+        map_taker = {t.seat_id: t.booking.user.email async for t in taker}
+
+        return ScreeningAnalytic._seat_layout(hall, all_seats, sold_bitmap, locked_seats, map_taker)
+
+
+    # Compact seat map for clients that poll a showtime: 1 letter per seat, row-major (A1, A2, ... B1, ...)
+    SEAT_MAP_LEGEND = {"G": "free", "Y": "held", "R": "sold", "X": "broken"}
+
+    @staticmethod
+    async def acompact_seat_map(showtime, since: int | None = None):
+        """
+        {"version", "rows", "columns", "legend", "seats": "GGYRR..."} ; or, when the client already has version `since`,
+        {"version", "since", "changes": [[position, letter], ...]} with only the seats that changed after it.
+        Redis gives the states, the DB only the broken seats (and only if the hall has some)
+        """
+        hall = showtime.hall
+        sold_bitmap, held_bitmap, version, changed = await SeatMap.aversioned(showtime, since)
+
+        broken = set()
+        if hall.broken_seats: # counter on the hall, no query for the (usual) hall without broken seats
+            broken = {seat_index(seat, hall) async for seat in hall.seat_set.filter(is_broken=True).only("row_label", "column_number")}
+
+        def letter(position):
+            if position in broken:
+                return "X"
+            if is_set(sold_bitmap, position):
+                return "R"
+            if is_set(held_bitmap, position):
+                return "Y"
+            return "G"
+
+        if changed is not None:
+            return {"version": version, "since": since, "changes": [[position, letter(position)] for position in sorted(changed)]}
+        return {
+            "version": version,
+            "rows": hall.seats_per_row,
+            "columns": hall.seats_per_column,
+            "legend": ScreeningAnalytic.SEAT_MAP_LEGEND,
+            "seats": "".join(letter(position) for position in range(SeatMap.capacity(hall))),
+        }
+
+
+    @staticmethod
+    def _live_holds(holds: dict):
+        """ Split the hold index into (seat ids still held, seat ids whose hold is over) --sets, so the layout loop checks in O(1) """
+        now = time.time()
+        locked_seats = {seat_id for seat_id, (_, deadline) in holds.items() if deadline > now}
+        return locked_seats, holds.keys() - locked_seats
+
+
+    @staticmethod
+    def _seat_layout(hall, all_seats, sold_bitmap, locked_seats, map_taker):
         seat_layout = []
         for seat in all_seats:
             if seat.is_broken:
                 status = "Grey"
-            elif seat.id in confirmed_seats:
+            elif is_set(sold_bitmap, seat_index(seat, hall)):
                 status = "Red"
             elif seat.id in locked_seats: 
                 status = "Yellow"
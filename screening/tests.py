@@ -1,3 +1,427 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+from datetime import timedelta
 
-# Create your tests here.  Write some automated test cases
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from booking.locks import SeatMap
+from booking.services import BookingService
+from booking.models import Booking, Ticket
+from cinema.testing import QueryBudgetMixin
+from identity.models import User
+from .models import Movie, Hall, Showtime, Seat
+from .services import HallService, SeatService, ShowtimeService, OccupancyCache
+
+
+class ScreeningQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """ Every screening URL, with 1, 10 and 100 rows: the query count must not follow the row count """
+
+    def setUp(self):
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+        self.customer = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+
+        self.movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01")
+        self.hall = self.make_hall("Hall 0", rows=10, columns=10) # 100 seats, enough for 100 tickets
+        self.showtime = self.make_showtimes(1)[0]
+        self.seats = list(Seat.objects.filter(hall=self.hall))
+
+        SeatMap.forget([self.showtime.id])
+        self.addCleanup(SeatMap.forget, [self.showtime.id])
+
+    # ---Fast builders (bulk_create), the services are tested elsewhere---
+    def make_hall(self, name, rows=1, columns=2):
+        hall = Hall.objects.create(name=name, seats_per_row=rows, seats_per_column=columns, total_seats=rows * columns)
+        Seat.objects.bulk_create([
+            Seat(hall=hall, row_label=chr(ord("A") + r), column_number=c + 1) for r in range(rows) for c in range(columns)
+        ])
+        return hall
+
+    def make_showtimes(self, count, movie=None):
+        start = timezone.now() + timedelta(days=1)
+        taken = Showtime.objects.filter(hall=self.hall).count() # one after the other: a hall can't run 2 shows at once
+        return Showtime.objects.bulk_create([
+            Showtime(
+                movie=movie or self.movie, hall=self.hall, price=10, sellable_capacity=100,
+                start_at=start + timedelta(hours=3 * i), end_at=start + timedelta(hours=3 * i, minutes=130),
+            )
+            for i in range(taken, taken + count)
+        ])
+
+    def make_tickets(self, showtime, seats):
+        bookings = Booking.objects.bulk_create([
+            Booking(user=self.customer, showtime=showtime, quantity=1, final_price=10, status="CONFIRMED") for _ in seats
+        ])
+        Ticket.objects.bulk_create([
+            Ticket(booking=booking, showtime=showtime, seat=seat) for booking, seat in zip(bookings, seats)
+        ])
+
+    def grow_movies(self, n):
+        Movie.objects.bulk_create([
+            Movie(title=f"Movie {i}", duration=90, rating=5, release_date="2024-01-01") for i in range(Movie.objects.count(), n)
+        ])
+
+    def grow_halls(self, n):
+        for i in range(Hall.objects.count(), n):
+            self.make_hall(f"Hall {i}")
+
+    def grow_showtimes(self, n):
+        self.make_showtimes(n - Showtime.objects.count())
+
+    # ---Movies---
+    def test_movie_list(self):
+        self.assertQueryBudget("/screening/movies", self.grow_movies, budget=1)
+
+    def test_movie_detail(self):
+        self.assertQueryBudget(f"/screening/movies/{self.movie.id}", self.grow_movies, budget=1)
+
+    def test_top_movies(self):
+        def grow(n): # n movies that each sold something
+            for i in range(n - Movie.objects.count()):
+                movie = Movie.objects.create(title=f"Movie {i}", duration=90, rating=5, release_date="2024-01-01")
+                self.make_tickets(self.make_showtimes(1, movie=movie)[0], self.seats[:1])
+        self.assertQueryBudget("/screening/movies/top", grow, budget=1)
+
+    # ---Halls and seats---
+    def test_hall_list(self):
+        self.assertQueryBudget("/screening/halls", self.grow_halls, budget=1)
+
+    def test_hall_detail(self):
+        self.assertQueryBudget(f"/screening/halls/{self.hall.id}", self.grow_halls, budget=1)
+
+    def test_seat_detail(self):
+        self.assertQueryBudget(f"/screening/halls/seat/{self.seats[0].id}", self.grow_halls, budget=2, user=self.manager)
+
+    # ---Showtimes---
+    def test_showtime_list(self):
+        self.assertQueryBudget("/screening/showtimes", self.grow_showtimes, budget=1)
+
+    def test_showtime_detail(self):
+        self.assertQueryBudget(f"/screening/showtimes/{self.showtime.id}", self.grow_showtimes, budget=1)
+
+    # ---Analytic (manager only)---
+    def test_occupancy_list(self):
+        def grow(n): # showtimes made behind the services' back: drop the cached pages ourselves
+            self.grow_showtimes(n)
+            OccupancyCache.invalidate()
+        self.assertQueryBudget("/screening/showtimes/occupancy", grow, budget=2, user=self.manager)
+
+    def test_occupancy_detail(self):
+        SeatMap.snapshot(self.showtime) # built once, like in production (the cold-start rebuild is not what we measure)
+
+        def grow(n): # n sold seats in the showtime
+            new_seats = self.seats[Ticket.objects.count():n]
+            self.make_tickets(self.showtime, new_seats)
+            SeatMap.mark_sold(self.showtime, new_seats) # tickets were made behind the services' back
+        self.assertQueryBudget(f"/screening/showtimes/occupancy/{self.showtime.id}", grow, budget=4, user=self.manager)
+
+
+class HallSeatCountersTest(TestCase):
+    """ total/broken seats live on the hall, the services must keep them equal to the Seat rows """
+
+    def assertCounters(self, hall, total, broken):
+        hall.refresh_from_db()
+        self.assertEqual((hall.total_seats, hall.broken_seats), (total, broken))
+        self.assertEqual(Seat.objects.filter(hall=hall).count(), total)
+        self.assertEqual(Seat.objects.filter(hall=hall, is_broken=True).count(), broken)
+
+    def test_counters_follow_the_seats(self):
+        hall = HallService.save_hall(name="Hall 1", seats_per_row=3, seats_per_column=4, screen_type="STANDARD")
+        self.assertCounters(hall, 12, 0)
+
+        seat = Seat.objects.filter(hall=hall).first()
+        SeatService.update_seat(seat, is_broken=True)
+        SeatService.update_seat(seat, is_broken=True) # no flip, no count
+        self.assertCounters(hall, 12, 1)
+        SeatService.update_seat(seat, is_broken=False)
+        self.assertCounters(hall, 12, 0)
+
+        SeatService.update_seat(seat, is_broken=True)
+        HallService.save_hall(hall=hall, seats_per_row=2) # resize: brand new seats, none broken
+        self.assertCounters(hall, 8, 0)
+
+    def test_edit_keeps_counters(self):
+        hall = HallService.save_hall(name="Hall 1", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        stale = Hall.objects.get(id=hall.id) # loaded by the edit form before the seat broke
+        SeatService.update_seat(Seat.objects.filter(hall=hall).first(), is_broken=True)
+        HallService.save_hall(hall=stale, name="Hall 1 bis", screen_type="IMAX")
+        self.assertCounters(hall, 4, 1)
+        self.assertEqual((hall.name, hall.screen_type), ("Hall 1 bis", "IMAX"))
+
+    def test_admin_add_and_edit(self):
+        admin = User.objects.create_superuser(email="admin@test.com", username="admin", password="pass12345")
+        self.client.force_login(admin)
+        form = {"name": "Hall 9", "seats_per_row": 2, "seats_per_column": 3, "screen_type": "STANDARD"}
+        self.assertEqual(self.client.post("/admin/screening/hall/add/", form).status_code, 302)
+        hall = Hall.objects.get(name="Hall 9")
+        self.assertCounters(hall, 6, 0)
+
+        self.assertEqual(self.client.post(f"/admin/screening/hall/{hall.id}/change/", {**form, "name": "Hall 10"}).status_code, 302)
+        self.assertCounters(hall, 6, 0)
+        self.assertEqual(hall.name, "Hall 10")
+
+
+class ShowtimeCountersTest(TestCase):
+    """ sold/held counts are moved by the bookings only: editing a showtime or a hall must not write stale numbers over them """
+
+    def setUp(self):
+        self.customer = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+        self.movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01")
+        self.hall = HallService.save_hall(name="Hall 1", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.show = ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=timezone.now() + timedelta(days=1), price=10)
+        SeatMap.forget([self.show.id])
+        self.addCleanup(SeatMap.forget, [self.show.id])
+
+    def sell(self):
+        seat = Seat.objects.filter(hall=self.hall).first()
+        return BookingService.confirm_booking(BookingService.make_booking(user=self.customer, showtime=self.show, quantity=1, seat_ids=[seat.id]))
+
+    def test_edit_keeps_counters(self):
+        stale = Showtime.objects.get(id=self.show.id) # loaded by the admin form before the sale
+        self.sell()
+        ShowtimeService.save_showtime(showtime=stale, price=12)
+        self.show.refresh_from_db()
+        self.assertEqual((self.show.price, self.show.sold_count), (12, 1))
+
+    def test_capacity_from_hall_counters(self):
+        SeatService.update_seat(Seat.objects.filter(hall=self.hall).first(), is_broken=True)
+        self.hall.refresh_from_db()
+        with self.assertNumQueries(4): # overlap check + savepoint/INSERT/release, no COUNT of the seats
+            show = ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=timezone.now() + timedelta(days=3), price=10)
+        self.assertEqual(show.sellable_capacity, 3)
+
+    def test_resize_refused_under_live_bookings(self):
+        self.sell()
+        with self.assertRaisesMessage(ValidationError, "can't be resized now"):
+            HallService.save_hall(hall=self.hall, seats_per_row=3)
+        self.assertEqual(Ticket.objects.filter(showtime=self.show).count(), 1)
+
+    def test_resize_resets_counters(self):
+        self.sell()
+        Showtime.objects.filter(id=self.show.id).update(start_at=timezone.now() - timedelta(days=2), end_at=timezone.now() - timedelta(days=1))
+        HallService.save_hall(hall=self.hall, seats_per_row=3) # the show is over: allowed, its tickets go with the old seats
+        self.show.refresh_from_db()
+        self.assertFalse(Ticket.objects.filter(showtime=self.show).exists())
+        self.assertEqual((self.show.sold_count, self.show.held_count, self.show.sellable_capacity), (0, 0, 6))
+
+
+class ShowtimeOverlapTest(TransactionTestCase):
+    """ 2 showtimes of the same hall can't overlap, even when they are saved at the same moment """
+
+    def setUp(self):
+        self.movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01")
+        self.hall = HallService.save_hall(name="Hall 1", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.start = timezone.now() + timedelta(days=1)
+
+    def test_database_refuses_overlap(self):
+        ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=self.start, price=10)
+        with self.assertRaises(IntegrityError): # behind the services' back: the constraint still says no
+            Showtime.objects.create(
+                movie=self.movie, hall=self.hall, price=10, sellable_capacity=4,
+                start_at=self.start + timedelta(minutes=30), end_at=self.start + timedelta(minutes=180),
+            )
+        # back to back is fine ([start, end) ranges)
+        ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=self.start + timedelta(minutes=150), price=10) # 120 + 30 cleaning
+
+    def test_concurrent_saves(self):
+        barrier = threading.Barrier(2)
+        results = []
+
+        def save():
+            try:
+                barrier.wait()
+                ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=self.start, price=10)
+                results.append("saved")
+            except ValidationError as error:
+                results.append(str(error))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=save) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count("saved"), 1)
+        self.assertIn("busy", next(result for result in results if result != "saved"))
+        self.assertEqual(Showtime.objects.filter(hall=self.hall).count(), 1)
+
+
+class ShowtimeImportTest(QueryBudgetMixin, TestCase):
+    """ Bulk schedule: constant queries whatever the size, every overlap reported, all or nothing """
+
+    def setUp(self):
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+        self.movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01") # 150 minutes with cleaning
+        self.hall = HallService.save_hall(name="Hall 1", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.other_hall = HallService.save_hall(name="Hall 2", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.start = (timezone.now() + timedelta(days=1)).replace(microsecond=0)
+
+    def row(self, hours, hall=None, **extra):
+        return {"movie": self.movie.id, "hall": (hall or self.hall).id, "start_at": (self.start + timedelta(hours=hours)).isoformat(), "price": "10.00", **extra}
+
+    def test_query_budget(self):
+        batch = []
+
+        def grow(n): # n back to back showtimes, after the ones of the previous batch
+            taken = Showtime.objects.count()
+            batch[:] = [self.row(3 * (taken + i)) for i in range(n)]
+        self.assertQueryBudget("/screening/showtimes/import", grow, budget=7, user=self.manager, method="post", data=lambda: batch)
+        self.assertEqual(Showtime.objects.count(), 111)
+
+    def test_import_json(self):
+        response = self.client.post("/screening/showtimes/import", [self.row(0), self.row(2.5), self.row(0, hall=self.other_hall, queue_enabled=True)], format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.data["showtimes"]), 3)
+
+        showtime = Showtime.objects.get(hall=self.other_hall)
+        self.assertEqual(showtime.end_at - showtime.start_at, timedelta(minutes=150))
+        self.assertEqual(showtime.sellable_capacity, 4)
+        self.assertTrue(showtime.queue_enabled)
+
+    def test_import_csv(self):
+        csv = "movie,hall,start_at,price\n" + "\n".join(f"{r['movie']},{r['hall']},{r['start_at']},{r['price']}" for r in [self.row(0), self.row(3)])
+        response = self.client.post("/screening/showtimes/import", csv, content_type="text/csv")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Showtime.objects.filter(hall=self.hall).count(), 2)
+
+    def test_conflicts(self):
+        saved = ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=self.start, price=10)
+        rows = [
+            self.row(2),                        # 1: overlaps the saved showtime (ends at +2.5h)
+            self.row(5), self.row(6),           # 2, 3: overlap each other
+            self.row(2, hall=self.other_hall),  # 4: fine, other hall
+            {**self.row(9), "movie": 999},      # 5: unknown movie
+        ]
+        response = self.client.post("/screening/showtimes/import?report=true", rows, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["conflicts"], [
+            {"row": 1, "hall": self.hall.id, "overlaps_showtime": saved.id},
+            {"row": 3, "hall": self.hall.id, "overlaps_row": 2},
+            {"row": 5, "error": "Unknown movie: 999"},
+        ])
+
+        response = self.client.post("/screening/showtimes/import", rows, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data["conflicts"]), 3)
+        self.assertEqual(Showtime.objects.count(), 1) # all or nothing
+
+    def test_command_report(self):
+        path = self.enterContext(tempfile.TemporaryDirectory()) + "/schedule.json"
+        with open(path, "w") as file:
+            json.dump([self.row(0), self.row(1)], file)
+
+        out = io.StringIO()
+        call_command("import_showtimes", path, "--report", stdout=out)
+        self.assertIn("row 2: overlaps row 1", out.getvalue())
+        self.assertEqual(Showtime.objects.count(), 0)
+
+        with self.assertRaises(CommandError):
+            call_command("import_showtimes", path, stdout=io.StringIO())
+
+
+class HallAvailabilityTest(TestCase):
+    """ Free halls for a window + the earliest start that fits in every hall, in 1 query """
+
+    def setUp(self):
+        self.movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01") # 150 minutes with cleaning
+        self.hall = HallService.save_hall(name="Hall 1", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.other_hall = HallService.save_hall(name="Hall 2", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.start = (timezone.now() + timedelta(days=1)).replace(second=0, microsecond=0)
+        for minutes in (0, 150, 400): # 0-150, 150-300 back to back, then a 100 minutes gap (too short), 400-550
+            ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=self.start + timedelta(minutes=minutes), price=10)
+
+    def test_availability(self):
+        start = self.start + timedelta(minutes=60)
+        with self.assertNumQueries(1):
+            halls = ShowtimeService.hall_availability(start, start + timedelta(minutes=150))
+
+        self.assertEqual(halls, [
+            {"id": self.hall.id, "name": "Hall 1", "screen_type": "STANDARD", "free": False, "next_free_start": self.start + timedelta(minutes=550)},
+            {"id": self.other_hall.id, "name": "Hall 2", "screen_type": "STANDARD", "free": True, "next_free_start": start},
+        ])
+
+    def test_moved_showtime_does_not_block_itself(self):
+        last = Showtime.objects.get(hall=self.hall, start_at=self.start + timedelta(minutes=400))
+        halls = ShowtimeService.hall_availability(self.start + timedelta(minutes=320), self.start + timedelta(minutes=470), ignore=last)
+        self.assertTrue(halls[0]["free"]) # would be busy if the show being moved counted
+        self.assertEqual(halls[0]["next_free_start"], self.start + timedelta(minutes=320))
+
+    def test_busy_error_suggests_next_start(self):
+        with self.assertRaises(ValidationError) as context:
+            ShowtimeService.save_showtime(movie=self.movie, hall=self.hall, start_at=self.start + timedelta(minutes=60), price=10)
+        message = str(context.exception.detail[0])
+        self.assertIn("Available halls at this time: ['Hall 2']", message)
+        self.assertIn(f"Next free start in this hall: {timezone.localtime(self.start + timedelta(minutes=550)):%Y-%m-%d %H:%M}", message)
+
+    def test_endpoint(self):
+        manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        manager.groups.add(Group.objects.create(name="Manager"))
+        client = APIClient()
+        client.force_authenticate(manager)
+
+        response = client.get("/screening/showtimes/availability", {"movie": self.movie.id, "start_at": (self.start + timedelta(minutes=60)).isoformat()})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([hall["free"] for hall in response.data], [False, True])
+
+
+class OccupancyReportTest(TestCase):
+    """ The manager's report: filters, 1 query per page, cached until a sale or a refund """
+
+    def setUp(self):
+        self.manager = User.objects.create_user(email="manager@test.com", username="manager", password="pass12345")
+        self.manager.groups.add(Group.objects.create(name="Manager"))
+        self.customer = User.objects.create_user(email="customer@test.com", username="customer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+        movie = Movie.objects.create(title="Dune", duration=120, rating=8, release_date="2024-01-01")
+        self.hall = HallService.save_hall(name="Hall 1", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.other_hall = HallService.save_hall(name="Hall 2", seats_per_row=2, seats_per_column=2, screen_type="STANDARD")
+        self.tomorrow = timezone.localtime() + timedelta(days=1)
+        self.show = ShowtimeService.save_showtime(movie=movie, hall=self.hall, start_at=self.tomorrow, price=10)
+        self.later = ShowtimeService.save_showtime(movie=movie, hall=self.hall, start_at=self.tomorrow + timedelta(days=3), price=10)
+        self.elsewhere = ShowtimeService.save_showtime(movie=movie, hall=self.other_hall, start_at=self.tomorrow, price=10)
+
+        OccupancyCache.invalidate() # pages cached by an earlier test are not ours
+        SeatMap.forget([self.show.id])
+        self.addCleanup(SeatMap.forget, [self.show.id])
+
+    def report(self, **params):
+        response = self.client.get("/screening/showtimes/occupancy", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data["results"]
+
+    def test_filters(self):
+        self.assertEqual([row["id"] for row in self.report()], [self.later.id, self.elsewhere.id, self.show.id])
+        self.assertEqual([row["id"] for row in self.report(hall=self.hall.id)], [self.later.id, self.show.id])
+        day = self.tomorrow.date().isoformat()
+        self.assertEqual({row["id"] for row in self.report(date_from=day, date_to=day)}, {self.show.id, self.elsewhere.id})
+
+    def test_cached_until_a_sale(self):
+        self.report()
+        with self.assertNumQueries(1): # only the role check, the page comes from Redis
+            self.report()
+
+        seats = list(Seat.objects.filter(hall=self.hall)[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = BookingService.make_booking(user=self.customer, showtime=self.show, quantity=2, seat_ids=[seat.id for seat in seats])
+            BookingService.confirm_booking(booking)
+
+        row = next(row for row in self.report() if row["id"] == self.show.id)
+        self.assertEqual((row["sold"], row["capacity"], row["occupancy_rate"]), (2, 4, 50))
+        self.assertIn("(50% Full)", row["screening"])
@@ -1,7 +1,7 @@
 # place different url routes and connect to views
 
 from django.urls import path
-from .views import MovieAPIView, MovieItemAPIView, HallAPIView, HallItemAPIView, ShowtimeAPIView, ShowtimeItemAPIView, SeatAPIView, TopMoviesAPIView, ShowtimeOccupancyListAPIView, ShowtimeOccupancyDetailAPIView
+from .views import MovieAPIView, MovieItemAPIView, HallAPIView, HallItemAPIView, ShowtimeAPIView, ShowtimeItemAPIView, SeatAPIView, TopMoviesAPIView, ShowtimeOccupancyListAPIView, ShowtimeOccupancyDetailAPIView, ShowtimeImportAPIView, ShowtimeAvailabilityAPIView, ShowtimeSeatMapAPIView, ShowtimeSeatStreamAPIView
 
 urlpatterns = [
     path("/movies", MovieAPIView.as_view(), name="movie-list"),
@@ -14,6 +14,10 @@ urlpatterns = [
 
     path("/showtimes", ShowtimeAPIView.as_view(), name="showtimes-list"),
     path("/showtimes/<int:pk>", ShowtimeItemAPIView.as_view(), name="showtime-detail"),
+    path("/showtimes/<int:pk>/seats", ShowtimeSeatMapAPIView.as_view(), name="showtime-seat-map"),
+    path("/showtimes/<int:pk>/seats/stream", ShowtimeSeatStreamAPIView.as_view(), name="showtime-seat-stream"),
+    path("/showtimes/import", ShowtimeImportAPIView.as_view(), name="showtimes-import"),
+    path("/showtimes/availability", ShowtimeAvailabilityAPIView.as_view(), name="showtimes-availability"),
 
     # Analytic
     path("/movies/top", TopMoviesAPIView.as_view(), name="top-movies"),
@@ -2,30 +2,44 @@
 # In here, we see Response more often than raise bcoz we're dealing with user. so
 
 from rest_framework.views import APIView
+from adrf.views import APIView as AsyncAPIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
 from .models import Movie, Hall, Showtime, Seat
-from .serializers import MovieSerializer, HallWriteSerializer, HallReadSerializer, ShowtimeWriteSerializer, ShowtimeReadListSerializer, ShowtimeReadItemSerializer, SeatSerializer, MessageSerializer, MovieResponseSerializer, HallResponseSerializer, ShowtimeResponseSerializer, SeatResponseSerializer, TopMovieSerializer
-from .services import MovieService, HallService, ShowtimeService, SeatService, ScreeningAnalytic
+from .serializers import MovieSerializer, HallWriteSerializer, HallReadSerializer, ShowtimeWriteSerializer, ShowtimeReadListSerializer, ShowtimeReadItemSerializer, SeatSerializer, MessageSerializer, MovieResponseSerializer, HallResponseSerializer, ShowtimeResponseSerializer, SeatResponseSerializer, TopMovieSerializer, ShowtimeImportRowSerializer, ScheduleImportResponseSerializer, HallAvailabilityQuerySerializer, HallAvailabilitySerializer, OccupancyQuerySerializer, ShowtimeOccupancySerializer
+from .parsers import CSVParser
+from .renderers import EventStreamRenderer
+from .services import MovieService, HallService, ShowtimeService, SeatService, ScreeningAnalytic, OccupancyCache
 from .permissions import IsManager, IsWorker, IsManagerOrReadonly
-from django.shortcuts import get_object_or_404
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from django.shortcuts import get_object_or_404, aget_object_or_404
+from cinema.async_views import sync_handler, serialize
+from booking.locks import SeatMap
+from booking.feed import seat_events
+from django.http import StreamingHttpResponse
+from cinema.pagination import MoviePagination, ShowtimePagination, OccupancyPagination, apaginate, paginated, PAGINATION_PARAMETERS
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
+from datetime import timedelta
 
 
 @extend_schema_view(
-    get=extend_schema(summary="List all Movies", responses={200: MovieSerializer(many=True)}),
+    get=extend_schema(summary="List all Movies", responses={200: paginated(MovieSerializer)}, parameters=PAGINATION_PARAMETERS),
     post=extend_schema(summary="Adds a New Movie", request=MovieSerializer, responses={201: MovieResponseSerializer})
 )
-class MovieAPIView(APIView):
+# Catalog views are async (ASGI): the GETs use the async ORM, writes are rare so they keep their sync code in a thread (sync_handler)
+class MovieAPIView(AsyncAPIView):
     permission_classes = [IsManagerOrReadonly]
 
-    def get(self, request):
-        movies = Movie.objects.all() # this is like: SELECT * FROM Movie and turn into obj
+    async def get(self, request):
+        paginator = MoviePagination()
+        movies = await apaginate(paginator, Movie.objects.all(), request, self) # this is like: SELECT * FROM Movie ... LIMIT n and turn into obj
         serializer = MovieSerializer(movies, many=True) # return Queryset (list of many models rows) to JSON
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
 
+    @sync_handler
     def post(self, request):
         serializer = MovieSerializer(data = request.data) # JSON to Model
         serializer.is_valid(raise_exception=True)
@@ -48,14 +62,15 @@ class MovieAPIView(APIView):
     patch=extend_schema(summary="Updates an existing movie", request=MovieSerializer, responses={200: MovieResponseSerializer}),
     delete=extend_schema(summary="Deletes a movie by ID",responses={200: MessageSerializer})
 )
-class MovieItemAPIView(APIView):
+class MovieItemAPIView(AsyncAPIView):
     permission_classes = [IsManagerOrReadonly] # anyone can GET, and only logged-in admin can POST, PATCH, DELETE
 
-    def get(self, request, pk):
-        movie = get_object_or_404(Movie, pk=pk) 
+    async def get(self, request, pk):
+        movie = await aget_object_or_404(Movie, pk=pk) 
         serializer = MovieSerializer(movie) # no need `many=True` bcoz return single obj (Model to JSON)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @sync_handler
     def patch(self, request, pk):
         movie = get_object_or_404(Movie, pk=pk)
         serializer = MovieSerializer(movie, data = request.data, partial=True) # enable PATCH (update some instead all)
@@ -73,6 +88,7 @@ class MovieItemAPIView(APIView):
             "movie": MovieSerializer(updated_movie).data
         }, status=status.HTTP_200_OK) # patch return OK, not 201
 
+    @sync_handler
     def delete(self, request, pk):
         movie = get_object_or_404(Movie, pk=pk)
         movie.delete()
@@ -84,14 +100,15 @@ class MovieItemAPIView(APIView):
     get=extend_schema(summary="List all Halls", responses={200: HallReadSerializer(many=True)}),
     post=extend_schema(summary="Adds a New Hall", request=HallWriteSerializer, responses={201: HallResponseSerializer})
 )
-class HallAPIView(APIView):
+class HallAPIView(AsyncAPIView):
     permission_classes = [IsManagerOrReadonly]
 
-    def get(self, request):
-        halls = Hall.objects.all()
+    async def get(self, request):
+        halls = [hall async for hall in Hall.objects.all()]
         serializer = HallReadSerializer(halls, many=True) 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(await serialize(serializer), status=status.HTTP_200_OK) # seat counts are columns of the hall, no extra query
         
+    @sync_handler
     def post(self, request):
         serializer = HallWriteSerializer(data = request.data)
         serializer.is_valid(raise_exception=True)
@@ -113,14 +130,15 @@ class HallAPIView(APIView):
     patch=extend_schema(summary="Updates an existing Hall by ID", request=HallWriteSerializer, responses={200: HallResponseSerializer}),
     delete=extend_schema(summary="Deletes a Hall by ID", responses={200: MessageSerializer})
 )
-class HallItemAPIView(APIView):
+class HallItemAPIView(AsyncAPIView):
     permission_classes = [IsManagerOrReadonly]
 
-    def get(self, request, pk):
-        hall = get_object_or_404(Hall, pk=pk)
+    async def get(self, request, pk):
+        hall = await aget_object_or_404(Hall, pk=pk)
         serializer = HallReadSerializer(hall)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(await serialize(serializer), status=status.HTTP_200_OK)
 
+    @sync_handler
     def patch(self, request, pk):
         hall = get_object_or_404(Hall, pk=pk) # this is like: SELECT * FROM Hall WHERE id=pk from db
         serializer = HallWriteSerializer(hall, data=request.data, partial=True)
@@ -137,6 +155,7 @@ class HallItemAPIView(APIView):
             "hall": HallReadSerializer(updated_hall).data
         }, status=status.HTTP_200_OK)
     
+    @sync_handler
     def delete(self, request, pk):
         hall = get_object_or_404(Hall, pk=pk)
         hall.delete()
@@ -145,19 +164,22 @@ class HallItemAPIView(APIView):
 
 
 @extend_schema_view(
-    get=extend_schema(summary="List all Showtimes",responses={200: ShowtimeReadListSerializer(many=True)}),
+    get=extend_schema(summary="List all Showtimes",responses={200: paginated(ShowtimeReadListSerializer)}, parameters=PAGINATION_PARAMETERS),
     post=extend_schema(summary="Adds a New Showtime", request=ShowtimeWriteSerializer, responses={201: ShowtimeResponseSerializer})
 )
-class ShowtimeAPIView(APIView):
+class ShowtimeAPIView(AsyncAPIView):
     permission_classes = [IsManagerOrReadonly]
 
     # Trip out: Get list of showtimes
-    def get(self, request):
-        showtimes = Showtime.objects.all()
+    async def get(self, request):
+        # movie_info/hall_info read these 2 relations, so they come in the same query (no lazy loading inside the event loop)
+        paginator = ShowtimePagination() # ordered by start_at, the next screenings first
+        showtimes = await apaginate(paginator, Showtime.objects.select_related("movie", "hall"), request, self)
         serializer = ShowtimeReadListSerializer(showtimes, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
         
     # Trip in: Create new showtimes
+    @sync_handler
     def post(self, request):
         # 1.check format (serializer)
         serializer = ShowtimeWriteSerializer(data = request.data) #takes raw material(JSON) from user and holds
@@ -168,6 +190,7 @@ class ShowtimeAPIView(APIView):
             hall=serializer.validated_data.get("hall"),
             start_at=serializer.validated_data.get("start_at"),
             price=serializer.validated_data.get("price"),
+            queue_enabled=serializer.validated_data.get("queue_enabled"),
         )
         return Response({
             "message": "New Showtime added",
@@ -180,14 +203,15 @@ class ShowtimeAPIView(APIView):
     patch=extend_schema(summary="Updates an existing Showtime by ID", request=ShowtimeWriteSerializer, responses={200: ShowtimeResponseSerializer}),
     delete=extend_schema(summary="Deletes a Showtime by ID", responses={200: MessageSerializer})
 )
-class ShowtimeItemAPIView(APIView):
+class ShowtimeItemAPIView(AsyncAPIView):
     permission_classes = [IsManagerOrReadonly]
 
-    def get(self, request, pk):
-        showtime = get_object_or_404(Showtime, pk=pk)
+    async def get(self, request, pk):
+        showtime = await aget_object_or_404(Showtime.objects.select_related("movie", "hall"), pk=pk)
         serializer = ShowtimeReadItemSerializer(showtime)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(await serialize(serializer), status=status.HTTP_200_OK)
     
+    @sync_handler
     def patch(self, request, pk):
         showtime = get_object_or_404(Showtime, pk=pk)
         serializer = ShowtimeWriteSerializer(showtime, data=request.data, partial=True)
@@ -198,12 +222,14 @@ class ShowtimeItemAPIView(APIView):
             hall=serializer.validated_data.get("hall"),
             start_at=serializer.validated_data.get("start_at"),
             price=serializer.validated_data.get("price"),
+            queue_enabled=serializer.validated_data.get("queue_enabled"),
         )
         return Response({
             "message": "Showtime updated",
             "showtime": ShowtimeReadItemSerializer(updated_showtime).data
         }, status=status.HTTP_200_OK)
     
+    @sync_handler
     def delete(self, request, pk):
         showtime = get_object_or_404(Showtime, pk=pk)
         showtime.delete()
@@ -211,6 +237,115 @@ class ShowtimeItemAPIView(APIView):
 
 
 
+class ShowtimeSeatMapAPIView(AsyncAPIView): # async: the hot poll of a busy on-sale
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        summary="Compact seat map of a showtime (1 letter per seat, row-major), or only the seats changed since a version",
+        description="Send `?since=<version>` (or `If-None-Match` with the last ETag): 304 if nothing changed, else only the changed seats. "
+                    "A full map comes back when the version is too old to answer with a delta.",
+        parameters=[OpenApiParameter("since", int, description="`version` of the map the client already has")],
+    )
+    async def get(self, request, pk):
+        since = request.query_params.get("since") or request.headers.get("If-None-Match", "").strip('W/"')
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            return Response({"error": "`since` must be a version number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # nothing changed: answered from 1 Redis GET, no query at all
+        if since is not None and since == await SeatMap.aversion(pk):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{since}"'})
+
+        showtime = await aget_object_or_404(Showtime.objects.select_related("hall"), pk=pk)
+        seat_map = await ScreeningAnalytic.acompact_seat_map(showtime, since)
+        return Response(seat_map, status=status.HTTP_200_OK, headers={"ETag": f'"{seat_map["version"]}"'})
+
+
+class ShowtimeSeatStreamAPIView(AsyncAPIView): # async: 1 idle coroutine per watching client, no thread
+    permission_classes = [AllowAny]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    @extend_schema(
+        summary="Live seat map of a showtime (Server-Sent Events)",
+        description="Starts with the same payload as `GET /showtimes/<id>/seats` (full map, or a delta with `?since` / `Last-Event-ID`), "
+                    "then 1 `seats` event with the changed seats (`since`, `version`, `changes`) for every hold, release, sale or broken seat. "
+                    "The event `id` is the map version, so a reconnecting browser resumes where it stopped.",
+        parameters=[OpenApiParameter("since", int, description="`version` of the map the client already has")],
+        responses={(200, "text/event-stream"): str},
+    )
+    async def get(self, request, pk):
+        since = request.query_params.get("since") or request.headers.get("Last-Event-ID")
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            return Response({"error": "`since` must be a version number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        showtime = await aget_object_or_404(Showtime.objects.select_related("hall"), pk=pk)
+        response = StreamingHttpResponse(seat_events(showtime, since), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no" # nginx: send each event right away
+        return response
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Planning: which halls are free for a movie at a time, and the earliest start that fits in each hall",
+        parameters=[
+            OpenApiParameter("movie", int, required=True),
+            OpenApiParameter("start_at", str, required=True, description="ISO datetime"),
+        ],
+        responses={200: HallAvailabilitySerializer(many=True)},
+    )
+)
+class ShowtimeAvailabilityAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request):
+        serializer = HallAvailabilityQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start_time = serializer.validated_data["start_at"]
+        end_time = start_time + timedelta(minutes=serializer.validated_data["movie"].duration + 30) # same buffer as save_showtime
+        halls = ShowtimeService.hall_availability(start_time, end_time)
+        return Response(HallAvailabilitySerializer(halls, many=True).data, status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    post=extend_schema(
+        summary="Schedules many showtimes at once (JSON list or CSV: movie,hall,start_at,price[,queue_enabled])",
+        description="All or nothing: any overlap (inside the file or with the saved schedule) and nothing is created. `?report=true` only lists the conflicts.",
+        request=ShowtimeImportRowSerializer(many=True),
+        responses={201: ScheduleImportResponseSerializer, 200: ScheduleImportResponseSerializer, 400: ScheduleImportResponseSerializer},
+    )
+)
+class ShowtimeImportAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsManager]
+    parser_classes = [JSONParser, CSVParser]
+
+    def post(self, request):
+        serializer = ShowtimeImportRowSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        report = request.query_params.get("report", "").lower() in ("1", "true", "yes")
+        showtimes, conflicts = ShowtimeService.import_schedule(serializer.validated_data, report=report)
+
+        if report:
+            return Response({
+                "message": f"{len(conflicts)} conflict(s) in {len(serializer.validated_data)} row(s)",
+                "showtimes": [],
+                "conflicts": conflicts,
+            }, status=status.HTTP_200_OK)
+        if conflicts:
+            return Response({
+                "error": f"{len(conflicts)} conflict(s), nothing was scheduled",
+                "conflicts": conflicts,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "message": f"{len(showtimes)} showtimes added",
+            "showtimes": ShowtimeReadListSerializer(showtimes, many=True).data, # movie/hall are already on the objects, no extra query
+            "conflicts": [],
+        }, status=status.HTTP_201_CREATED)
+
+
 @extend_schema_view(
     get=extend_schema(summary="Retrieve the details of a specific seat by ID", responses={200: SeatSerializer}),
     patch=extend_schema(summary="To mark if a certain seat is broken", request=SeatSerializer, responses={200: SeatResponseSerializer}),
@@ -251,15 +386,28 @@ class TopMoviesAPIView(APIView):
 
 class ShowtimeOccupancyListAPIView(APIView):
     permission_classes = [IsAuthenticated, IsManager]
-    @extend_schema(summary="Showing Real-time upcoming Showtime(alongside movie and hall info)")
+    @extend_schema(
+        summary="Showing Real-time upcoming Showtime(alongside movie and hall info)",
+        parameters=[OccupancyQuerySerializer, *PAGINATION_PARAMETERS],
+        responses={200: paginated(ShowtimeOccupancySerializer)},
+    )
     def get(self, request):
-        list_showtimes = ScreeningAnalytic.showtime_occupancy()
-        return Response(list_showtimes, status=status.HTTP_200_OK)
+        filters = OccupancyQuerySerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        # same URL (filters + cursor) = same page, served from Redis until a booking is confirmed/cancelled or OCCUPANCY_CACHE_TTL passes
+        version, page = OccupancyCache.get(request.get_full_path())
+        if page is None:
+            paginator = OccupancyPagination()
+            showtimes = paginator.paginate_queryset(ScreeningAnalytic.showtime_occupancy(**filters.validated_data), request, view=self)
+            page = paginator.get_paginated_response(ShowtimeOccupancySerializer(showtimes, many=True).data).data
+            OccupancyCache.set(version, request.get_full_path(), page)
+        return Response(page, status=status.HTTP_200_OK)
     
-class ShowtimeOccupancyDetailAPIView(APIView):
+class ShowtimeOccupancyDetailAPIView(AsyncAPIView): # async: staff keep this seat map open and refresh it during on-sales
     permission_classes = [IsAuthenticated, IsManager]
     @extend_schema(summary="Showing seats layout detail by clicking one of listed showtimes report")
-    def get(self, request, pk):
-        selected_showtime = ScreeningAnalytic.hall_seats_layout(showtime_id=pk)
+    async def get(self, request, pk):
+        selected_showtime = await ScreeningAnalytic.ahall_seats_layout(showtime_id=pk)
         return Response(selected_showtime, status=status.HTTP_200_OK)
 